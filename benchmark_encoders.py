@@ -0,0 +1,90 @@
+"""
+Compares the preview encoder profiles (see ENCODER_PROFILES in utils/config.py
+and mtv_settings.cfg) on one recording, to help choose PREVIEW_ENCODER.
+
+    python benchmark_encoders.py RECORDING [--seconds 60] [--start 300] [--profiles vp8,h264]
+
+Each profile encodes the same stretch of the recording, one after another,
+with the same converter arguments a preview would get. For each, it reports:
+    * speed - seconds of preview encoded per second of wall time
+    * CPU seconds - user + system time of the converter, on all cores
+    * output size, and what that comes to per minute of preview
+Nothing is written to VIDEO_SAMPLES_DIR; outputs go in a temporary directory.
+"""
+import argparse
+import os
+import os.path
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from utils.config import get_config
+from utils.conversion_progress import format_seconds
+
+
+def benchmark_profile(config, name, recording, start, seconds, outdir):
+    """
+    Encodes seconds of recording, from start, with the named encoder profile.
+    Return: dict with profile, returncode, wall and cpu seconds, speed,
+    output size in bytes and the converter's error output
+    """
+    ext, args = config.encoder_profile(name)
+    outfilespec = os.path.join(outdir, 'benchmark-{}.{}'.format(name, ext))
+    cmd = [ config.vidconverter, '-loglevel', '16', '-y',
+            '-ss', str(start), '-i', recording ] + args + [ '-t', str(seconds), outfilespec ]
+    # Children's rusage only counts processes that have been waited for,
+    # and the converters run one at a time, so the difference is this one's.
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.time()
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    wall = time.time() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    size = os.path.getsize(outfilespec) if os.path.exists(outfilespec) else 0
+    return { 'profile': name, 'returncode': proc.returncode, 'wall': wall, 'cpu': cpu,
+             'speed': seconds / wall if wall > 0 else 0.0, 'size': size,
+             'stderr': proc.stderr.decode('utf-8', 'replace').strip() }
+
+
+def main(argv=None):
+    config = get_config()
+    parser = argparse.ArgumentParser(description='Compare preview encoder profiles on one recording.')
+    parser.add_argument('recording', help='recording file to encode from')
+    parser.add_argument('--seconds', type=int, default=60, help='seconds of preview to encode (default 60)')
+    parser.add_argument('--start', type=int, default=0, help='offset into the recording, in seconds (default 0)')
+    parser.add_argument('--profiles', help='comma-separated profile names (default: all of them)')
+    opts = parser.parse_args(argv)
+
+    names = opts.profiles.split(',') if opts.profiles else sorted(config.encoder_profiles)
+    unknown = [ n for n in names if n not in config.encoder_profiles ]
+    if unknown:
+        parser.error('no such profile: {} (have {})'.format(', '.join(unknown), ', '.join(sorted(config.encoder_profiles))))
+    if not os.path.exists(opts.recording):
+        parser.error('no such file: {}'.format(opts.recording))
+
+    print("Encoding {} of {} from {}, with {}...".format(format_seconds(opts.seconds), opts.recording,
+                                                         format_seconds(opts.start), config.vidconverter))
+    results = []
+    with tempfile.TemporaryDirectory(prefix='mtv-benchmark-') as outdir:
+        for name in names:
+            print("\t{}...".format(name))
+            results.append(benchmark_profile(config, name, opts.recording, opts.start, opts.seconds, outdir))
+
+    print("\n{:<12} {:>8} {:>9} {:>9} {:>10} {:>10}".format('Profile', 'Speed', 'Wall s', 'CPU s', 'Size MB', 'MB/min'))
+    failures = 0
+    for r in results:
+        if r['returncode'] != 0:
+            failures += 1
+            print("{:<12} failed ({}): {}".format(r['profile'], r['returncode'], (r['stderr'].splitlines() or [ '' ])[-1]))
+            continue
+        mb = r['size'] / (1024 * 1024)
+        print("{:<12} {:>7.1f}x {:>9.1f} {:>9.1f} {:>10.1f} {:>10.1f}".format(
+            r['profile'], r['speed'], r['wall'], r['cpu'], mb, mb * 60 / opts.seconds))
+    print("\nPREVIEW_ENCODER is currently '{}'.".format(config.preview_encoder))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,18 +11,15 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os.path
-import configparser
+
+from utils.config import get_config
 
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# Read configuration...
-config_file = os.path.join(BASE_DIR, 'mtv_settings.cfg')
-cfg = configparser.SafeConfigParser(interpolation=None)
-config_files_read = cfg.read(config_file)
-if len(config_files_read) == 0:
-    raise Exception('Could not find config file {}'.format(config_file))
+# Read configuration (see utils/config.py)...
+config = get_config()
 
 
 
@@ -34,10 +31,10 @@ if len(config_files_read) == 0:
 # See https://docs.djangoproject.com/en/1.9/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = cfg['SECURITY'].get('SECRET_KEY')
+SECRET_KEY = config.secret_key
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = cfg['DEVEL'].getboolean('DEBUG')
+DEBUG = config.debug
 
 ALLOWED_HOSTS = []
 
@@ -97,15 +94,15 @@ WSGI_APPLICATION = 'myth_to_vid.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': cfg['DB'].get('DEFAULT_DB_ENGINE'),
-        'NAME': os.path.join(BASE_DIR, cfg['DB'].get('DEFAULT_DB_NAME')),
+        'ENGINE': config.default_db_engine,
+        'NAME': config.default_db_name,
     },
     'mythtv': {
-        'ENGINE': cfg['DB'].get('MYTH_DB_ENGINE'),
-        'NAME' : cfg['DB'].get('MYTH_DB_NAME'),
-        'HOST' : cfg['DB'].get('MYTH_DB_HOST'),
-        'USER' : cfg['DB'].get('MYTH_DB_USER'),
-        'PASSWORD': cfg['DB'].get('MYTH_DB_PASSWORD'),
+        'ENGINE': config.myth_db_engine,
+        'NAME' : config.myth_db_name,
+        'HOST' : config.myth_db_host,
+        'USER' : config.myth_db_user,
+        'PASSWORD': config.myth_db_password,
     },
 }
 
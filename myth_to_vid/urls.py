@@ -21,6 +21,7 @@ from django.contrib import admin
 
 urlpatterns = [
     url(r'^orphans/', include('orphans.urls', namespace='orphans')),
+    url(r'^mythvideos/', include('mythvideos.urls', namespace='mythvideos')),
     url(r'^admin/', include(admin.site.urls)),
 ]
 
@@ -1,16 +1,19 @@
-import configparser
 import datetime
 import iso8601
 import os
 import os.path
+import shlex
 import socket
-import shutil
 
 from django.conf import settings
 
 from mythvideos.models import MythVideo
 from orphans.models import Orphan
+from utils.config import get_config
+from utils.filemove import place_file, place_remote_file, transfer_file, STRATEGY_RENAME
+from utils.general import remove_remote_file, run_remote_command
 from utils.myth import MythApi
+from utils.sample_cache import remove_previews_for
 
 
 """
@@ -21,6 +24,7 @@ types of entities.
 class MythVideoService(object):
     def __init__(self):
         self.api = MythApi()
+        self.transfers = [] # one dict per file placed, as returned by place_file
     
     def activate_video(self, data={}):
         """
@@ -94,33 +98,66 @@ class MythVideoService(object):
             
         
             
-    def new_video_from_orphan(self, orphan, target_host=None, delete_orphan=False):
+    def new_video_from_orphan(self, orphan, target_host=None, delete_orphan=False, progress=None):
         """
         1. Figures out where to put file based on orphan's title and subtitle -
             creates appropriate subdirectory under target host's top-level
             video directory, if that subdirectory doesn't already exist.
-        2. Copies orphan's file to destination subdirectory
+        2. Copies orphan's file to destination subdirectory - see
+            utils.filemove.place_file. If delete_orphan == True and the
+            source and destination are on the same filesystem, the file
+            is simply renamed; otherwise it is reflinked where the filesystem
+            allows, or copied. A copy is checksummed as it is written, and
+            read back and checked if COPY_VERIFY is set in the config;
+            progress, if given, is called with its CopyProgress as it goes
+            (see utils.filemove.copy_file - running copies can also be
+            polled at /mythvideos/transfers/).
+            If the orphan's file and target_host are both on one other host,
+            the move or copy happens there - see
+            utils.filemove.place_remote_file.
+            If the orphan's file and target_host are on different hosts,
+            the file is sent over SFTP instead - see
+            utils.filemove.transfer_file. An interrupted transfer resumes
+            where it left off the next time, and the file's size and
+            checksum on the target host are checked before it is activated.
+            The strategy used, the time it took and the throughput are
+            printed and appended to self.transfers.
         3. Calls activate_video()
         4. If all above was successful and delete_orphan == True, delete the
             orphan's disk file and the Orphan ORM instance.
         """
         # Step 1: Derive source and target. Create target directory, if needed.
-        api = MythApi()
+        api = self.api
         if target_host is None:
             target_host = api.server_name
-        if target_host != socket.gethostname():
-            raise Exception("Sorry - cross-host file moves not yet implemented.")
+        source_host = orphan.hostname or api.server_name
+        local_host = socket.gethostname()
+        same_host = source_host == local_host and target_host == local_host
         
         if orphan.title is None or orphan.title == '':
             raise Exception("You must supply a title for the orphaned recording.")
-        target_top_level_dir = api.videos_directory
+        target_top_level_dir = api.storage_dir_for_name('Videos', target_host)
+        if target_top_level_dir is None:
+            raise Exception("Host {} has no Videos storage group.".format(target_host))
         target_subdir = orphan.title.replace(' ','_')
-        source_dir = api.default_directory
+        source_dir = orphan.directory or api.default_directory
         source_filespec = os.path.join(source_dir,orphan.filename)
         target_directory = os.path.join(target_top_level_dir, target_subdir)
-        os.makedirs(target_directory, exist_ok=True)
-        # Step 2: Copy file
-        shutil.copy2(source_filespec, target_directory, follow_symlinks=True)
+        # Step 2: Copy (or move) file
+        if same_host:
+            source_filespec = os.path.realpath(source_filespec)
+            os.makedirs(target_directory, exist_ok=True)
+            transfer = place_file(source_filespec, target_directory, allow_rename=delete_orphan,
+                                  verify=get_config().copy_verify, progress=progress)
+        elif source_host == target_host:
+            transfer = place_remote_file(source_host, source_filespec, target_directory,
+                                         allow_rename=delete_orphan)
+        else:
+            transfer = transfer_file(source_host, source_filespec, target_host, target_directory,
+                                     progress=progress)
+        self.transfers.append(transfer)
+        print("{}: {} in {:.2f} seconds ({:.1f} MB/s)".format(orphan.filename, transfer['strategy'],
+              transfer['seconds'], transfer['bytes_per_second'] / 1000000))
         # Step 3: Call MythTV API to add video
         # Construct data dict to pass to activate_video:
         target_filepath = os.path.join(target_subdir, orphan.filename)
@@ -132,10 +169,25 @@ class MythVideoService(object):
                 'releasedate': orphan.start_date,
                 'length': orphan.duration, # this value is an integer, in minutes
                 }
-        v = self.activate_video(data)
+        try:
+            v = self.activate_video(data)
+        except Exception:
+            if transfer['strategy'] == STRATEGY_RENAME: # put it back
+                if same_host:
+                    os.rename(transfer['target'], source_filespec)
+                else:
+                    run_remote_command(source_host, 'mv -- {} {}'.format(
+                        shlex.quote(transfer['target']), shlex.quote(source_filespec)))
+            raise
         # Step 6: Delete orphan, if desired, but only if activation went OK
         if delete_orphan and v is not None:
-            os.remove(source_filespec)
+            if transfer['strategy'] == STRATEGY_RENAME:
+                pass # already gone from its old place
+            elif source_host == local_host:
+                os.remove(source_filespec)
+            else:
+                remove_remote_file(source_host, source_filespec)
+            remove_previews_for([ orphan.intid ])
             orphan.delete()
         return v
         
@@ -0,0 +1,6 @@
+from django.conf.urls import url
+from mythvideos.views import TransferStatusView
+
+urlpatterns = [
+    url(r'^transfers/$', TransferStatusView.as_view(), name='TransferStatusView'),
+]
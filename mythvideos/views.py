@@ -1,3 +1,13 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.views.generic import View
 
-# Create your views here.
+from utils.filemove import transfers
+
+
+class TransferStatusView(View):
+    """
+    Progress of the file copies running in this process (and the last
+    few to finish), as JSON, for a page to poll during long moves.
+    """
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({ 'transfers': transfers() })
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orphans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orphan',
+            name='mtime',
+            field=models.FloatField(blank=True, default=0),
+        ),
+    ]
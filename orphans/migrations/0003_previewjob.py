@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orphans', '0002_orphan_mtime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreviewJob',
+            fields=[
+                ('intid', models.AutoField(primary_key=True, serialize=False)),
+                ('sample_name', models.CharField(max_length=64, unique=True)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.SmallIntegerField(default=0)),
+                ('queued', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('output_size', models.BigIntegerField(blank=True, default=0)),
+                ('message', models.TextField(blank=True, default='')),
+                ('orphan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='preview_jobs', to='orphans.Orphan')),
+            ],
+            options={
+                'db_table': 'previewjobs',
+                'managed': True,
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_sprite_profiles(apps, schema_editor):
+    # Jobs made before the profile column existed were all video samples,
+    # except for sprite sheets, which can be told apart by name.
+    PreviewJob = apps.get_model('orphans', 'PreviewJob')
+    PreviewJob.objects.filter(sample_name__contains='.sprite.').update(profile='sprite')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orphans', '0003_previewjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='previewjob',
+            name='profile',
+            field=models.CharField(default='video', max_length=16),
+        ),
+        migrations.AlterIndexTogether(
+            name='previewjob',
+            index_together=set([('profile', 'state')]),
+        ),
+        migrations.RunPython(set_sprite_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orphans', '0004_previewjob_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='previewjob',
+            name='target_seconds',
+            field=models.FloatField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='previewjob',
+            name='position',
+            field=models.FloatField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='previewjob',
+            name='fps',
+            field=models.FloatField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='previewjob',
+            name='speed',
+            field=models.FloatField(blank=True, default=0),
+        ),
+    ]
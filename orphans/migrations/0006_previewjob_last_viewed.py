@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orphans', '0005_previewjob_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='previewjob',
+            name='last_viewed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='previewjob',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('evicted', 'Evicted')], db_index=True, default='pending', max_length=10),
+        ),
+    ]
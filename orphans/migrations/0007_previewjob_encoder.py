@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_theora_encoders(apps, schema_editor):
+    # Every video and clips sample made before encoder profiles was Theora.
+    PreviewJob = apps.get_model('orphans', 'PreviewJob')
+    PreviewJob.objects.exclude(profile='sprite').update(encoder='theora')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orphans', '0006_previewjob_last_viewed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='previewjob',
+            name='encoder',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(set_theora_encoders, migrations.RunPython.noop),
+    ]
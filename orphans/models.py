@@ -3,6 +3,8 @@ import os.path
 from django.core.urlresolvers import reverse
 from django.db import models
 
+from utils.config import get_config
+
 # Create your models here.
 
 class Orphan(models.Model):
@@ -19,11 +21,19 @@ class Orphan(models.Model):
     channel_id = models.CharField(max_length=4)
     channel_number = models.SmallIntegerField()
     channel_name = models.CharField(max_length=256)
+    mtime = models.FloatField(blank=True, default=0) # file's modification time, seconds since epoch
     
      
     @property
-    def samplename(self): #"Calculated" field -- name of sample file
-        return os.path.splitext(self.filename)[0] + '.ogv'
+    def samplename(self): #"Calculated" field -- name a sample made with PREVIEW_ENCODER would have
+        return os.path.splitext(self.filename)[0] + '.' + get_config().encoder_profile()[0]
+    @property
+    def preview_name(self): # name of the most recently finished video or clips sample, or None
+        return self.preview_jobs.filter(state=PreviewJob.DONE).exclude(profile='sprite') \
+                   .order_by('-finished').values_list('sample_name', flat=True).first()
+    @property
+    def spritename(self): #"Calculated" field -- name of sprite sheet of stills
+        return os.path.splitext(self.filename)[0] + '.sprite.' + get_config().sprite_format
     @classmethod
     def db_name(cls):
         return 'default'
@@ -39,3 +49,87 @@ class Orphan(models.Model):
         # validation and at the database level. If an attempt is made to save a model item which violates
         # this contraint, a django.db.IntegrityError will be raised.
         unique_together = ('hostname', 'filename')
+
+
+class PreviewJob(models.Model):
+    """
+    One preview conversion for an Orphan, as run by
+    utils.myth.VideoSampleMaker. Kept in the database so that an
+    interrupted run can pick up where it left off: 'done' jobs are
+    not redone, 'running' jobs left over from a dead run go back to
+    'pending', and 'failed' jobs are retried until they reach the
+    configured maximum number of attempts.
+    
+    The table is also the manifest of the previews on disk: a 'done'
+    job's sample_name, output_size, profile and finished time describe
+    a file in VIDEO_SAMPLES_DIR, so working out which orphans still
+    need previews takes a query rather than a stat per orphan.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    EVICTED = 'evicted' # made, then removed to keep under SAMPLES_QUOTA_MB
+    STATE_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (EVICTED, 'Evicted'),
+    )
+    intid = models.AutoField(primary_key=True)
+    orphan = models.ForeignKey(Orphan, on_delete=models.CASCADE, related_name='preview_jobs')
+    sample_name = models.CharField(max_length=64, unique=True) # output file, in VIDEO_SAMPLES_DIR
+    profile = models.CharField(max_length=16, default='video') # preview mode that made it - see VideoSampleMaker.MODES
+    encoder = models.CharField(max_length=32, blank=True, default='') # encoder profile used, for video and clips
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=PENDING, db_index=True)
+    attempts = models.SmallIntegerField(default=0)
+    queued = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    output_size = models.BigIntegerField(blank=True, default=0)
+    message = models.TextField(blank=True, default='')
+    # Progress of a running conversion, from ffmpeg's -progress output:
+    target_seconds = models.FloatField(blank=True, default=0) # seconds of output expected, 0 if unknown
+    position = models.FloatField(blank=True, default=0) # seconds of output written so far
+    fps = models.FloatField(blank=True, default=0)
+    speed = models.FloatField(blank=True, default=0) # seconds of output per second of wall time
+    last_viewed = models.DateTimeField(blank=True, null=True, db_index=True) # see utils.sample_cache
+
+    @classmethod
+    def db_name(cls):
+        return 'default'
+
+    @property
+    def elapsed(self):
+        """
+        Seconds the last attempt took, or None if it hasn't finished.
+        """
+        if self.started is None or self.finished is None:
+            return None
+        return (self.finished - self.started).total_seconds()
+
+    @property
+    def eta(self):
+        """
+        Seconds until a running conversion finishes, at its current
+        speed, or None if that can't be told.
+        """
+        if self.state != self.RUNNING or self.speed <= 0 or self.target_seconds <= 0:
+            return None
+        return max(0.0, self.target_seconds - self.position) / self.speed
+
+    @property
+    def percent(self):
+        if self.target_seconds <= 0:
+            return None
+        return min(100.0, 100.0 * self.position / self.target_seconds)
+
+    @property
+    def path(self):
+        return os.path.join(get_config().video_samples_dir, self.sample_name)
+
+    class Meta:
+        managed = True
+        db_table = 'previewjobs'
+        index_together = [ ('profile', 'state') ]
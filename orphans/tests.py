@@ -1,3 +1,151 @@
+import datetime
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import mock
+
 from django.test import TestCase
 
+from orphans.models import Orphan
+from utils.myth import bulk_insert_orphans, refresh_orphans_list
+
 # Create your tests here.
+
+HOST = 'mythbox'
+
+def make_orphan(filename, hostname=HOST, directory='/var/lib/mythtv/recordings', **kwargs):
+    """
+    Return: an unsaved Orphan, with just enough filled in to be saved
+    """
+    fields = dict(hostname=hostname, directory=directory, filename=filename,
+                  start_date=datetime.date(2015, 11, 22), start_time=datetime.time(18, 0, 3),
+                  channel_id='1008', channel_number=8, channel_name='WXYZ')
+    fields.update(kwargs)
+    return Orphan(**fields)
+
+
+class FakeChannels(object):
+    def prefetch(self, channel_ids):
+        list(channel_ids)
+
+    def get(self, channel_id):
+        return { 'ChannelName': 'Channel {}'.format(channel_id), 'ChanNum': int(channel_id) % 100 }
+
+
+class FakeMythApi(object):
+    """
+    Stands in for utils.myth.MythApi: a backend whose recordings are
+    the file names in 'recorded'.
+    """
+    server_name = HOST
+
+    def __init__(self, recorded=()):
+        self.recorded = set(recorded)
+        self.channels = FakeChannels()
+
+    def is_tv_recording(self, filename, hostname=None):
+        return filename in self.recorded
+
+
+class BulkInsertOrphansTest(TestCase):
+
+    def test_inserts_all_new_orphans(self):
+        orphans = [ make_orphan('1008_2015112218{:04d}.mpg'.format(i)) for i in range(7) ]
+        self.assertEqual(bulk_insert_orphans(orphans, batch_size=3), 7)
+        self.assertEqual(Orphan.objects.count(), 7)
+
+    def test_skips_orphans_already_in_table(self):
+        make_orphan('1008_20151122180003.mpg', title='Kept').save()
+        orphans = [ make_orphan('1008_20151122180003.mpg'), make_orphan('1008_20151122190003.mpg') ]
+        self.assertEqual(bulk_insert_orphans(orphans), 1)
+        self.assertEqual(Orphan.objects.count(), 2)
+        self.assertEqual(Orphan.objects.get(filename='1008_20151122180003.mpg').title, 'Kept')
+
+    def test_skips_duplicates_within_list(self):
+        orphans = [ make_orphan('1008_20151122180003.mpg'), make_orphan('1008_20151122180003.mpg'),
+                    make_orphan('1008_20151122180003.mpg', hostname='otherbox') ]
+        self.assertEqual(bulk_insert_orphans(orphans), 2)
+        self.assertEqual(Orphan.objects.count(), 2)
+
+    def test_falls_back_to_row_by_row_on_conflict(self):
+        # A row inserted by someone else after the existing keys were read
+        make_orphan('1008_20151122180003.mpg', title='Theirs').save()
+        orphans = [ make_orphan('1008_2015112218{:04d}.mpg'.format(i)) for i in range(3) ] + \
+                  [ make_orphan('1008_20151122180003.mpg') ]
+        with mock.patch.object(Orphan.objects, 'values_list', return_value=[]):
+            inserted = bulk_insert_orphans(orphans, batch_size=10)
+        self.assertEqual(inserted, 3)
+        self.assertEqual(Orphan.objects.count(), 4)
+        self.assertEqual(Orphan.objects.get(filename='1008_20151122180003.mpg').title, 'Theirs')
+
+
+class RefreshOrphansListTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write_file(self, filename, size):
+        filespec = os.path.join(self.dir, filename)
+        with open(filespec, 'wb') as f:
+            f.write(b'\0' * size)
+        return os.stat(filespec)
+
+    def save_orphan(self, filename, st=None, **kwargs):
+        o = make_orphan(filename, directory=self.dir, **kwargs)
+        if st is not None:
+            o.filesize = st.st_size
+            o.mtime = st.st_mtime
+        o.save()
+        return o
+
+    def refresh(self, api):
+        with mock.patch('utils.myth.MythApi', return_value=api):
+            return refresh_orphans_list(from_dir=self.dir, filename_pattern='*.mpg', remote=False)
+
+    def test_counts_each_kind_of_change(self):
+        st = self.write_file('1008_20151122180003.mpg', 100)
+        self.save_orphan('1008_20151122180003.mpg', st, title='Unchanged title')
+        st = self.write_file('1008_20151122190003.mpg', 100)
+        self.save_orphan('1008_20151122190003.mpg', st, title='Grown', subtitle='Part 1')
+        self.write_file('1008_20151122190003.mpg', 250)
+        self.save_orphan('1008_20151122200003.mpg', title='Deleted from disk')
+        st = self.write_file('1008_20151122210003.mpg', 100)
+        self.save_orphan('1008_20151122210003.mpg', st)
+        self.write_file('1008_20151122220003.mpg', 100) # new
+        self.write_file('1008_20151122230003.mpg', 100) # new, but a recording
+        self.write_file('notes.mpg', 10) # not a MythTV name
+        self.write_file('.1008_20151122220003.mpg', 10) # hidden
+
+        counts = self.refresh(FakeMythApi(recorded=[ '1008_20151122210003.mpg', '1008_20151122230003.mpg' ]))
+
+        self.assertEqual(counts, { 'inserted': 1, 'updated': 1, 'unchanged': 1,
+                                   'deleted_missing': 1, 'deleted_recorded': 1, 'skipped': 1 })
+        self.assertEqual(sorted(Orphan.objects.values_list('filename', flat=True)),
+                         [ '1008_20151122180003.mpg', '1008_20151122190003.mpg', '1008_20151122220003.mpg' ])
+        grown = Orphan.objects.get(filename='1008_20151122190003.mpg')
+        self.assertEqual(grown.filesize, 250)
+        self.assertEqual(grown.channel_name, 'WXYZ')
+
+    def test_keeps_user_entered_titles(self):
+        st = self.write_file('1008_20151122180003.mpg', 100)
+        self.save_orphan('1008_20151122180003.mpg', st, title='Movie', subtitle='Director\'s cut')
+        self.write_file('1008_20151122180003.mpg', 200)
+        os.utime(os.path.join(self.dir, '1008_20151122180003.mpg'), (st.st_atime, st.st_mtime + 60))
+
+        counts = self.refresh(FakeMythApi())
+
+        self.assertEqual(counts['updated'], 1)
+        o = Orphan.objects.get(filename='1008_20151122180003.mpg')
+        self.assertEqual([ o.title, o.subtitle, o.filesize ], [ 'Movie', 'Director\'s cut', 200 ])
+
+    def test_new_orphan_gets_channel_and_host(self):
+        self.write_file('1008_20151122180003.mpg', 100)
+
+        counts = self.refresh(FakeMythApi())
+
+        self.assertEqual(counts['inserted'], 1)
+        o = Orphan.objects.get()
+        self.assertEqual([ o.hostname, o.directory, o.channel_name, o.channel_number ],
+                         [ HOST, self.dir, 'Channel 1008', 8 ])
@@ -1,5 +1,5 @@
 from django.conf.urls import url
-from orphans.views import OrphanDeleteView, OrphanDetailView, OrphanListView, OrphanUpdateView
+from orphans.views import OrphanDeleteView, OrphanDetailView, OrphanListView, OrphanUpdateView, PreviewStatusView
 
 urlpatterns = [
     url(r'^$', OrphanListView.as_view(), name='OrphanListView'),
@@ -7,5 +7,6 @@ urlpatterns = [
     url(r'^update/(?P<pk>\d+)/$', OrphanUpdateView.as_view(), name='OrphanUpdateView'),
     url(r'^delete/(?P<pk>\d+)/$', OrphanDeleteView.as_view(), name='OrphanDeleteView'),
     url(r'^(?P<pk>\d+)/$', OrphanDetailView.as_view(), name='OrphanDetailView'),
+    url(r'^previews/$', PreviewStatusView.as_view(), name='PreviewStatusView'),
                
 ]
\ No newline at end of file
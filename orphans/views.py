@@ -2,16 +2,22 @@ import os
 import os.path
 import socket
 
+from django.conf import settings
 from django.http.response import HttpResponseRedirect
 from django.template import defaultfilters
-from django.views.generic import DeleteView, DetailView, UpdateView 
+from django.utils.html import format_html
+from django.db.models import Count
+from django.views.generic import DeleteView, DetailView, TemplateView, UpdateView 
 
 import django_tables2 as djt2
 from django_tables2 import  SingleTableView
 from django_tables2.utils import A  # alias for Accessor
 
 
-from orphans.models import Orphan
+from orphans.models import Orphan, PreviewJob
+from utils.config import get_config
+from utils.general import remove_remote_file
+from utils.sample_cache import mark_viewed, remove_previews_for
 
 # Create your views here.
 
@@ -20,6 +26,7 @@ class OrphanListTable(djt2.Table):
 #     play = djt2.LinkColumn('orphans:OrphanUpdateView', text='Edit Entry', args=[ A('intid')], attrs={ 'target': '_blank' }, empty_values=(), orderable=False )
     play = djt2.LinkColumn('orphans:OrphanUpdateView', text='Edit Entry', args=[ A('intid')], empty_values=(), orderable=False )
     samplename = djt2.Column()
+    sprite = djt2.Column(accessor=A('spritename'), verbose_name='Preview', empty_values=(), orderable=False)
     # Format filesize and time columns
     def render_filesize(self,value):
         return defaultfilters.filesizeformat(value)
@@ -27,16 +34,30 @@ class OrphanListTable(djt2.Table):
         return defaultfilters.date(value, 'D, m/d/Y')
     def render_start_time(self,value):
         return defaultfilters.time(value, 'h:i A')
+    def render_sprite(self,value):
+        # Only link sprite sheets that have been made, to avoid broken images
+        if not os.path.exists(os.path.join(get_config().video_samples_dir, value)):
+            return ''
+        return format_html('<img src="{}vidsamples/{}" width="160" alt="Preview"/>', settings.MEDIA_URL, value)
     class Meta:
         model = Orphan
         attrs = { 'class': 'paleblue' }
         exclude = ('samplename','intid', 'channel_id','filename','hostname','directory')
-        sequence = ('play','channel_number', 'channel_name', 'start_date', 'start_time','filesize','duration','title','subtitle')
+        sequence = ('play','sprite','channel_number', 'channel_name', 'start_date', 'start_time','filesize','duration','title','subtitle')
 # DeleteView
 class OrphanListView(SingleTableView):
     model = Orphan
     table_class = OrphanListTable
 
+    def get_context_data(self, **kwargs):
+        context = super(OrphanListView, self).get_context_data(**kwargs)
+        # The sprite sheets on this page count as viewed, for the samples quota.
+        # Evicted ones aren't shown here, so they aren't queued up again.
+        table = context['table']
+        rows = table.page.object_list if getattr(table, 'page', None) else table.rows
+        mark_viewed((row.record.intid for row in rows), profile='sprite', requeue=False)
+        return context
+
 class OrphanUpdateView(UpdateView):
     model = Orphan
     readonly_fields = [ 'start_date','start_time','channel_number','channel_name','duration','filesize','samplename'  ]
@@ -50,17 +71,28 @@ class OrphanUpdateView(UpdateView):
         context = super(OrphanUpdateView, self).get_context_data(**kwargs)
         # Store return address of orphan list page in session
         self.request.session['LISTPAGE_URL'] = self.request.META['HTTP_REFERER']
+        mark_viewed([ self.object.intid ])
+        # The sample that was actually made, whatever PREVIEW_ENCODER says now
+        context['sample_name'] = self.object.preview_name
         return context
 
 class OrphanDetailView(DetailView):
     model = Orphan
 
+    def get_context_data(self, **kwargs):
+        context = super(OrphanDetailView, self).get_context_data(**kwargs)
+        context['has_sprite'] = os.path.exists(
+            os.path.join(get_config().video_samples_dir, self.object.spritename))
+        mark_viewed([ self.object.intid ])
+        return context
+
 class OrphanDeleteView(DeleteView):
     """
     Deletes the file associated with the Orphan object,
     then deletes the Orphan object.
     
-    Assumes that the file is on localhost.
+    If the file is on another host, it is removed over SFTP,
+    which needs an SSH_CONFIGS entry for that host.
     """
     model = Orphan
 #     success_url = reverse_lazy('orphans:OrphanListView')
@@ -69,11 +101,33 @@ class OrphanDeleteView(DeleteView):
 
     def delete(self, request, *args, **kwargs):
         self.object = self.get_object()
-        if self.object.hostname != socket.gethostname():
-            raise Exception("This version of this method requires that it be running on the same host as the recording file is found on.")
         filespec = os.path.join(self.object.directory,self.object.filename)
-        if os.path.isfile(filespec):
+        if self.object.hostname != socket.gethostname():
+            remove_remote_file(self.object.hostname, filespec)
+        elif os.path.isfile(filespec):
             os.remove(filespec)
+        remove_previews_for([ self.object.intid ])
         self.object.delete()
         return HttpResponseRedirect(self.get_success_url())
-        
\ No newline at end of file
+        
+
+class PreviewStatusView(TemplateView):
+    """
+    How preview making is going: how many jobs are in each state, and,
+    for each conversion running now, its position, fps, speed and ETA.
+    The overall throughput is the sum of the running jobs' speeds -
+    seconds of preview encoded per second of wall time.
+    """
+    template_name = 'orphans/preview_status.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(PreviewStatusView, self).get_context_data(**kwargs)
+        counts = { state: 0 for state, label in PreviewJob.STATE_CHOICES }
+        for row in PreviewJob.objects.values('state').annotate(n=Count('intid')):
+            counts[row['state']] = row['n']
+        running = list(PreviewJob.objects.filter(state=PreviewJob.RUNNING)
+                       .select_related('orphan').order_by('started'))
+        context['counts'] = [ (label, counts[state]) for state, label in PreviewJob.STATE_CHOICES ]
+        context['running'] = running
+        context['throughput'] = sum(j.speed for j in running)
+        return context
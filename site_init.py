@@ -6,28 +6,46 @@ application = get_wsgi_application()
 
 
 from orphans.models import Orphan
-from utils.myth import initialize_orphans_list, VideoSampleMaker
+from utils.myth import initialize_orphans_list, refresh_orphans_list, VideoSampleMaker
 
 
 # Are there any orphans already?
 
 original_orphan_count = Orphan.objects.count()
+refresh_orphan_list = False
 if original_orphan_count > 0:
     init_orphan_list = False
     print("There are already {} orphan records in the database.".format(original_orphan_count))
     print("\tDo you want to recreate the list? Doing so will wipe out")
     print("\tall data in the orphan table.")
-    print("Type YES (all caps) to wipe out current data and recreate the list, or anything else to keep the current data.")
+    print("\tAlternatively, the list can be updated to match the files")
+    print("\ton disk, keeping any titles and subtitles already entered.")
+    print("Type YES (all caps) to wipe out current data and recreate the list,")
+    print("UPDATE (all caps) to update the list, or anything else to keep the current data.")
     user_response = input('Wipe out current data? --> ')
     if user_response == 'YES':
         init_orphan_list = True
+    elif user_response == 'UPDATE':
+        refresh_orphan_list = True
 else:
     init_orphan_list = True
 
 if init_orphan_list:
     # Initialize list of Orphan objects:
-    num_orphans = initialize_orphans_list(override=True)
+    scan_stats = {}
+    num_orphans = initialize_orphans_list(override=True, stats=scan_stats)
     print("Found {} orphan files.".format(num_orphans))
+    print("Scanned {} files in {:.1f} seconds ({:.0f} rows/second).".format(
+        scan_stats['files_scanned'], scan_stats['seconds'], scan_stats['rows_per_second']))
+    if scan_stats['files_skipped'] > 0:
+        print("Skipped {} files whose names aren't in MythTV's form.".format(scan_stats['files_skipped']))
+elif refresh_orphan_list:
+    changes = refresh_orphans_list()
+    print("Added {inserted}, updated {updated} and left {unchanged} unchanged.".format(**changes))
+    print("Removed {deleted_missing} whose files are gone and {deleted_recorded} that are now MythTV recordings.".format(**changes))
+    if changes['skipped'] > 0:
+        print("Skipped {skipped} files whose names aren't in MythTV's form.".format(**changes))
+    num_orphans = Orphan.objects.count()
 else:
     num_orphans = original_orphan_count
     
@@ -35,16 +53,32 @@ if num_orphans > 0:
     print("There are {} records in the orphans database table.".format(num_orphans))
     print("\tChecking whether any of them need video previews made...")
     vm = VideoSampleMaker()
-    print("\nA total of {} orphans were checked.".format(vm.empty_count + vm.to_do_count + vm.already_there_count))
+    print("\nA total of {} orphans were checked.".format(vm.empty_count + vm.to_do_count + vm.already_there_count + vm.gave_up_count + vm.evicted_count))
     print("Of these, {} were empty files (zero bytes) and {} already had samples present.".format(vm.empty_count, vm.already_there_count))
+    if vm.gave_up_count > 0:
+        print("{} were skipped because making their samples has failed too many times.".format(vm.gave_up_count))
+    if vm.evicted_count > 0:
+        print("{} had samples removed to stay within SAMPLES_QUOTA_MB; viewing them queues them again.".format(vm.evicted_count))
     if vm.to_do_count > 0:
         print("I will attempt to make video samples for the remaining {}...".format(vm.to_do_count))
-        print("\tThis will take several minutes per file...")
+        if vm.mode == 'sprite':
+            print("\tThese are sprite sheets of stills, which take a few seconds per file,")
+        elif vm.mode == 'clips':
+            print("\tThese are short clips from across each recording, a fraction of the work of a full sample,")
+        else:
+            print("\tThis will take several minutes per file,")
+        if vm.mode != 'sprite':
+            print("\tencoded with the '{}' profile (see PREVIEW_ENCODER in mtv_settings.cfg),".format(vm.encoder))
+        print("\twith several files processed at once (see PREVIEW_WORKERS in mtv_settings.cfg)...")
         conversion_results = vm.make_video_samples()
         # Each element of conversion_results is [ returncode, error message (if any), filename ]
         failures = [ f for f in conversion_results if f[0] != 0 ]
         failure_count = len(failures)
         success_count = vm.to_do_count - failure_count
+        print("Encoded {:.0f} seconds of preview at {:.1f} seconds per second overall.".format(
+            vm.meter.encoded, vm.meter.throughput))
+        print("Samples directory: removed {removed} unneeded and evicted {evicted} least recently viewed samples;"
+              " {bytes_used} bytes in use.".format(**vm.cache_stats))
         print("{} attempts succeeded and {} encountered problems.".format(success_count, failure_count))
         if failure_count > 0:
             print("Here are the error messages:")
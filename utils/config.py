@@ -0,0 +1,210 @@
+# Typed, cached access to mtv_settings.cfg.
+import configparser
+import os
+import os.path
+import shlex
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = os.path.join(BASE_DIR, 'mtv_settings.cfg')
+
+REQUIRED = object() # marks options that have no default
+
+"""
+The options read from mtv_settings.cfg. Each entry is:
+    ( attribute name, section, option, type, default )
+type is one of str, int, float, bool or 'path' - a path which, if
+relative, is taken relative to BASE_DIR.
+To add an option, add a line here; it then appears as an attribute
+of MtvConfig.
+"""
+OPTIONS = (
+    ( 'secret_key', 'SECURITY', 'SECRET_KEY', str, REQUIRED ),
+    ( 'debug', 'DEVEL', 'DEBUG', bool, False ),
+
+    ( 'default_db_engine', 'DB', 'DEFAULT_DB_ENGINE', str, REQUIRED ),
+    ( 'default_db_name', 'DB', 'DEFAULT_DB_NAME', 'path', REQUIRED ),
+    ( 'myth_db_engine', 'DB', 'MYTH_DB_ENGINE', str, None ),
+    ( 'myth_db_name', 'DB', 'MYTH_DB_NAME', str, None ),
+    ( 'myth_db_host', 'DB', 'MYTH_DB_HOST', str, None ),
+    ( 'myth_db_user', 'DB', 'MYTH_DB_USER', str, None ),
+    ( 'myth_db_password', 'DB', 'MYTH_DB_PASSWORD', str, None ),
+
+    ( 'mythbackend', 'MYTHTV_CONTENT', 'MYTHBACKEND', str, REQUIRED ),
+    ( 'api_port', 'MYTHTV_CONTENT', 'API_PORT', int, 6544 ),
+    ( 'api_pool_size', 'MYTHTV_CONTENT', 'API_POOL_SIZE', int, 8 ), # raised to API_CONCURRENCY if lower
+    ( 'api_timeout', 'MYTHTV_CONTENT', 'API_TIMEOUT', float, 30.0 ),
+    ( 'api_concurrency', 'MYTHTV_CONTENT', 'API_CONCURRENCY', int, 8 ),
+    ( 'recording_page_size', 'MYTHTV_CONTENT', 'RECORDING_PAGE_SIZE', int, 500 ),
+    ( 'channel_cache_ttl', 'MYTHTV_CONTENT', 'CHANNEL_CACHE_TTL', int, 3600 ),
+    ( 'persist_channel_cache', 'MYTHTV_CONTENT', 'PERSIST_CHANNEL_CACHE', bool, False ),
+
+    ( 'tv_recordings_dir', 'MYTHTV_CONTENT', 'TV_RECORDINGS_DIR', str, REQUIRED ),
+    ( 'recording_filename_pattern', 'MYTHTV_CONTENT', 'RECORDING_FILENAME_PATTERN', str, '*.mpg' ),
+    ( 'orphan_batch_size', 'MYTHTV_CONTENT', 'ORPHAN_BATCH_SIZE', int, 500 ),
+    ( 'scan_remote_hosts', 'MYTHTV_CONTENT', 'SCAN_REMOTE_HOSTS', bool, False ),
+
+    ( 'video_samples_dir', 'MYTHTV_CONTENT', 'VIDEO_SAMPLES_DIR', 'path', REQUIRED ),
+    ( 'vidconverter', 'MYTHTV_CONTENT', 'VIDCONVERTER', str, REQUIRED ),
+    ( 'preview_duration', 'MYTHTV_CONTENT', 'PREVIEW_DURATION', str, '00:10:00' ),
+    ( 'preview_quality', 'MYTHTV_CONTENT', 'PREVIEW_QUALITY', str, '5' ),
+    ( 'preview_workers', 'MYTHTV_CONTENT', 'PREVIEW_WORKERS', int, os.cpu_count() or 1 ),
+    ( 'preview_timeout', 'MYTHTV_CONTENT', 'PREVIEW_TIMEOUT', int, 3600 ),
+    ( 'preview_max_attempts', 'MYTHTV_CONTENT', 'PREVIEW_MAX_ATTEMPTS', int, 3 ),
+    ( 'preview_segments', 'MYTHTV_CONTENT', 'PREVIEW_SEGMENTS', int, 1 ),
+    ( 'preview_nice', 'MYTHTV_CONTENT', 'PREVIEW_NICE', int, 10 ),
+    ( 'preview_ionice_class', 'MYTHTV_CONTENT', 'PREVIEW_IONICE_CLASS', int, 2 ),
+    ( 'preview_ionice_level', 'MYTHTV_CONTENT', 'PREVIEW_IONICE_LEVEL', int, 7 ),
+    ( 'max_load_per_cpu', 'MYTHTV_CONTENT', 'MAX_LOAD_PER_CPU', float, 0.8 ),
+    ( 'max_iowait_percent', 'MYTHTV_CONTENT', 'MAX_IOWAIT_PERCENT', float, 20.0 ),
+    ( 'min_free_mb', 'MYTHTV_CONTENT', 'MIN_FREE_MB', int, 2048 ),
+    ( 'samples_quota_mb', 'MYTHTV_CONTENT', 'SAMPLES_QUOTA_MB', int, 0 ), # 0 means no quota
+    ( 'pause_while_recording', 'MYTHTV_CONTENT', 'PAUSE_WHILE_RECORDING', bool, True ),
+    ( 'preview_mode', 'MYTHTV_CONTENT', 'PREVIEW_MODE', str, 'video' ),
+    ( 'preview_encoder', 'MYTHTV_CONTENT', 'PREVIEW_ENCODER', str, 'theora' ),
+    ( 'sprite_frames', 'MYTHTV_CONTENT', 'SPRITE_FRAMES', int, 12 ),
+    ( 'sprite_columns', 'MYTHTV_CONTENT', 'SPRITE_COLUMNS', int, 4 ),
+    ( 'sprite_tile_width', 'MYTHTV_CONTENT', 'SPRITE_TILE_WIDTH', int, 320 ),
+    ( 'sprite_format', 'MYTHTV_CONTENT', 'SPRITE_FORMAT', str, 'jpg' ),
+    ( 'clip_count', 'MYTHTV_CONTENT', 'CLIP_COUNT', int, 4 ),
+    ( 'clip_seconds', 'MYTHTV_CONTENT', 'CLIP_SECONDS', int, 30 ),
+
+    ( 'ssh_pool_size', 'MYTHTV_CONTENT', 'SSH_POOL_SIZE', int, 2 ),
+    ( 'copy_verify', 'MYTHTV_CONTENT', 'COPY_VERIFY', bool, False ),
+)
+
+"""
+Built-in encoder profiles for video previews. Each is:
+    name: ( file extension, converter arguments )
+{quality} in the arguments is replaced with PREVIEW_QUALITY.
+Profiles can be added or changed in an ENCODER_PROFILES section of
+mtv_settings.cfg, one per line, extension first:
+    vp9 = webm, -c:v libvpx-vp9 -deadline realtime -cpu-used 8 -c:a libopus
+"""
+ENCODER_PROFILES = {
+    # What previews have always been; slow, but plays everywhere
+    'theora': ( 'ogv', '-acodec libvorbis -vcodec libtheora -qscale:v {quality}' ),
+    'vp8': ( 'webm', '-c:v libvpx -deadline realtime -cpu-used 8 -b:v 1M -c:a libvorbis' ),
+    'h264': ( 'mp4', '-c:v libx264 -preset ultrafast -crf 28 -pix_fmt yuv420p'
+                     ' -c:a aac -b:a 128k -movflags +faststart' ),
+}
+
+
+class MtvConfig(object):
+    """
+    The contents of mtv_settings.cfg, read and checked once, with each
+    option from OPTIONS converted to its type and stored as an attribute
+    (e.g. config.api_port is an int).
+
+    Also available:
+        * ssh_configs - dict mapping host name to [ user, password, port ],
+          from the optional SSH_CONFIGS section
+        * encoder_profiles - dict mapping profile name to [ extension,
+          arguments ], from ENCODER_PROFILES and the optional section of
+          the same name (see encoder_profile)
+        * parser - the underlying ConfigParser, for anything else
+        * mtime - modification time of the file when it was read
+
+    Raises Exception if the file is missing, a required option is absent,
+    or a value can't be converted.
+    """
+    def __init__(self, config_file=CONFIG_FILE):
+        self.config_file = config_file
+        self.mtime = os.stat(config_file).st_mtime if os.path.exists(config_file) else None
+        self.parser = configparser.ConfigParser(interpolation=None)
+        config_files_read = self.parser.read(config_file)
+        if len(config_files_read) == 0:
+            raise Exception('Could not find config file {}'.format(config_file))
+        problems = []
+        for attr, section, option, kind, default in OPTIONS:
+            try:
+                value = self._read(section, option, kind, default)
+            except (ValueError, KeyError) as e:
+                problems.append('{}/{}: {}'.format(section, option, e))
+                continue
+            setattr(self, attr, value)
+        if problems:
+            raise Exception('Problems in config file {}: {}'.format(config_file, '; '.join(problems)))
+        self.ssh_configs = {}
+        if self.parser.has_section('SSH_CONFIGS'):
+            for hostname, host_cfg in self.parser['SSH_CONFIGS'].items():
+                user, pword, port = host_cfg.split(',')
+                self.ssh_configs[hostname] = [ user, pword, int(port) ]
+        self.encoder_profiles = { name: [ ext, args ] for name, (ext, args) in ENCODER_PROFILES.items() }
+        if self.parser.has_section('ENCODER_PROFILES'):
+            for name, profile_cfg in self.parser['ENCODER_PROFILES'].items():
+                ext, sep, args = profile_cfg.partition(',')
+                if not sep:
+                    raise Exception('Problems in config file {}: ENCODER_PROFILES/{}: expected "extension, arguments"'.format(
+                        config_file, name))
+                self.encoder_profiles[name] = [ ext.strip().lstrip('.'), args.strip() ]
+        if self.preview_encoder not in self.encoder_profiles:
+            raise Exception('Problems in config file {}: MYTHTV_CONTENT/PREVIEW_ENCODER: no profile named {}'.format(
+                config_file, self.preview_encoder))
+
+    def encoder_profile(self, name=None):
+        """
+        Pass: name of an encoder profile (default: PREVIEW_ENCODER)
+        Return: [ file extension, list of converter arguments ]
+        Raises KeyError if there is no such profile.
+        """
+        ext, args = self.encoder_profiles[name or self.preview_encoder]
+        return [ ext, shlex.split(args.replace('{quality}', self.preview_quality)) ]
+
+    def ssh_config_for(self, hostname):
+        """
+        Return: [ user, password, port ] for hostname
+        Raises KeyError if SSH_CONFIGS has no entry for it.
+        """
+        return self.ssh_configs[hostname.lower()] # ConfigParser lower-cases option names
+
+    def _read(self, section, option, kind, default):
+        if not self.parser.has_option(section, option):
+            if default is REQUIRED:
+                raise KeyError('missing')
+            return default
+        if kind is bool:
+            return self.parser.getboolean(section, option)
+        if kind is int:
+            return self.parser.getint(section, option)
+        if kind is float:
+            return self.parser.getfloat(section, option)
+        value = self.parser.get(section, option)
+        if kind == 'path':
+            value = os.path.join(BASE_DIR, value) # no effect if value is absolute
+        return value
+
+
+_config = None
+_checked_at = 0
+_lock = threading.Lock()
+CHECK_INTERVAL = 5 # seconds between checks of the file's mtime
+
+def get_config():
+    """
+    Return: the current MtvConfig.
+    The file is parsed on first use and again only when its modification
+    time changes - and the mtime itself is looked at no more than once
+    every CHECK_INTERVAL seconds, so calling this on a hot path costs no
+    file I/O at all.
+    """
+    global _config, _checked_at
+    now = time.time()
+    if _config is not None and now - _checked_at < CHECK_INTERVAL:
+        return _config
+    with _lock:
+        if _config is None:
+            _config = MtvConfig()
+        elif now - _checked_at >= CHECK_INTERVAL:
+            try:
+                mtime = os.stat(_config.config_file).st_mtime
+            except OSError:
+                mtime = _config.mtime # file went away - keep what we have
+            if mtime != _config.mtime:
+                try:
+                    _config = MtvConfig(_config.config_file)
+                except Exception:
+                    pass # half-edited or invalid file - keep using the last good one
+        _checked_at = now
+        return _config
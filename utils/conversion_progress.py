@@ -0,0 +1,152 @@
+# Following the progress of ffmpeg conversions as they run.
+import collections
+import threading
+import time
+
+
+class ConversionProgress(object):
+    """
+    Where one preview conversion has got to, from the key=value lines that
+    ffmpeg writes with '-progress pipe:1'. A conversion may run as several
+    ffmpeg processes at once (see VideoSampleMaker.make_segmented_sample);
+    each feeds its own stream key, and position, fps and speed are the
+    totals over all of them.
+
+    on_update, if given, is called with this object after each complete
+    block of progress lines (ffmpeg writes one about twice a second).
+    """
+    def __init__(self, name, total=None, on_update=None):
+        self.name = name
+        self.total = total # seconds of output expected, if known
+        self.on_update = on_update
+        self.started = time.time()
+        self.finished = None
+        self._streams = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def feed(self, line, stream=0):
+        """
+        Takes one line of ffmpeg's -progress output.
+        """
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return
+        pending = self._pending.setdefault(stream, {})
+        pending[key] = value
+        if key != 'progress': # 'progress' ends each block
+            return
+        state = {}
+        # out_time_us is the current name; older ffmpegs only have
+        # out_time_ms, which (despite the name) is also in microseconds.
+        micros = pending.get('out_time_us', pending.get('out_time_ms'))
+        state['position'] = _to_float(micros) / 1000000
+        state['fps'] = _to_float(pending.get('fps'))
+        state['speed'] = _to_float(pending.get('speed', '').rstrip('x'))
+        if value == 'end':
+            state['speed'] = 0.0
+        self._pending[stream] = {}
+        with self._lock:
+            self._streams[stream] = state
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def _total_of(self, field):
+        with self._lock:
+            return sum(s[field] for s in self._streams.values())
+
+    @property
+    def position(self):
+        """Seconds of output written so far"""
+        return self._total_of('position')
+
+    @property
+    def fps(self):
+        return self._total_of('fps')
+
+    @property
+    def speed(self):
+        """Seconds of output written per second of wall time, just now"""
+        return self._total_of('speed')
+
+    @property
+    def eta(self):
+        """Seconds until done, at the current speed, or None if unknown"""
+        speed = self.speed
+        if not self.total or speed <= 0:
+            return None
+        return max(0.0, self.total - self.position) / speed
+
+    def finish(self):
+        self.finished = time.time()
+
+    def as_dict(self):
+        return { 'name': self.name, 'position': self.position, 'total': self.total,
+                 'fps': self.fps, 'speed': self.speed, 'eta': self.eta,
+                 'seconds': (self.finished or time.time()) - self.started,
+                 'done': self.finished is not None }
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0 # 'N/A' before the first frame
+
+
+class ThroughputMeter(object):
+    """
+    Totals for a whole run of conversions: seconds of output encoded,
+    per second of wall time since the run started.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.running = collections.OrderedDict() # name -> ConversionProgress
+        self.encoded_done = 0.0 # seconds of output from finished conversions
+        self._lock = threading.Lock()
+
+    def start(self, progress):
+        with self._lock:
+            self.running[progress.name] = progress
+
+    def finish(self, progress):
+        progress.finish()
+        with self._lock:
+            self.running.pop(progress.name, None)
+            self.encoded_done += progress.position
+
+    @property
+    def encoded(self):
+        with self._lock:
+            return self.encoded_done + sum(p.position for p in self.running.values())
+
+    @property
+    def throughput(self):
+        elapsed = time.time() - self.started
+        return self.encoded / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        """
+        Return: a one-line description of the run so far, for the CLI
+        """
+        with self._lock:
+            running = list(self.running.values())
+        parts = []
+        for p in running:
+            text = '{} {}'.format(p.name, format_seconds(p.position))
+            if p.total:
+                text += '/' + format_seconds(p.total)
+            text += ' at {:.1f}x'.format(p.speed)
+            if p.eta is not None:
+                text += ' ETA ' + format_seconds(p.eta)
+            parts.append(text)
+        return '{} running: {}; overall {:.1f} encoded s/s'.format(
+            len(running), ', '.join(parts) or '-', self.throughput)
+
+
+def format_seconds(seconds):
+    """
+    Return: seconds as H:MM:SS
+    """
+    seconds = int(round(seconds or 0))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
@@ -46,4 +46,16 @@ Return:
 def time_diff_from_strings(start_time, end_time):
     end_dt = iso8601.parse_date(end_time, pytz.timezone('Etc/UTC'))
     start_dt = iso8601.parse_date(start_time, pytz.timezone('Etc/UTC'))
-    return (int)(end_dt.timestamp() - start_dt.timestamp())
\ No newline at end of file
+    return (int)(end_dt.timestamp() - start_dt.timestamp())
+"""
+Pass:
+  * A duration as ffmpeg takes it: seconds ('600', '90.5') or
+    [HH:]MM:SS[.fff] ('00:10:00')
+Return:
+  * The duration in seconds (float)
+"""
+def duration_to_seconds(duration):
+    seconds = 0.0
+    for part in str(duration).strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
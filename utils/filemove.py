@@ -0,0 +1,524 @@
+# Moving and copying large recording files between directories.
+import collections
+import contextlib
+import errno
+import fcntl
+import hashlib
+import itertools
+import mmap
+import os
+import os.path
+import shlex
+import shutil
+import socket
+import threading
+import time
+
+from utils.general import open_sftp, run_remote_command, ssh_session
+
+# ioctl request number for FICLONE (linux/fs.h): make the destination
+# share the source's data blocks, on filesystems that support it
+# (btrfs, XFS with reflink=1, ...).
+FICLONE = 0x40049409
+
+# errnos meaning "this filesystem or pair of files can't be cloned" -
+# not a real failure, just a reason to fall back to copying.
+NO_REFLINK_ERRORS = frozenset([ errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                                errno.EINVAL, errno.ENOSYS, errno.EPERM ])
+
+COPY_BUFFER_SIZE = 8 * 1024 * 1024 # a multiple of the page size
+COPY_CHECKSUM = 'blake2b'
+PROGRESS_INTERVAL = 0.5 # seconds between progress callbacks
+
+STRATEGY_RENAME = 'rename'
+STRATEGY_REFLINK = 'reflink'
+STRATEGY_COPY = 'copy'
+STRATEGY_SFTP = 'sftp'
+
+PART_PREFIX = '.part-' # name prefix of a file still being transferred
+# Checksum used for cross-host transfers: it needs a command-line tool
+# (sha256sum) on the far host, to check what landed there.
+REMOTE_CHECKSUM = 'sha256'
+
+
+def same_device(source, target_dir):
+    """
+    Return: True if source and target_dir are on the same filesystem,
+    so that a rename from one to the other is possible.
+    """
+    return os.stat(source).st_dev == os.stat(target_dir).st_dev
+
+def reflink(source, target):
+    """
+    Clones source to target (which must not exist yet) with FICLONE.
+    Return: True if it worked, False if the filesystem can't do it.
+    Any partial target is removed on failure.
+    """
+    with open(source, 'rb') as src:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+        except OSError as e:
+            os.close(fd)
+            os.remove(target)
+            if e.errno in NO_REFLINK_ERRORS:
+                return False
+            raise
+        os.close(fd)
+    return True
+
+class CopyProgress(object):
+    """
+    The state of one copy_file call. Updated as the copy goes on, so
+    another thread (e.g. a view answering a web page's poll) can read it.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, source, target, total):
+        self.id = next(self._ids)
+        self.source = source
+        self.target = target
+        self.total = total
+        self.copied = 0
+        self.started = time.time()
+        self.finished = None
+        self.checksum = None # hex digest of the data, once copied
+        self.error = None
+
+    @property
+    def seconds(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def bytes_per_second(self):
+        seconds = self.seconds
+        return self.copied / seconds if seconds > 0 else 0.0
+
+    @property
+    def percent(self):
+        return 100.0 * self.copied / self.total if self.total else 100.0
+
+    def as_dict(self):
+        return { 'id': self.id, 'source': self.source, 'target': self.target,
+                 'total': self.total, 'copied': self.copied, 'percent': self.percent,
+                 'seconds': self.seconds, 'bytes_per_second': self.bytes_per_second,
+                 'done': self.finished is not None, 'checksum': self.checksum,
+                 'error': self.error }
+
+
+_active = {}
+_recent = collections.deque(maxlen=20)
+_registry_lock = threading.Lock()
+
+def transfers():
+    """
+    Return: list of CopyProgress.as_dict() for the copies running in this
+    process, followed by the last few that have finished.
+    """
+    with _registry_lock:
+        return [ p.as_dict() for p in list(_active.values()) + list(_recent) ]
+
+def file_checksum(filespec, checksum=COPY_CHECKSUM, buffer_size=COPY_BUFFER_SIZE):
+    """
+    Return: hex digest of a file's contents
+    """
+    h = hashlib.new(checksum)
+    buf = mmap.mmap(-1, buffer_size)
+    view = memoryview(buf)
+    try:
+        with open(filespec, 'rb', buffering=0) as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+    finally:
+        view.release()
+        buf.close()
+    return h.hexdigest()
+
+def copy_file(source, target, checksum=COPY_CHECKSUM, verify=False, progress=None,
+              buffer_size=COPY_BUFFER_SIZE):
+    """
+    Copies source to target in a single pass, working out a checksum of
+    the data as it goes, and fsyncs target once at the end.
+    Pass:
+      * source and target file paths
+      * checksum - a hashlib algorithm name, or None for no checksum. With
+        no checksum, the kernel copies the data (copy_file_range or
+        sendfile) without it passing through Python at all.
+      * verify - if True, target is read back from disk after the copy and
+        its checksum compared with the one computed while copying
+      * progress (optional) - called with the CopyProgress every
+        PROGRESS_INTERVAL seconds, and once at the end
+      * buffer_size - bytes per read. The buffer is page-aligned.
+    Return: the CopyProgress, with checksum filled in
+    Raises: Exception if verification fails. A partial or bad target is
+    removed on any failure.
+    """
+    p = CopyProgress(source, target, os.stat(source).st_size)
+    with _registry_lock:
+        _active[p.id] = p
+    try:
+        h = hashlib.new(checksum) if checksum else None
+        last_report = 0
+        with open(source, 'rb', buffering=0) as src, open(target, 'wb', buffering=0) as dst:
+            if h is None:
+                copy_chunk = _kernel_copier(src.fileno(), dst.fileno(), buffer_size)
+            else:
+                buf = mmap.mmap(-1, buffer_size) # anonymous mmap, so page-aligned
+                view = memoryview(buf)
+                def copy_chunk():
+                    n = src.readinto(buf)
+                    if n:
+                        chunk = view[:n]
+                        h.update(chunk)
+                        written = 0
+                        while written < n:
+                            written += dst.write(chunk[written:])
+                    return n
+            try:
+                while True:
+                    n = copy_chunk()
+                    if not n:
+                        break
+                    p.copied += n
+                    if progress is not None and time.time() - last_report >= PROGRESS_INTERVAL:
+                        last_report = time.time()
+                        progress(p)
+            finally:
+                if h is not None:
+                    view.release()
+                    buf.close()
+            os.fsync(dst.fileno())
+            if verify:
+                # Drop target from the page cache, so it really is read back from disk:
+                os.posix_fadvise(dst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        if h is not None:
+            p.checksum = h.hexdigest()
+        if verify:
+            written_sum = file_checksum(target, checksum or COPY_CHECKSUM, buffer_size)
+            if p.checksum is None:
+                p.checksum = file_checksum(source, checksum or COPY_CHECKSUM, buffer_size)
+            if written_sum != p.checksum:
+                raise Exception("Checksum mismatch copying {} to {}".format(source, target))
+        p.finished = time.time()
+        if progress is not None:
+            progress(p)
+        return p
+    except Exception as e:
+        p.error = str(e)
+        p.finished = time.time()
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+    finally:
+        with _registry_lock:
+            _active.pop(p.id, None)
+            _recent.append(p)
+
+def _kernel_copier(in_fd, out_fd, count):
+    """
+    Return: a function that copies the next count bytes from in_fd to
+    out_fd inside the kernel and returns how many it copied (0 at EOF).
+    """
+    if hasattr(os, 'copy_file_range'):
+        def copy_chunk():
+            try:
+                return os.copy_file_range(in_fd, out_fd, count)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+            return os.sendfile(out_fd, in_fd, None, count)
+        return copy_chunk
+    return lambda: os.sendfile(out_fd, in_fd, None, count)
+
+def place_file(source, target_dir, allow_rename=False, verify=False, progress=None):
+    """
+    Puts a copy of source into target_dir, under the same name, by the
+    cheapest means available:
+        * rename - if allow_rename is True and both are on the same
+          filesystem. Instant, but the source is gone afterwards.
+        * reflink - a copy-on-write clone, on btrfs, XFS and the like.
+          Nearly instant, and uses no extra space.
+        * copy - a streamed copy of the data, checksummed as it is
+          written (see copy_file; verify and progress are passed on to it).
+    Permission bits and times are copied over for reflinks and copies,
+    as shutil.copy2 would.
+    Return: a dict with:
+        * target - full path of the new file
+        * strategy - 'rename', 'reflink' or 'copy'
+        * bytes - size of the file
+        * seconds - elapsed time
+        * bytes_per_second
+        * checksum - of the copied data, for a copy; otherwise None
+    """
+    started = time.time()
+    target = os.path.join(target_dir, os.path.basename(source))
+    size = os.stat(source).st_size
+    digest = None
+    if allow_rename and same_device(source, target_dir):
+        os.rename(source, target)
+        strategy = STRATEGY_RENAME
+    else:
+        if os.path.exists(target):
+            os.remove(target) # left over from an earlier, failed attempt
+        if reflink(source, target):
+            strategy = STRATEGY_REFLINK
+        else:
+            digest = copy_file(source, target, verify=verify, progress=progress).checksum
+            strategy = STRATEGY_COPY
+        shutil.copystat(source, target)
+    seconds = time.time() - started
+    return { 'target': target, 'strategy': strategy, 'bytes': size, 'seconds': seconds,
+             'bytes_per_second': size / seconds if seconds > 0 else 0.0, 'checksum': digest }
+
+def _run_on(hostname, command):
+    """
+    Runs command on hostname (see run_remote_command).
+    Return: its stdout, as text
+    Raises: Exception if it exits with a non-zero status
+    """
+    status, out, err = run_remote_command(hostname, command)
+    if status != 0:
+        raise Exception("'{}' failed on {}: {}".format(command, hostname, err.decode('utf-8', 'replace').strip()))
+    return out.decode('utf-8', 'replace')
+
+def _remote_size_and_checksum(hostname, path):
+    """
+    Return: [ size in bytes, REMOTE_CHECKSUM hex digest ] of path, worked out on hostname
+    """
+    out = _run_on(hostname, 'stat -c %s -- {0} && {1}sum -- {0}'.format(shlex.quote(path), REMOTE_CHECKSUM))
+    lines = out.splitlines()
+    return [ int(lines[0]), lines[1].split()[0] ]
+
+def place_remote_file(hostname, source, target_dir, allow_rename=False):
+    """
+    place_file, for a source and target_dir that are both on hostname,
+    another host. Everything runs there, over a pooled SSH connection, so
+    the data never crosses the network:
+        * rename - if allow_rename is True and both are on the same
+          filesystem, with mv. The source is gone afterwards.
+        * copy - otherwise, with cp --reflink=auto (a clone, where the
+          filesystem allows) to PART_PREFIX + name, renamed into place
+          once it has been checked.
+    Either way, the size and REMOTE_CHECKSUM of what landed are checked
+    against the source's, on that host.
+    Return: a dict like place_file's
+    Raises: Exception if a command fails or the check doesn't match; a
+    copy is then removed, and a rename undone.
+    """
+    started = time.time()
+    name = os.path.basename(source)
+    target = os.path.join(target_dir, name)
+    part = os.path.join(target_dir, PART_PREFIX + name)
+    q = shlex.quote
+    _run_on(hostname, 'mkdir -p -- {}'.format(q(target_dir)))
+    size, digest = _remote_size_and_checksum(hostname, source)
+    devices = _run_on(hostname, 'stat -c %d -- {} {}'.format(q(source), q(target_dir))).split()
+    if allow_rename and devices[0] == devices[1]:
+        strategy = STRATEGY_RENAME
+        landed = target
+        _run_on(hostname, 'mv -- {} {}'.format(q(source), q(target)))
+    else:
+        strategy = STRATEGY_COPY
+        landed = part
+        _run_on(hostname, 'cp --reflink=auto --preserve=mode,timestamps -- {} {}'.format(q(source), q(part)))
+    try:
+        if _remote_size_and_checksum(hostname, landed) != [ size, digest ]:
+            raise Exception("Placing {} on {} failed verification".format(name, hostname))
+        if strategy == STRATEGY_COPY:
+            _run_on(hostname, 'mv -f -- {} {}'.format(q(part), q(target)))
+    except Exception:
+        if strategy == STRATEGY_RENAME:
+            _run_on(hostname, 'mv -- {} {}'.format(q(target), q(source))) # put it back
+        else:
+            _run_on(hostname, 'rm -f -- {}'.format(q(part)))
+        raise
+    seconds = time.time() - started
+    return { 'target': target, 'strategy': strategy, 'bytes': size, 'seconds': seconds,
+             'bytes_per_second': size / seconds if seconds > 0 else 0.0, 'checksum': digest }
+
+
+class HostFiles(object):
+    """
+    The few file operations a cross-host transfer needs, on one host:
+    plain local calls if it is this host, SFTP calls otherwise.
+    """
+    def __init__(self, hostname, sftp=None):
+        self.hostname = hostname
+        self.sftp = sftp
+
+    @property
+    def is_local(self):
+        return self.sftp is None
+
+    def open(self, path, mode, offset=0):
+        if self.is_local:
+            f = open(path, mode)
+            if offset:
+                f.seek(offset)
+            return f
+        f = self.sftp.open(path, mode, bufsize=COPY_BUFFER_SIZE)
+        if offset:
+            f.seek(offset)
+        if 'r' in mode and '+' not in mode:
+            f.prefetch() # read ahead from offset, many requests in flight
+        else:
+            f.set_pipelined(True) # don't wait for each write to be acknowledged
+        return f
+
+    def size(self, path):
+        """
+        Return: size of path in bytes, or None if there's no such file
+        """
+        try:
+            if self.is_local:
+                return os.stat(path).st_size
+            return self.sftp.stat(path).st_size
+        except (FileNotFoundError, IOError):
+            return None
+
+    def makedirs(self, path):
+        if self.is_local:
+            os.makedirs(path, exist_ok=True)
+            return
+        missing = []
+        while self.size(path) is None and path not in ('', '/'):
+            missing.append(path)
+            path = os.path.dirname(path)
+        for d in reversed(missing):
+            self.sftp.mkdir(d)
+
+    def replace(self, source, target):
+        if self.is_local:
+            os.replace(source, target)
+        else:
+            self.sftp.posix_rename(source, target)
+
+    def remove(self, path):
+        if self.is_local:
+            os.remove(path)
+        else:
+            self.sftp.remove(path)
+
+    def checksum(self, path):
+        """
+        Return: REMOTE_CHECKSUM hex digest of path, worked out on its own host
+        """
+        if self.is_local:
+            return file_checksum(path, REMOTE_CHECKSUM)
+        status, out, err = run_remote_command(self.hostname, '{}sum -- {}'.format(
+                REMOTE_CHECKSUM, shlex.quote(path)))
+        if status != 0:
+            raise Exception("Could not checksum {} on {}: {}".format(
+                path, self.hostname, err.decode('utf-8', 'replace')))
+        return out.split()[0].decode('ascii')
+
+@contextlib.contextmanager
+def host_files(hostname):
+    """
+    Context manager giving a HostFiles for hostname, holding a pooled
+    SSH connection (and one SFTP channel on it) if it's another host.
+    """
+    if hostname is None or hostname == socket.gethostname():
+        yield HostFiles(hostname)
+        return
+    with ssh_session(hostname) as client:
+        sftp = open_sftp(client)
+        try:
+            yield HostFiles(hostname, sftp)
+        finally:
+            sftp.close()
+
+def transfer_file(source_host, source, target_host, target_dir, progress=None,
+                  buffer_size=COPY_BUFFER_SIZE):
+    """
+    Copies source, on source_host, into target_dir on target_host, where
+    either or both may be other hosts, reached over pooled SSH connections.
+    Reads and writes are pipelined over SFTP, so the link stays busy.
+    
+    The data goes to PART_PREFIX + name in target_dir first. If a transfer
+    is interrupted, the next call for the same file picks up where that
+    file ends instead of starting over. Once all the data is there, its
+    size and its checksum - worked out on the target host - are checked
+    against the source before it is renamed into place. The source's
+    checksum is computed from the data as it is sent, or, when resuming
+    from a remote source, by its own host.
+    
+    progress, if given, is called as for copy_file.
+    Return: a dict like place_file's, with strategy 'sftp' and also
+    resumed_from, the number of bytes already there from an earlier try.
+    Raises: Exception if the size or checksum don't match; the partial
+    file is then removed, so the next try starts afresh.
+    """
+    started = time.time()
+    name = os.path.basename(source)
+    target = os.path.join(target_dir, name)
+    part = os.path.join(target_dir, PART_PREFIX + name)
+    with host_files(source_host) as src, host_files(target_host) as dst:
+        total = src.size(source)
+        if total is None:
+            raise Exception("No such file {} on {}".format(source, source_host))
+        dst.makedirs(target_dir)
+        offset = dst.size(part) or 0
+        if offset > total:
+            dst.remove(part)
+            offset = 0
+        h = hashlib.new(REMOTE_CHECKSUM)
+        if offset and not src.is_local:
+            h = None # the source is checksummed on its own host at the end
+        elif offset:
+            # Fold the part of the source already sent into the checksum:
+            with src.open(source, 'rb') as f:
+                remaining = offset
+                while remaining > 0:
+                    buf = f.read(min(buffer_size, remaining))
+                    if not buf:
+                        break
+                    h.update(buf)
+                    remaining -= len(buf)
+        p = CopyProgress(source, target, total)
+        p.copied = offset
+        with _registry_lock:
+            _active[p.id] = p
+        try:
+            last_report = 0
+            with src.open(source, 'rb', offset) as fin, \
+                 dst.open(part, 'r+b' if offset else 'wb', offset) as fout:
+                while True:
+                    buf = fin.read(buffer_size)
+                    if not buf:
+                        break
+                    if h is not None:
+                        h.update(buf)
+                    fout.write(buf)
+                    p.copied += len(buf)
+                    if progress is not None and time.time() - last_report >= PROGRESS_INTERVAL:
+                        last_report = time.time()
+                        progress(p)
+                if dst.is_local:
+                    fout.flush()
+                    os.fsync(fout.fileno())
+            p.checksum = h.hexdigest() if h is not None else src.checksum(source)
+            landed = dst.size(part)
+            if landed != total or dst.checksum(part) != p.checksum:
+                dst.remove(part)
+                raise Exception("Transfer of {} from {} to {} failed verification ({} of {} bytes)".format(
+                    name, source_host, target_host, landed, total))
+            dst.replace(part, target)
+            p.finished = time.time()
+            if progress is not None:
+                progress(p)
+        except Exception as e:
+            p.error = str(e)
+            p.finished = time.time()
+            raise
+        finally:
+            with _registry_lock:
+                _active.pop(p.id, None)
+                _recent.append(p)
+    seconds = time.time() - started
+    return { 'target': target, 'strategy': STRATEGY_SFTP, 'bytes': total, 'seconds': seconds,
+             'bytes_per_second': (total - offset) / seconds if seconds > 0 else 0.0,
+             'checksum': p.checksum, 'resumed_from': offset }
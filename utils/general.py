@@ -1,21 +1,162 @@
+import contextlib
+import queue
+import threading
+
 import paramiko
 
-from myth_to_vid.settings import cfg
+from utils.config import get_config
 
 def make_ssh_client(hostname):
-    ssh_configs = cfg['SSH_CONFIGS'] # raises KeyError if no such section
-    host_cfg = ssh_configs[hostname] # raises KeyError if no such option
-    user,pword,port = host_cfg.split(',')
-    port = int(port)
+    user,pword,port = get_config().ssh_config_for(hostname) # raises KeyError if no such host
     ssh_client = paramiko.SSHClient()
     ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     ssh_client.connect(
         hostname, username=user,password=pword,port=port,
         allow_agent=False, look_for_keys=False
         )
+    # Keep idle pooled connections from being dropped by firewalls/NAT:
+    ssh_client.get_transport().set_keepalive(30)
     return ssh_client
 
 
+class SshPool(object):
+    """
+    Connected, authenticated SSHClients to one host, kept open and
+    reused so that each remote command doesn't pay for a new handshake
+    and login. At most 'size' idle clients are kept; more are opened
+    if several threads need one at the same time.
+    
+    Use session() to borrow a client:
+        with get_ssh_pool('mythbox').session() as client:
+            client.exec_command(...)
+    """
+    def __init__(self, hostname, size=2):
+        self.hostname = hostname
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    @staticmethod
+    def _is_alive(client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+    
+    def acquire(self):
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                return make_ssh_client(self.hostname)
+            if self._is_alive(client):
+                return client
+            client.close() # dropped while idle - try the next one
+    
+    def release(self, client):
+        if not self._is_alive(client):
+            client.close()
+            return
+        try:
+            self._idle.put_nowait(client)
+        except queue.Full:
+            client.close()
+    
+    @contextlib.contextmanager
+    def session(self):
+        client = self.acquire()
+        broken = False
+        try:
+            yield client
+        except Exception:
+            broken = True # don't hand a possibly broken connection to someone else
+            raise
+        finally:
+            # Also reached on GeneratorExit, when a generator holding a
+            # session (e.g. scan_remote_directories) is closed early
+            if broken:
+                client.close()
+            else:
+                self.release(client)
+    
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_ssh_pools = {}
+_ssh_pools_lock = threading.Lock()
+
+def get_ssh_pool(hostname):
+    """
+    Return: the shared SshPool for hostname, creating it on first use.
+    Its size is SSH_POOL_SIZE from the config.
+    """
+    with _ssh_pools_lock:
+        pool = _ssh_pools.get(hostname)
+        if pool is None:
+            pool = SshPool(hostname, size=get_config().ssh_pool_size)
+            _ssh_pools[hostname] = pool
+        return pool
+
+def ssh_session(hostname):
+    """
+    Shorthand for get_ssh_pool(hostname).session()
+    """
+    return get_ssh_pool(hostname).session()
+
+
+def _write_and_close(stdin, data):
+    stdin.write(data)
+    stdin.flush()
+    stdin.channel.shutdown_write()
+
+def _read_all(stream, chunks):
+    chunks.append(stream.read())
+
+def _read_stderr_in_background(stderr):
+    """
+    Starts reading a remote command's stderr on another thread, so that
+    a command writing a lot of errors can't fill the channel's window
+    while we are still reading its stdout, stalling both ends.
+    Return: [ thread, list that will hold the bytes read ]
+    """
+    chunks = []
+    reader = threading.Thread(target=_read_all, args=(stderr, chunks), daemon=True)
+    reader.start()
+    return [ reader, chunks ]
+
+def run_remote_command(hostname, command, input_data=None, timeout=None):
+    """
+    Runs a shell command on hostname over a pooled SSH connection.
+    Pass:
+      * hostname
+      * command - string, run by the remote user's shell
+      * input_data (optional) - bytes to send to the command's stdin
+      * timeout (optional) - seconds to wait for output before giving up
+    Return:
+      [ exit status, stdout as bytes, stderr as bytes ]
+    """
+    with ssh_session(hostname) as client:
+        stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+        writer = None
+        if input_data is not None:
+            # Write from another thread, so a command that answers as it
+            # reads (like xargs) can't fill the window and stall us both.
+            writer = threading.Thread(target=_write_and_close, args=(stdin, input_data), daemon=True)
+            writer.start()
+        else:
+            stdin.channel.shutdown_write()
+        err_reader, err_chunks = _read_stderr_in_background(stderr)
+        out = stdout.read()
+        err_reader.join()
+        err = b''.join(err_chunks)
+        if writer is not None:
+            writer.join()
+        status = stdout.channel.recv_exit_status()
+    return [ status, out, err ]
+
+
 """
 Execute a stat command on the remote host and
 parse the output into a dict to return.
@@ -69,12 +210,15 @@ def stat_remote_host(hostname, filespec, fields):
             raise Exception("Invalid field: {}".format(f))
         fields_requested += allowed_fields[f] + delimiter
     stat_cmd = 'stat -c {} {}'.format(fields_requested,filespec)
-    cl=make_ssh_client(hostname)
-    stdin,stdout,stderr = cl.exec_command(stat_cmd)
-    for l in stderr.readlines():
-        print(l)
+    with ssh_session(hostname) as cl:
+        stdin,stdout,stderr = cl.exec_command(stat_cmd)
+        err_reader, err_chunks = _read_stderr_in_background(stderr)
+        out_lines = stdout.readlines()
+        err_reader.join()
+        for l in b''.join(err_chunks).decode('utf-8', 'replace').splitlines():
+            print(l)
     ret_list=[]
-    for line in stdout.readlines():
+    for line in out_lines:
         line = line.strip()
         line = line.rstrip(delimiter)
         d = {}
@@ -84,6 +228,68 @@ def stat_remote_host(hostname, filespec, fields):
         ret_list.append(d)
     return ret_list
         
+"""
+Stat many files on a remote host with a single command.
+
+Pass:
+    * hostname
+    * paths -- an iterable of absolute file names. They are sent to the
+    remote host on stdin, NUL-separated, so there is no limit on how many
+    and no trouble with spaces or odd characters in the names.
+
+Return:
+    * a dict keyed by path. Each value is a dict:
+       { 'size': 12743, 'mtime': 1448215203.0, 'type': 'regular file' }
+    where type is the description from stat's %F ('regular file',
+    'directory', 'symbolic link', ...). Paths that don't exist on the
+    remote host are left out.
+"""
+def batch_stat_remote(hostname, paths):
+    paths = list(paths)
+    if len(paths) == 0:
+        return {}
+    data = b'\0'.join(p.encode('utf-8', 'surrogateescape') for p in paths) + b'\0'
+    cmd = "xargs -0 -r stat --printf '%n\\0%s\\0%Y\\0%F\\0' --"
+    status, out, err = run_remote_command(hostname, cmd, input_data=data)
+    # stat exits non-zero (and xargs with 123) if some paths were missing - that's fine.
+    fields = out.split(b'\0')
+    ret = {}
+    for i in range(0, len(fields) - 3, 4):
+        name = fields[i].decode('utf-8', 'surrogateescape')
+        ret[name] = {
+            'size': int(fields[i+1]),
+            'mtime': float(fields[i+2]),
+            'type': fields[i+3].decode('utf-8'),
+        }
+    return ret
+
+# Big SFTP windows let many write/read requests be in flight at once,
+# so a transfer isn't held to one round trip per 32 KB packet.
+SFTP_WINDOW_SIZE = 64 * 1024 * 1024
+SFTP_MAX_PACKET_SIZE = 32 * 1024
+
+def open_sftp(client):
+    """
+    Return: a paramiko SFTPClient on client's transport, with a large window
+    """
+    return paramiko.SFTPClient.from_transport(client.get_transport(),
+                window_size=SFTP_WINDOW_SIZE, max_packet_size=SFTP_MAX_PACKET_SIZE)
+
+def remove_remote_file(hostname, filespec):
+    """
+    Deletes a file on a remote host over SFTP.
+    Return: True if the file was removed, False if it wasn't there.
+    """
+    with ssh_session(hostname) as client:
+        sftp = open_sftp(client)
+        try:
+            sftp.remove(filespec)
+        except FileNotFoundError:
+            return False
+        finally:
+            sftp.close()
+    return True
+
 def size_remote_file(hostname, filespec):
     res_list = stat_remote_host(hostname, filespec, ['size'])
     if not res_list or len(res_list) == 0:
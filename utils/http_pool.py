@@ -0,0 +1,141 @@
+# Keep-alive HTTP connections for talking to the MythTV Services API.
+import http.client
+import queue
+import threading
+
+
+class HttpConnectionPool(object):
+    """
+    A small pool of persistent HTTP/1.1 connections to one
+    (host, port). Connections are handed out one request at a time
+    and put back once the response has been read in full, so a
+    scan that makes thousands of API calls needs only a handful of
+    TCP connections.
+
+    Keeps count of how many requests went over a reused connection
+    versus a newly opened one (see stats()).
+    """
+    # Errors meaning the server closed an idle keep-alive connection.
+    # A request that hits one of these on a reused connection is retried
+    # once on a fresh connection.
+    STALE_CONNECTION_ERRORS = (
+        http.client.RemoteDisconnected,
+        http.client.BadStatusLine,
+        BrokenPipeError,
+        ConnectionResetError,
+        ConnectionAbortedError,
+    )
+
+    def __init__(self, host, port, size=4, timeout=30):
+        self.host = host
+        self.port = int(port)
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._new = 0
+        self._reused = 0
+
+    def grow(self, size):
+        """
+        Raises the number of idle connections kept to size, if it is more.
+        """
+        with self._idle.mutex:
+            if size > self._idle.maxsize:
+                self._idle.maxsize = size
+                self.size = size
+
+    def _get(self):
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            reused = False
+        with self._lock:
+            if reused:
+                self._reused += 1
+            else:
+                self._new += 1
+        return conn, reused
+
+    def _put(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """
+        Sends one request and reads the whole response.
+        Pass:
+          * HTTP method and path (e.g. 'GET', '/Dvr/GetRecordedList')
+          * body (optional) - bytes
+          * headers (optional) - dict
+          * timeout (optional) - seconds, overriding the pool's default
+            for this request only
+        Return:
+          [ status code, reason, response body as bytes ]
+        Raises:
+          OSError or http.client.HTTPException if the server can't be reached
+        """
+        headers = dict(headers or {})
+        while True:
+            conn, reused = self._get()
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(self.timeout if timeout is None else timeout)
+                elif timeout is not None:
+                    conn.timeout = timeout
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except self.STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused:
+                    continue # server dropped an idle connection - try a new one
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                conn.timeout = self.timeout
+                self._put(conn)
+            return [ response.status, response.reason, data ]
+
+    def stats(self):
+        """
+        Return: dict with counts of 'new' and 'reused' connections,
+        and how many are sitting 'idle' in the pool.
+        """
+        with self._lock:
+            return { 'new': self._new, 'reused': self._reused, 'idle': self._idle.qsize() }
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host, port, size=4, timeout=30):
+    """
+    Return: the shared HttpConnectionPool for (host, port),
+    creating it on first use, and growing it if it keeps fewer than
+    size idle connections.
+    """
+    key = (host, int(port))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = HttpConnectionPool(host, port, size=size, timeout=timeout)
+            _pools[key] = pool
+        else:
+            pool.grow(size)
+        return pool
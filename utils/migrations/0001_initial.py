@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MythChannel',
+            fields=[
+                ('intid', models.AutoField(primary_key=True, serialize=False)),
+                ('channel_id', models.CharField(max_length=10, unique=True)),
+                ('channel_number', models.CharField(blank=True, default='', max_length=10)),
+                ('call_sign', models.CharField(blank=True, default='', max_length=64)),
+                ('channel_name', models.CharField(blank=True, default='', max_length=256)),
+                ('fetched', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'mythchannels',
+                'managed': True,
+            },
+        ),
+    ]
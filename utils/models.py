@@ -1,3 +1,36 @@
 from django.db import models
 
 # Create your models here.
+
+class MythChannel(models.Model):
+    """
+    Persisted copy of the MythTV backend's channel list, as fetched by
+    utils.myth.ChannelCatalogue. Lets scans and views resolve channel
+    names and numbers without asking the backend.
+    """
+    intid = models.AutoField(primary_key=True)
+    channel_id = models.CharField(max_length=10, unique=True)
+    channel_number = models.CharField(max_length=10, blank=True, default='')
+    call_sign = models.CharField(max_length=64, blank=True, default='')
+    channel_name = models.CharField(max_length=256, blank=True, default='')
+    fetched = models.DateTimeField()
+
+    @classmethod
+    def db_name(cls):
+        return 'default'
+
+    def as_channel_info(self):
+        """
+        Return: a dict with the same keys the MythTV API uses for
+        ChannelInfo, so callers can treat both alike.
+        """
+        return {
+            'ChanId': self.channel_id,
+            'ChanNum': self.channel_number,
+            'CallSign': self.call_sign,
+            'ChannelName': self.channel_name,
+        }
+
+    class Meta:
+        managed = True
+        db_table = 'mythchannels'
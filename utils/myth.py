@@ -1,31 +1,39 @@
 # Utility code for dealing with MythTV.
-import configparser
+import collections
+import concurrent.futures
 import datetime
-from glob import glob
 import iso8601
-import json
 import os.path
 import pytz
-import re
 import subprocess
 from socket import gethostname
-import urllib.request
+import threading
+import time
 
 
 
-from utils.date_and_time import ensure_tz_aware, ensure_utc, utc_dt_to_local_dt
-from orphans.models import Orphan
-from django.conf import settings
+from utils.config import get_config
+from utils.conversion_progress import ConversionProgress, ThroughputMeter, format_seconds
+from utils.myth_async import AsyncMythApi, run_sync
+from utils.scanner import mythtv_filename_pattern, scan_hosts
+from utils import sample_cache
+from utils.sample_cache import SampleCache, relink_preview_jobs, remove_previews_for, remove_sample_files
+from utils.scheduler import LoadAwareScheduler
+from utils.date_and_time import duration_to_seconds, ensure_tz_aware, ensure_utc, utc_dt_to_local_dt
+from orphans.models import Orphan, PreviewJob
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from tvrecordings.models import TvRecording
+from utils.models import MythChannel
 
-mythtv_filename_pattern = re.compile('\d{4}_\d{14}\.')
 REC_FILENAME_DATE_FORMAT = '%Y%m%d%H%M%S'
 BYTES_PER_MINUTE=38928300 # approx. 39 million bytes/minute in a
                             # SD Mythtv recording
                             
-def initialize_orphans_list(from_dir=None, filename_pattern=None, override=False):
+def initialize_orphans_list(from_dir=None, filename_pattern=None, override=False, batch_size=None, stats=None, remote=None):
     """
-    Reads files matching filename_pattern in from_dir. Presumably,
+    Reads files matching filename_pattern in from_dir (a directory, or a
+    list of directories). Presumably,
     these are files created by MythTV and were at one time associated with
     TV recordings. We want a list of files that are still present in that
     directory, but that MythTV no longer "knows" about, probably due to
@@ -33,112 +41,395 @@ def initialize_orphans_list(from_dir=None, filename_pattern=None, override=False
     
     For each file that is not associated with a MythTV tv recording
     (that is, for each "orphan,"), constructs an Orphan object and
-    saves it in this project's database.
+    saves it in this project's database. The Orphans are written
+    batch_size at a time, in a single transaction (see bulk_insert_orphans),
+    which also removes any existing entries.
     
-    If from_dir or filename_pattern is None, this method will use the defaults
-    from the project's configuration.
+    If from_dir is None, every storage group directory on the backend that
+    can hold recordings is scanned (see scan_directories_for). If
+    filename_pattern or batch_size is None, this method will use the
+    defaults from the project's configuration.
+    
+    The directories are read in parallel with os.scandir, and each file
+    is checked against MythTV's recordings as soon as it is found.
+    
+    If remote is True (default: SCAN_REMOTE_HOSTS from the config), and
+    from_dir is None, the recording directories of every host in the
+    backend's storage groups are scanned: this host's with os.scandir, the
+    others over SFTP, one pooled SSH connection per host (see
+    scan_targets_for). All hosts are scanned at once, and each Orphan
+    records the host its file is actually on.
+    
+    Files whose names aren't in MythTV's form (see mythtv_filename_pattern)
+    are skipped, and counted, rather than stopping the scan.
+    
+    If stats is a dict, it is filled in with:
+        * files_scanned
+        * files_skipped - names not in MythTV's form
+        * orphans_inserted
+        * seconds - elapsed time for the whole scan
+        * rows_per_second - orphans inserted per second of scan time
     
     ASSUMPTIONS:
         * from_dir is on localhost, or mounted via a network fs such as sshfs so
         that it's accessible as if it were on localhost.
+        * for a remote scan, SSH_CONFIGS has an entry for each remote host
         * no Orphan entries currently exist, or override==True
     
     """
-    # Any orphans there yet?
-    if Orphan.objects.count() > 0:
-        if override == False:
-            raise Exception('initialize_orphans_list called with override == False, but Orphans table already has entries')
-        else:
-            # Dump existing entries...
-            Orphan.objects.all().delete()
-    # Read configuration...
-    config_file = os.path.join(settings.BASE_DIR, 'mtv_settings.cfg')
-    cfg = configparser.ConfigParser(interpolation=None)
-    config_files_read = cfg.read(config_file)
-    if len(config_files_read) == 0:
-        raise Exception('Could not find config file {}'.format(config_file))
-    
-    # Verify running on localhost:
-    mythhost = cfg['MYTHTV_CONTENT'].get('MYTHBACKEND')
-    if mythhost != gethostname():
-        pass
-#         raise Exception('This version must run on MythTV backend - remote host functionality not yet implemented.')
+    started = time.time()
+    # Any orphans there yet? If so (and override is True), they are
+    # dumped only once the new list is ready - see below.
+    if Orphan.objects.count() > 0 and override == False:
+        raise Exception('initialize_orphans_list called with override == False, but Orphans table already has entries')
+    config = get_config()
+    if filename_pattern is None:
+        filename_pattern = config.recording_filename_pattern
+    if batch_size is None:
+        batch_size = config.orphan_batch_size
+    api = MythApi()
+    files_scanned = 0
+    files_skipped = 0
+    candidates = []
+    for f in scan_hosts(scan_targets_for(api, from_dir, remote), filename_pattern):
+        files_scanned += 1
+        if not mythtv_filename_pattern.match(f[2]):
+            files_skipped += 1
+            continue
+        if not api.is_tv_recording(f[2]):
+            candidates.append(f)
+    orphans = []
+    if len(candidates) > 0:
+        api.channels.prefetch(channel_id_from_filename(f[2]) for f in candidates)
+        orphans = [ make_orphan(api, host, d, fn, st) for host, d, fn, st in candidates ]
+    # The scan and channel lookups succeeded; replace the old list in one
+    # transaction, so a failure leaves it (and its titles) as it was.
+    # The preview manifest is kept: jobs are put back against the new
+    # orphans for the same recordings (see relink_preview_jobs). The
+    # previews of orphans that have gone are removed once that is committed.
+    with transaction.atomic(using=Orphan.db_name()):
+        jobs = list(PreviewJob.objects.all().iterator())
+        Orphan.objects.all().delete()
+        ocounter = bulk_insert_orphans(orphans, batch_size)
+        unmatched = relink_preview_jobs(jobs, batch_size)
+    remove_sample_files(job.sample_name for job in unmatched)
+    
+    if stats is not None:
+        elapsed = time.time() - started
+        stats['files_scanned'] = files_scanned
+        stats['files_skipped'] = files_skipped
+        stats['orphans_inserted'] = ocounter
+        stats['seconds'] = elapsed
+        stats['rows_per_second'] = ocounter / elapsed if elapsed > 0 else 0.0
+    return ocounter
+
+def scan_directories_for(api, from_dir=None):
+    """
+    Works out which directories an orphan scan should look at.
+    Pass:
+      * a MythApi instance
+      * from_dir (optional) - a directory, or a list of them
+    Return: a list of directories. If from_dir is None, these are all the
+    backend's storage group directories that can hold recordings, or
+    TV_RECORDINGS_DIR from the config if the backend lists none.
+    """
     if from_dir is None:
-        from_dir = cfg['MYTHTV_CONTENT'].get('TV_RECORDINGS_DIR')
+        dirs = api.recording_directories()
+        if len(dirs) == 0:
+            dirs = [ get_config().tv_recordings_dir ]
+    elif isinstance(from_dir, str):
+        dirs = [ from_dir ]
+    else:
+        dirs = list(from_dir)
+    return [ d.rstrip(os.sep) or os.sep for d in dirs ]
+
+def scan_targets_for(api, from_dir=None, remote=None):
+    """
+    Works out which hosts, and which of their directories, an orphan scan
+    should look at.
+    Pass:
+      * a MythApi instance
+      * from_dir (optional) - a directory, or a list of them
+      * remote (optional) - whether to scan every recording host;
+        defaults to SCAN_REMOTE_HOSTS from the config
+    Return: a list of [ hostname, list of directories, is_local ], as
+    taken by utils.scanner.scan_hosts.
+    If from_dir is given, or this isn't a remote scan, there is just one
+    target: the directories from scan_directories_for, read locally and
+    credited to the MythTV backend, as before. Otherwise there is one
+    target per host that has recording directories; only this host's
+    are read locally.
+    """
+    if remote is None:
+        remote = get_config().scan_remote_hosts
+    if from_dir is not None or not remote:
+        return [ [ api.server_name, scan_directories_for(api, from_dir), True ] ]
+    local_host = gethostname()
+    targets = []
+    for host in api.recording_hosts():
+        dirs = [ d.rstrip('/') or '/' for d in api.recording_directories(host) ]
+        targets.append([ host, dirs, host == local_host ])
+    if len(targets) == 0:
+        return [ [ api.server_name, scan_directories_for(api), True ] ]
+    return targets
+
+def make_orphan(api, hostname, directory, filename, st):
+    """
+    Builds (but does not save) an Orphan for a recording file.
+    Pass:
+      * a MythApi instance, used to look up the channel
+      * host and directory the file lives in, and the file's name
+      * the file's os.stat_result
+    """
+    o = Orphan()
+    local_dt, channel_id = parse_myth_filename(filename)
+    o.start_date = local_dt.date()
+    o.start_time = local_dt.time()
+    ci = api.channels.get(channel_id)
+    if ci is None:
+        raise Exception("Problem getting channel info for channel {}".format(channel_id))
+    o.channel_name = ci['ChannelName']
+    o.channel_number = ci['ChanNum']
+    o.channel_id = channel_id
+    o.title = ''
+    o.subtitle = ''
+    o.filename = filename
+    o.directory = directory
+    o.filesize = st.st_size
+    o.duration = int(round(o.filesize/BYTES_PER_MINUTE))
+    o.mtime = st.st_mtime
+    o.hostname = hostname
+    return o
+
+def refresh_orphans_list(from_dir=None, filename_pattern=None, batch_size=None, remote=None):
+    """
+    Incremental version of initialize_orphans_list. Instead of dumping the
+    orphans table and rebuilding it, compares the files in from_dir
+    (name, size and mtime) against the Orphan rows already there, and:
+        * inserts Orphans for new files that MythTV doesn't know about
+        * updates filesize, duration and mtime for files that changed,
+          and the directory of files that moved to another storage group
+        * deletes rows whose files are gone
+        * deletes rows whose files have become real MythTV recordings
+    Titles and subtitles entered by users are left alone.
+    
+    from_dir may be a directory or a list of them; if it is None, all the
+    backend's recording directories are scanned, as in
+    initialize_orphans_list - on every host, if remote is True (see
+    scan_targets_for). If filename_pattern or batch_size is None,
+    this method will use the defaults from the project's configuration.
+    
+    Return: a dict with the counts of each kind of change:
+        inserted, updated, unchanged, deleted_missing, deleted_recorded,
+        and skipped - files whose names aren't in MythTV's form
+    """
+    config = get_config()
     if filename_pattern is None:
-        filename_pattern = cfg['MYTHTV_CONTENT'].get('RECORDING_FILENAME_PATTERN')
-    filespec = os.path.join(from_dir, filename_pattern)
-    filelist = [ f for f in glob(filespec) if os.path.isfile(f) ] # don't bother with directories
-    if len(filelist) > 0:
-        api = MythApi()
-        ocounter = 0
-        for f in filelist:
-            orphandir,fn = os.path.split(f) # split into path and filename
-            if not api.is_tv_recording(fn):
-                o = Orphan()
-                local_dt, channel_id = parse_myth_filename(fn) 
-                o.start_date = local_dt.date()
-                o.start_time = local_dt.time()
-                ci = api.get_channel_info(channel_id)
-                o.channel_name = ci['ChannelName']
-                o.channel_number = ci['ChanNum']
-                o.channel_id = channel_id
-                o.title = ''
-                o.subtitle = ''
-                o.filename = fn
-                o.directory = orphandir
-                o.filesize = os.path.getsize(f)
-                o.duration = int(round(o.filesize/BYTES_PER_MINUTE))
-                o.hostname = mythhost
-                ocounter += 1
-                o.save()
-        
-        return ocounter        
+        filename_pattern = config.recording_filename_pattern
+    if batch_size is None:
+        batch_size = config.orphan_batch_size
+    
+    counts = { 'inserted': 0, 'updated': 0, 'unchanged': 0,
+               'deleted_missing': 0, 'deleted_recorded': 0, 'skipped': 0 }
+    api = MythApi()
+    targets = scan_targets_for(api, from_dir, remote)
+    existing = {}
+    for host, dirs, is_local in targets:
+        for o in Orphan.objects.filter(hostname=host, directory__in=dirs):
+            existing[(host, o.filename)] = o
+    new_files = []
+    changed = []
+    recorded_ids = []
+    for host, orphandir, fn, st in scan_hosts(targets, filename_pattern):
+        if not mythtv_filename_pattern.match(fn):
+            counts['skipped'] += 1
+            continue
+        o = existing.pop((host, fn), None)
+        if api.is_tv_recording(fn):
+            if o is not None:
+                recorded_ids.append(o.intid)
+            continue
+        if o is None:
+            new_files.append([ host, orphandir, fn, st ])
+        elif o.filesize != st.st_size or o.mtime != st.st_mtime or o.directory != orphandir:
+            o.directory = orphandir
+            o.filesize = st.st_size
+            o.duration = int(round(o.filesize/BYTES_PER_MINUTE))
+            o.mtime = st.st_mtime
+            changed.append(o)
+        else:
+            counts['unchanged'] += 1
+    # Whatever is left in existing has no file any more:
+    missing_ids = [ o.intid for o in existing.values() ]
+    api.channels.prefetch(channel_id_from_filename(f[2]) for f in new_files)
+    new_orphans = [ make_orphan(api, host, d, fn, st) for host, d, fn, st in new_files ]
+    
+    with transaction.atomic(using=Orphan.db_name()):
+        for o in changed:
+            Orphan.objects.filter(pk=o.intid).update(
+                directory=o.directory, filesize=o.filesize, duration=o.duration, mtime=o.mtime)
+        counts['updated'] = len(changed)
+        counts['deleted_missing'] = _delete_orphans_by_id(missing_ids, batch_size)
+        counts['deleted_recorded'] = _delete_orphans_by_id(recorded_ids, batch_size)
+        counts['inserted'] = bulk_insert_orphans(new_orphans, batch_size)
+    return counts
+
+def _delete_orphans_by_id(ids, batch_size):
+    # Chunked, to stay under SQLite's limit on query parameters.
+    for i in range(0, len(ids), batch_size):
+        remove_previews_for(ids[i:i+batch_size], batch_size)
+        Orphan.objects.filter(pk__in=ids[i:i+batch_size]).delete()
+    return len(ids)
+
+def bulk_insert_orphans(orphans, batch_size=500):
+    """
+    Saves a list of unsaved Orphan instances using bulk_create, batch_size
+    rows per INSERT, all inside one transaction (so SQLite syncs once
+    instead of once per row).
+    
+    Orphans whose (hostname, filename) is already in the table, or repeated
+    within the list, are skipped. If a batch still hits the unique constraint
+    (e.g. another process inserted a row meanwhile), that batch alone is
+    rolled back to its savepoint and retried row by row, skipping the
+    conflicting rows.
+    
+    Return: the number of rows inserted
+    """
+    db = Orphan.db_name()
+    inserted = 0
+    with transaction.atomic(using=db):
+        seen = set(Orphan.objects.values_list('hostname', 'filename'))
+        fresh = []
+        for o in orphans:
+            key = (o.hostname, o.filename)
+            if key not in seen:
+                seen.add(key)
+                fresh.append(o)
+        for i in range(0, len(fresh), batch_size):
+            batch = fresh[i:i+batch_size]
+            try:
+                with transaction.atomic(using=db):
+                    Orphan.objects.bulk_create(batch)
+                inserted += len(batch)
+            except IntegrityError:
+                for o in batch:
+                    try:
+                        with transaction.atomic(using=db):
+                            o.save()
+                        inserted += 1
+                    except IntegrityError:
+                        pass # already there -- leave existing row alone
+    return inserted
 
 def init_tvrecordings_list():
     """
-    Query MythTV backend server for list of TV programs. Save
-    an tvrecordings.models.TvRecording object for each program.
+    Query MythTV backend server for list of TV programs. Make sure
+    there's an up-to-date tvrecordings.models.TvRecording object for
+    each program (see sync_tvrecordings_list).
     Pass:
         Nothing
     Return:
         Count of programs
     """
-    # Clear old records in our internal table (NOT MythTV's records):
-    TvRecording.objects.all().delete()
-    
-    # Get a list of TV recordings from the MythTV backend via its api
+    return sync_tvrecordings_list()['total']
+
+# TvRecording fields that sync_tvrecordings_list keeps up to date. The
+# key fields (channel_id, start_utc_datetime) are matched, not updated.
+TVRECORDING_SYNC_FIELDS = ( 'hostname', 'directory', 'filename', 'filesize', 'duration',
+                            'title', 'subtitle', 'channel_name', 'channel_number' )
+
+def sync_tvrecordings_list(batch_size=500):
+    """
+    Brings our internal tvrecordings table (NOT MythTV's records) in line
+    with the backend's list of recordings, touching only what changed.
+    Rows are matched on the table's unique key, (channel_id, start_utc_datetime):
+        * recordings with no row are bulk-inserted
+        * rows whose other fields differ are updated
+        * rows for recordings the backend no longer has are deleted
+    All of it happens in one transaction.
+    Pass:
+        batch_size (optional) - rows per INSERT or DELETE statement
+    Return:
+        dict with the counts inserted, updated, deleted, unchanged, and
+        total (the number of recordings on the backend)
+    """
     api = MythApi()
-    rawlist = api.tv_recordings
-    
-    # For each list item, construct a TvRecording object and
-    # add it to our internal database
-    for rawdata in rawlist:
-        r = TvRecording()
-        r.filename = rawdata['FileName']
-        r.filesize = rawdata['FileSize']
-        r.hostname = rawdata['HostName']
-        storage_group = rawdata['Recording']['StorageGroup']
-        r.directory = api.storage_dir_for_name(storage_group, r.hostname)
-    
-        # Construct datetime objects from strings in rawdata - use them to
-        # figure difference between start and end, and round to nearest minute.
-        start_utc_string = rawdata['Recording']['StartTs']
-        end_utc_string = rawdata['Recording']['EndTs']
-        r.start_utc_datetime = iso8601.parse_date(start_utc_string, pytz.timezone('Etc/UTC'))
-        end_utc_datetime = iso8601.parse_date(end_utc_string, pytz.timezone('Etc/UTC'))
-        timediff = (end_utc_datetime - r.start_utc_datetime)
-        r.duration = round((timediff.seconds)/60)
-        
-        # Rest of fields of interest...
-        r.channel_id = rawdata['Channel']['ChanId']
-        r.channel_name = rawdata['Channel']['ChannelName']
-        r.channel_number = rawdata['Channel']['ChanNum']
-        r.title = rawdata['Title']
-        r.subtitle = rawdata['SubTitle']
-        r.save()
-    return len(rawlist)            
+    storage_dirs = api.storage_dir_map() # resolve directories with one dict lookup each
+    existing = {
+        (r.channel_id, r.start_utc_datetime): r for r in TvRecording.objects.all()
+        }
+    new_rows = []
+    changed = []
+    counts = { 'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'total': 0 }
+    seen = set()
+    for rec in api.iter_mythtv_recordings():
+        r = tvrecording_from_recording_info(rec, storage_dirs)
+        key = (r.channel_id, r.start_utc_datetime)
+        if key in seen:
+            continue # listed twice by the backend
+        seen.add(key)
+        counts['total'] += 1
+        old = existing.pop(key, None)
+        if old is None:
+            new_rows.append(r)
+            continue
+        values = { f: getattr(r, f) for f in TVRECORDING_SYNC_FIELDS }
+        if any(getattr(old, f) != v for f, v in values.items()):
+            changed.append([ old.intid, values ])
+        else:
+            counts['unchanged'] += 1
+    # Whatever is left in existing is gone from the backend:
+    removed_ids = [ r.intid for r in existing.values() ]
+    
+    with transaction.atomic(using=TvRecording.db_name()):
+        TvRecording.objects.bulk_create(new_rows, batch_size=batch_size)
+        for intid, values in changed:
+            TvRecording.objects.filter(pk=intid).update(**values)
+        for i in range(0, len(removed_ids), batch_size):
+            TvRecording.objects.filter(pk__in=removed_ids[i:i+batch_size]).delete()
+    counts['inserted'] = len(new_rows)
+    counts['updated'] = len(changed)
+    counts['deleted'] = len(removed_ids)
+    return counts
+
+def tvrecording_from_recording_info(rec, storage_dirs):
+    """
+    Builds (but does not save) a TvRecording.
+    Pass:
+      * a RecordingInfo from MythApi.iter_mythtv_recordings
+      * dict of storage directories, as from MythApi.storage_dir_map
+    """
+    r = TvRecording()
+    r.filename = rec.filename
+    r.filesize = rec.filesize
+    r.hostname = rec.hostname
+    r.directory = storage_dirs.get((rec.storage_group, rec.hostname))
+
+    # Construct datetime objects from strings in rec - use them to
+    # figure difference between start and end, and round to nearest minute.
+    r.start_utc_datetime = iso8601.parse_date(rec.start_ts, pytz.timezone('Etc/UTC'))
+    end_utc_datetime = iso8601.parse_date(rec.end_ts, pytz.timezone('Etc/UTC'))
+    timediff = (end_utc_datetime - r.start_utc_datetime)
+    r.duration = round((timediff.seconds)/60)
     
+    # Rest of fields of interest...
+    r.channel_id = str(rec.channel_id)
+    r.channel_name = rec.channel_name
+    try:
+        r.channel_number = int(rec.channel_number) # stored as a SmallIntegerField
+    except (TypeError, ValueError):
+        r.channel_number = rec.channel_number
+    r.title = rec.title
+    r.subtitle = rec.subtitle
+    return r
+    
+def channel_id_from_filename(filename):
+    """
+    Return: the channel id part of a MythTV recording file name,
+    e.g. '1008' for '1008_20151122180003.mpg'
+    """
+    return filename.split('_')[0]
+
 def parse_myth_filename(filename):
     # Verify filename fits pattern - "\d{4}_\d{14}\."
     # If not, bail out.
@@ -159,84 +450,410 @@ def parse_myth_filename(filename):
 
 
 
+def prober_for(converter):
+    """
+    Return: path of the probe program that comes with converter -
+    ffprobe for ffmpeg, avprobe for avconv - in the same directory
+    """
+    name = os.path.basename(converter).replace('ffmpeg', 'ffprobe').replace('avconv', 'avprobe')
+    return os.path.join(os.path.dirname(converter), name)
+
+def probe_duration(filespec, converter=None, timeout=60):
+    """
+    Return: the length of a media file in seconds, as the probe program
+    that comes with converter (default: VIDCONVERTER) reads it from the
+    file's container, or None if it can't be read
+    """
+    try:
+        out = subprocess.run([ prober_for(converter or get_config().vidconverter), '-v', 'error',
+                               '-show_entries', 'format=duration',
+                               '-of', 'default=noprint_wrappers=1:nokey=1', filespec ],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=timeout).stdout
+        seconds = float(out.decode('utf-8', 'replace').strip().splitlines()[0])
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError):
+        return None # no prober, unreadable file, or 'N/A'
+    return seconds if seconds > 0 else None
+
+
 class VideoSampleMaker(object):
-    def __init__(self, override=False):
+    TEMP_PREFIX = sample_cache.TEMP_PREFIX # conversions write to .part-<samplename> until complete
+    STATUS_INTERVAL = 10 # seconds between progress lines printed by make_video_samples
+    SAVE_INTERVAL = 2 # seconds between progress updates written to a PreviewJob
+    STDERR_LINES = 200 # lines of a converter's error output kept for the job's message
+    DISK_WAIT = 1800 # seconds to wait for free space (MIN_FREE_MB) before giving up on a run
+    # Kinds of preview, as set by PREVIEW_MODE in mtv_settings.cfg:
+    #   video  - the first PREVIEW_DURATION of the recording
+    #   sprite - SPRITE_FRAMES stills from across the recording, tiled into one image
+    #   clips  - CLIP_COUNT clips of CLIP_SECONDS from across the recording,
+    #            joined into one sample
+    # Video and clips samples are encoded with an encoder profile (PREVIEW_ENCODER,
+    # or the encoder passed in) - see ENCODER_PROFILES in utils.config.
+    MODES = ('video', 'sprite', 'clips')
+    # Modes whose commands depend on the recording's real length (see
+    # recording_seconds); run_preview_job builds them, on a worker thread
+    PROBED_MODES = ('sprite', 'clips')
+    
+    def __init__(self, override=False, mode=None, encoder=None):
         self.override = override
-                # Read configuration...
-        config_file = os.path.join(settings.BASE_DIR, 'mtv_settings.cfg')
-        self.cfg = configparser.ConfigParser(interpolation=None)
-        config_files_read = self.cfg.read(config_file)
-        if len(config_files_read) == 0:
-            raise Exception('Could not find config file {}'.format(config_file))
+        self.config = get_config()
+        self.mode = mode or self.config.preview_mode
+        if self.mode not in self.MODES:
+            raise Exception("Unknown preview mode '{}' - expected one of {}".format(self.mode, ', '.join(self.MODES)))
+        self.encoder = encoder or self.config.preview_encoder
+        if self.encoder not in self.config.encoder_profiles:
+            raise Exception("Unknown encoder profile '{}' - expected one of {}".format(
+                self.encoder, ', '.join(sorted(self.config.encoder_profiles))))
+        self.extension, self.encoder_args = self.config.encoder_profile(self.encoder)
+        self.max_attempts = self.config.preview_max_attempts
+        self.jobs = {} # PreviewJob instances, keyed by sample_name
+        self.meter = ThroughputMeter() # totals for make_video_samples
+        self.scheduler = None # a LoadAwareScheduler, while make_video_samples runs
+        self.already_there_count = 0
+        self.gave_up_count = 0
+        self.evicted_count = 0
+        self.cache_stats = None # from SampleCache.run, after make_video_samples
+        self.recording_durations = {} # seconds, keyed by Orphan intid - see recording_seconds
         self.characterize_orphans()
         self.empty_count = len(self.orphan_types['empty'])
-        self.already_there_count = len(self.orphan_types['already_there'])
+        self.already_there_count += len(self.orphan_types['already_there'])
+        self.gave_up_count += len(self.orphan_types['gave_up'])
+        self.evicted_count += len(self.orphan_types['evicted'])
         self.to_do_count = len(self.orphan_types['to_do'])
         
+    def sample_name_for(self, o):
+        """
+        Return: name of o's preview file, in VIDEO_SAMPLES_DIR, for this mode
+        and encoder profile
+        """
+        if self.mode == 'sprite':
+            return o.spritename
+        return os.path.splitext(o.filename)[0] + '.' + self.extension
+    
+    @property
+    def job_encoder(self):
+        """The encoder profile recorded in PreviewJobs - none for sprite sheets"""
+        return '' if self.mode == 'sprite' else self.encoder
+    
     def characterize_orphan(self, o):
         """
         Examines an Orphan instance and determines
         whether or not a sample should be created for it.
         No samples are needed for cases where:
             * Orphan's filesize is 0
-            * A sample for that Orphan already exists.
+            * A sample for that Orphan already exists (its PreviewJob is done).
+            * Making a sample has already failed PREVIEW_MAX_ATTEMPTS times
         For an Orphan which does need a sample,
-        a list of command parameters is prepared. The
-        name of the converter is obtained from mtv_settings.cfg.
+        a list of command parameters is prepared (see build_command) -
+        except in PROBED_MODES, where building it means probing the
+        recording; run_preview_job builds those on its worker thread,
+        so characterizing costs no subprocess per orphan.
         
         """
         # don't bother with zero-byte files...
         if o.filesize == 0:
             return ['empty', o, None]
     
-        # Check if preview file already exists...
-        if self.override == False:
-            outdir = os.path.join(settings.BASE_DIR, self.cfg['MYTHTV_CONTENT'].get('VIDEO_SAMPLES_DIR'))
-            outfilespec = os.path.join(outdir, o.samplename)
-            if os.path.exists(outfilespec):
+        # Check if preview file already exists (see reconcile_manifest)...
+        sample_name = self.sample_name_for(o)
+        job = self.jobs.get(sample_name)
+        if (self.override == False and job is not None
+                and job.profile == self.mode and job.encoder == self.job_encoder):
+            if job.state == PreviewJob.FAILED and job.attempts >= self.max_attempts:
+                return ['gave_up', o, None]
+            if job.state == PreviewJob.DONE:
                 return ['already_there', o, None]
+            if job.state == PreviewJob.EVICTED:
+                return ['evicted', o, None] # until someone views it - see utils.sample_cache
         
         # OK -- file with length > 0, and preview not already there
         # (or preview already there but override == True)    
-        duration = self.cfg['MYTHTV_CONTENT'].get('PREVIEW_DURATION')
-        converter = self.cfg['MYTHTV_CONTENT'].get('VIDCONVERTER')
-        vidqual = self.cfg['MYTHTV_CONTENT'].get('PREVIEW_QUALITY')
+        if self.mode in self.PROBED_MODES:
+            return ['to_do', o, None]
+        return ['to_do', o, self.build_command(o)]
+    
+    def build_command(self, o):
+        """
+        Return: the command list that makes o's sample. The
+        name of the converter is obtained from mtv_settings.cfg.
+        The command writes to a temporary file next to the sample;
+        run_preview_job renames it into place once it is complete.
+        """
+        converter = self.config.vidconverter
         infilespec = os.path.join(o.directory, o.filename)
-        # Construct a command list:
-        cmd = [
-               converter,
-               '-loglevel', '16', # print error messages to stderr, not general license and build info
-               '-ss', '00:00:00', # point in source file from which to start
-               '-i', infilespec, # input file
-               '-acodec','libvorbis', # audio codec
-               '-vcodec', 'libtheora', # video codec
-               '-qscale:v', vidqual, # video quality to use
-               '-t', duration, # duration to extract, eitstart_utc_stringher in seconds, or in HH:MM:SS format
-               outfilespec # destination file
-               ]
+        tmpfilespec = os.path.join(self.config.video_samples_dir,
+                                   self.TEMP_PREFIX + self.sample_name_for(o)) # same extension, so same format
+        if self.mode == 'sprite':
+            cmd = self.sprite_command(o, infilespec, tmpfilespec)
+        elif self.mode == 'clips':
+            cmd = self.clips_command(o, infilespec, tmpfilespec)
+        else:
+            cmd = self.video_command(o, infilespec, tmpfilespec)
         # avconv and ffmpeg have slightly different syntax. '-n' is not valid for avconv.
         if 'ffmpeg' in converter:
             cmd.insert(1, '-y' if self.override else '-n'  ) # -n means exit if destination file already exists.
         else:
             if self.override:
                 cmd.insert(1, '-y')
+        return cmd
+    
+    def video_command(self, o, infilespec, tmpfilespec, start='00:00:00', duration=None):
+        """
+        Return: command list for a PREVIEW_DURATION-long sample of the start
+        of o's recording - or, if start and duration are given, of that
+        stretch of it (see make_segmented_sample)
+        """
+        return [
+               self.config.vidconverter,
+               '-loglevel', '16', # print error messages to stderr, not general license and build info
+               '-ss', str(start), # point in source file from which to start
+               '-i', infilespec, # input file
+               ] + self.encoder_args + [ # codecs and quality, from the encoder profile
+               '-t', str(duration or self.config.preview_duration), # duration to extract, either in seconds, or in HH:MM:SS format
+               tmpfilespec # destination file
+               ]
+    
+    def sprite_command(self, o, infilespec, tmpfilespec):
+        """
+        Return: command list for a sprite sheet of o's recording - one
+        keyframe from each of SPRITE_FRAMES evenly spaced points, scaled to
+        SPRITE_TILE_WIDTH and tiled SPRITE_COLUMNS across into one image.
+        
+        Each point is a separate input with -ss before -i, so the converter
+        seeks straight to it in the file instead of decoding everything up to
+        it, and -skip_frame nokey means only the keyframe there is decoded.
+        A sheet takes seconds, however long the recording.
+        This needs ffmpeg; avconv has no tile filter.
+        """
+        frames = max(1, self.config.sprite_frames)
+        columns = max(1, min(self.config.sprite_columns, frames))
+        rows = (frames + columns - 1) // columns
+        width = self.config.sprite_tile_width
+        cmd = [ self.config.vidconverter, '-loglevel', '16' ]
+        filters = []
+        seconds = self.recording_seconds(o, infilespec)
+        for i, offset in enumerate(self.spread_offsets(o, frames, seconds=seconds)):
+            cmd += [ '-skip_frame', 'nokey', '-ss', '{:.1f}'.format(offset),
+                     '-t', '30', # don't read on if there's no keyframe nearby
+                     '-i', infilespec ]
+            filters.append('[{0}:v]trim=end_frame=1,setpts=PTS-STARTPTS,scale={1}:-2[v{0}]'.format(i, width))
+        filters.append('{}concat=n={}:v=1:a=0,tile={}x{}[sheet]'.format(
+            ''.join('[v{}]'.format(i) for i in range(frames)), frames, columns, rows))
+        cmd += [ '-filter_complex', ';'.join(filters), '-map', '[sheet]', '-frames:v', '1' ]
+        if self.config.sprite_format == 'webp':
+            cmd += [ '-quality', '75' ]
+        else:
+            cmd += [ '-q:v', '3', '-update', '1' ] # one still image, not a numbered sequence
+        cmd.append(tmpfilespec)
+        return cmd
+    
+    def clips_command(self, o, infilespec, tmpfilespec):
+        """
+        Return: command list for a sample made of CLIP_COUNT clips, each
+        CLIP_SECONDS long, taken from evenly spaced points in o's recording
+        and joined into one file.
         
-        return ['to_do', o, cmd ]
+        As in sprite_command, each clip is a separate input with -ss and -t
+        before -i: the converter seeks to the keyframe before each point and
+        decodes only from there, so it never decodes the parts of the
+        recording between clips. Four 30-second clips cost a fraction of
+        the CPU of a ten-minute sample, and skip the end of the previous
+        show and the ads at the start of the recording.
+        """
+        count = max(1, self.config.clip_count)
+        clip = self.config.clip_seconds
+        cmd = [ self.config.vidconverter, '-loglevel', '16' ]
+        seconds = self.recording_seconds(o, infilespec)
+        if seconds < count * clip:
+            clip = max(1, int(seconds // count)) # short recording - shorter clips, so they don't overlap
+        for offset in self.spread_offsets(o, count, clip, seconds=seconds):
+            cmd += [ '-ss', '{:.1f}'.format(offset), '-t', str(clip), '-i', infilespec ]
+        streams = ''.join('[{0}:v:0][{0}:a:0]'.format(i) for i in range(count))
+        cmd += [
+               '-filter_complex', '{}concat=n={}:v=1:a=1[v][a]'.format(streams, count),
+               '-map', '[v]', '-map', '[a]',
+               ] + self.encoder_args + [ # codecs and quality, from the encoder profile
+               tmpfilespec # destination file
+               ]
+        return cmd
+    
+    def spread_offsets(self, o, count, length=0, seconds=None):
+        """
+        Return: list of count offsets, in seconds, spread evenly over o's
+        recording - the middle of each of count equal slices, less half of
+        length, so that a clip of that length is centred in its slice.
+        seconds is the length of the recording (see recording_seconds);
+        if it isn't given, o.duration is used.
+        """
+        if not seconds:
+            seconds = (o.duration or 1) * 60 # duration is estimated from filesize, in minutes
+        return [ max(0, seconds * (i + 0.5) / count - length / 2) for i in range(count) ]
+    
+    def recording_seconds(self, o, infilespec):
+        """
+        Return: the real length of o's recording, in seconds, as the probe
+        program reads it from the file's container. o.duration is estimated
+        from the file size at SD bit rates (BYTES_PER_MINUTE), so an HD
+        recording's is about three times too long, and offsets spread over
+        it would mostly land past the end of the file.
+        Falls back to o.duration if the file can't be probed. Each
+        recording is probed once per VideoSampleMaker.
+        """
+        if o.intid in self.recording_durations:
+            return self.recording_durations[o.intid]
+        seconds = probe_duration(infilespec, self.config.vidconverter)
+        if not seconds:
+            seconds = (o.duration or 1) * 60
+        self.recording_durations[o.intid] = seconds
+        return seconds
     
     def characterize_orphans(self):
         """
         Examines each Orphan instance and determines whether a sample needs to be
         created for it. Sample creation is not needed for Orphans with zero-length
         files and Orphans that already have a sample.
+        
+        The PreviewJob table is the manifest of samples on disk; after
+        reconcile_manifest brings it up to date, orphans with a finished
+        sample (or that have failed too often) are left out by the query
+        itself, and only counted. The rest are read with .iterator(), so
+        memory use doesn't grow with the number of orphans.
+        
+        Every Orphan that needs a sample gets a pending PreviewJob.
+        Jobs still marked 'running' belong to a run that was interrupted
+        (only one VideoSampleMaker is expected to run at a time), so they
+        are put back to 'pending' first.
         """
-        self.orphan_types = { 'to_do': [], 'empty': [], 'already_there': [] }
+        self.orphan_types = { 'to_do': [], 'empty': [], 'already_there': [], 'gave_up': [], 'evicted': [] }
+        PreviewJob.objects.filter(state=PreviewJob.RUNNING).update(state=PreviewJob.PENDING)
+        self.reconcile_manifest()
+        
+        orphans = Orphan.objects.all()
+        # A sample made with another encoder doesn't count - it is made again
+        profile_jobs = PreviewJob.objects.filter(profile=self.mode, encoder=self.job_encoder)
+        if not self.override:
+            finished = profile_jobs.filter(state=PreviewJob.DONE)
+            gave_up = profile_jobs.filter(state=PreviewJob.FAILED, attempts__gte=self.max_attempts)
+            evicted = profile_jobs.filter(state=PreviewJob.EVICTED)
+            self.already_there_count = finished.count()
+            self.gave_up_count = gave_up.count()
+            self.evicted_count = evicted.count()
+            orphans = orphans.exclude(intid__in=finished.values('orphan_id')) \
+                             .exclude(intid__in=gave_up.values('orphan_id')) \
+                             .exclude(intid__in=evicted.values('orphan_id'))
+            profile_jobs = profile_jobs.exclude(state=PreviewJob.DONE)
+        self.jobs = { j.sample_name: j for j in profile_jobs.iterator() }
     
-        for o in Orphan.objects.all():
+        for o in orphans.iterator():
             c = self.characterize_orphan(o)
-            # c is a list: [0] is the type of orphan ('empty', 'already_there', or 'to_do')
+            # c is a list: [0] is the type of orphan ('empty', 'already_there', 'gave_up', 'evicted' or 'to_do')
             # [1] is the Orphan object
-            # [2] is the constructed command list to be passed to subprocess, if type is needs preview, otherwise None
+            # [2] is the constructed command list to be passed to subprocess, if type is needs preview
+            # (and the mode isn't one of PROBED_MODES), otherwise None
             self.orphan_types[c[0]].append([c[1],c[2]])
+        
+        # Queue a job for everything still to do. A job for the same file made
+        # under another profile or encoder (clips and video samples share a
+        # name, as do encoders with the same extension) is taken over, with
+        # its attempts reset.
+        to_do = { self.sample_name_for(o): o for o, cmd in self.orphan_types['to_do'] }
+        names = list(to_do)
+        with transaction.atomic(using=PreviewJob.db_name()):
+            for i in range(0, len(names), 500):
+                chunk = names[i:i+500]
+                existing = PreviewJob.objects.filter(sample_name__in=chunk)
+                existing.filter(profile=self.mode, encoder=self.job_encoder).exclude(state=PreviewJob.PENDING) \
+                        .update(state=PreviewJob.PENDING)
+                existing.exclude(profile=self.mode, encoder=self.job_encoder) \
+                        .update(state=PreviewJob.PENDING, profile=self.mode, encoder=self.job_encoder,
+                                attempts=0, output_size=0)
+                have = set(existing.values_list('sample_name', flat=True))
+                PreviewJob.objects.bulk_create([ PreviewJob(orphan=to_do[n], sample_name=n, profile=self.mode,
+                                                            encoder=self.job_encoder)
+                                                 for n in chunk if n not in have ])
+        self.jobs = {}
+        for i in range(0, len(names), 500):
+            for j in PreviewJob.objects.filter(sample_name__in=names[i:i+500]):
+                self.jobs[j.sample_name] = j
+    
+    def reconcile_manifest(self):
+        """
+        Brings the PreviewJob manifest into line with VIDEO_SAMPLES_DIR,
+        using a single scandir of that directory:
+            * 'done' jobs whose file has gone are put back to 'pending'
+            * sample files with no job at all (made before there was a job
+              table) are recorded too. Back then samples were written
+              straight to their final names, so one left by an interrupted
+              run may be truncated: files that pass untracked_sample_ok
+              are recorded as 'done', the rest as 'pending', to be made again
+        Return: [ number of jobs requeued, number of files recorded ]
+        """
+        outdir = self.config.video_samples_dir
+        present = {}
+        try:
+            with os.scandir(outdir) as it:
+                for entry in it:
+                    if not entry.name.startswith(self.TEMP_PREFIX) and entry.is_file():
+                        present[entry.name] = entry.stat().st_size
+        except FileNotFoundError:
+            pass
+        gone_ids = []
+        for intid, sample_name in PreviewJob.objects.filter(state=PreviewJob.DONE) \
+                                          .values_list('intid', 'sample_name').iterator():
+            if present.pop(sample_name, None) is None:
+                gone_ids.append(intid)
+        recorded = []
+        if present:
+            # Untracked files: match them to orphans by the recording's base name
+            known = set(PreviewJob.objects.exclude(state=PreviewJob.DONE)
+                        .values_list('sample_name', flat=True).iterator())
+            untracked = {}
+            for name, size in present.items():
+                if name not in known:
+                    untracked.setdefault(name.split('.')[0], []).append([ name, size ])
+            if untracked:
+                # Guess the encoder from the extension; the first profile to use one wins
+                encoders = {}
+                for name, (ext, args) in sorted(self.config.encoder_profiles.items()):
+                    encoders.setdefault(ext, name)
+                for o in Orphan.objects.only('intid', 'filename', 'duration').iterator():
+                    for name, size in untracked.pop(os.path.splitext(o.filename)[0], ()):
+                        profile = 'sprite' if '.sprite.' in name else 'video'
+                        encoder = '' if profile == 'sprite' else encoders.get(os.path.splitext(name)[1].lstrip('.'), '')
+                        recorded.append([ o, PreviewJob(orphan=o, sample_name=name, profile=profile, encoder=encoder,
+                                                        output_size=size) ])
+                # Checked in parallel: each video sample check runs the probe program
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.config.preview_workers)) as pool:
+                    oks = list(pool.map(lambda r: self.untracked_sample_ok(r[0], r[1]), recorded))
+                for (o, job), ok in zip(recorded, oks):
+                    job.state = PreviewJob.DONE if ok else PreviewJob.PENDING
+                    if not ok:
+                        job.output_size = 0
+                recorded = [ job for o, job in recorded ]
+        with transaction.atomic(using=PreviewJob.db_name()):
+            for i in range(0, len(gone_ids), 500):
+                PreviewJob.objects.filter(pk__in=gone_ids[i:i+500]).update(state=PreviewJob.PENDING)
+            PreviewJob.objects.bulk_create(recorded, batch_size=500)
+        return [ len(gone_ids), len(recorded) ]
+    
+    def untracked_sample_ok(self, o, job):
+        """
+        A cheap check of a sample file that has no job (see reconcile_manifest).
+        Return: True if it looks complete - not empty and, for a video
+        sample, at least 90% of the length it should have (PREVIEW_DURATION,
+        or the whole recording if that is shorter by its size-based estimate)
+        """
+        if job.output_size <= 0:
+            return False
+        if job.profile == 'sprite':
+            return True
+        seconds = probe_duration(os.path.join(self.config.video_samples_dir, job.sample_name),
+                                 self.config.vidconverter)
+        if seconds is None:
+            return False
+        expected = duration_to_seconds(self.config.preview_duration)
+        if o.duration:
+            expected = min(expected, o.duration * 60)
+        return seconds >= 0.9 * expected
     
     def make_video_samples(self):
         """
@@ -250,6 +867,19 @@ class VideoSampleMaker(object):
         If override is False (the default), the method
         will not overwrite preview files that already exist.
         
+        Before and after, VIDEO_SAMPLES_DIR is brought within its quota
+        (see utils.sample_cache.SampleCache); the results of the last
+        pass are left in self.cache_stats.
+        
+        Conversions are started as a LoadAwareScheduler allows: fewer
+        than PREVIEW_WORKERS at a time when the machine is busy, none
+        while a recording is in progress or the samples disk is nearly
+        full, and always at low CPU and I/O priority. While paused for
+        free space, the samples cache is swept and its quota enforced
+        again; if there still isn't room after DISK_WAIT seconds, the
+        conversions not yet started are given up (and left pending for
+        the next run), each reported as a failure.
+        
         ASSUMPTIONS:
             * The host is running Linux or a compatible OS. "Compatible" means, probably,
             Linux or a closely-related OS such as FreeBSD, with a POSIX or near-POSIX
@@ -261,36 +891,273 @@ class VideoSampleMaker(object):
             
         """
         to_do_list = self.orphan_types['to_do']
-        retlist = []
-        for i, item in enumerate(to_do_list, start=1):
-            print("\nProcessing item {} of {}...".format(i,self.to_do_count))
-            # item is [ orphan, cmd ]
-            o = item[0]
-            cmd = item[1]
-            res = self.make_video_sample(cmd)
-            res.append(o.filename)
-            # res is [ returncode, error message (if any), filename ]
-            retlist.append(res)#         if res[0] == 0:
+        cache = SampleCache(self.config)
+        cache.run() # make room before adding more
+        workers = self.config.preview_workers
+        if self.segmenting:
+            # Each job runs PREVIEW_SEGMENTS converters of its own
+            workers = workers // self.config.preview_segments
+        timeout = self.config.preview_timeout
+        retlist = [ None ] * len(to_do_list)
+        self.meter = ThroughputMeter()
+        # The work is done by ffmpeg/avconv child processes, so threads
+        # are enough to keep up to 'workers' conversions running at once.
+        workers = max(1, workers)
+        try:
+            api = MythApi()
+        except Exception:
+            api = None # can't check for recordings, but load and disk checks still apply
+        self.scheduler = LoadAwareScheduler(self.config, api)
+        paused_reason = None
+        low_disk_since = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            pending = set()
+            next_item = 0
+            done = 0
+            while next_item < len(to_do_list) or pending:
+                allowed = self.scheduler.allowed_workers(workers)
+                while next_item < len(to_do_list) and len(pending) < allowed:
+                    # item is [ orphan, cmd ]
+                    item = to_do_list[next_item]
+                    future = pool.submit(self.run_preview_job, item[0], item[1], timeout)
+                    futures[future] = next_item
+                    pending.add(future)
+                    next_item += 1
+                if allowed < workers and self.scheduler.reason != paused_reason:
+                    paused_reason = self.scheduler.reason
+                    print("Running {} of {} conversions at a time: {}".format(allowed, workers, paused_reason))
+                if not pending:
+                    if self.scheduler.low_disk:
+                        low_disk_since = low_disk_since or time.time()
+                        cache.run() # may free enough to carry on
+                        if time.time() - low_disk_since >= self.DISK_WAIT:
+                            message = 'Not started: {} after waiting {}.'.format(
+                                self.scheduler.reason, format_seconds(self.DISK_WAIT))
+                            print(message)
+                            for i in range(next_item, len(to_do_list)):
+                                retlist[i] = [ 1, message.encode('utf-8'), to_do_list[i][0].filename ]
+                            break
+                    time.sleep(self.scheduler.check_interval) # paused
+                    continue
+                low_disk_since = None
+                finished, pending = concurrent.futures.wait(
+                    pending, timeout=self.STATUS_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED)
+                if not finished:
+                    print(self.meter.summary())
+                for future in finished:
+                    done += 1
+                    i = futures[future]
+                    o = to_do_list[i][0]
+                    res = future.result()
+                    res.append(o.filename)
+                    # res is [ returncode, error message (if any), filename ]
+                    retlist[i] = res
+                    print("\nFinished item {} of {} ({})...".format(done, self.to_do_count, o.filename))
     
+        self.cache_stats = cache.run()
         return retlist
     
-    def make_video_sample(self, cmd):
+    def run_preview_job(self, o, cmd, timeout=None):
+        """
+        Runs one conversion and records it in o's PreviewJob: attempts,
+        start and finish times, output size, and the error message if it
+        failed. While it runs, the job's position, fps and speed are kept
+        up to date (every SAVE_INTERVAL seconds), for the status page.
+        The converter writes to a temporary file, which is renamed to the
+        sample's real name only on success, so a half-written sample never
+        looks like a finished one.
+        Only the fields this method owns are saved, so a last_viewed set
+        by a view while the conversion runs is kept.
+        Pass:
+          * Orphan, and the command list generated for it by characterize_orphan
+            (None in PROBED_MODES: it is built here, so probing the recording
+            happens on the worker thread)
+          * timeout (optional) - see make_video_sample
+        Return:
+          same as make_video_sample
+        """
+        if cmd is None:
+            cmd = self.build_command(o) # PROBED_MODES - see characterize_orphan
+        sample_name = self.sample_name_for(o)
+        job = self.jobs[sample_name]
+        tmpfilespec = cmd[-1]
+        outfilespec = os.path.join(os.path.dirname(tmpfilespec), sample_name)
+        if os.path.exists(tmpfilespec):
+            os.remove(tmpfilespec) # left behind by an interrupted run
+        job.state = PreviewJob.RUNNING
+        job.profile = self.mode
+        job.encoder = self.job_encoder
+        job.attempts += 1
+        job.started = timezone.now()
+        job.finished = None
+        job.message = ''
+        job.target_seconds = self.expected_seconds(o) or 0
+        job.position = job.fps = job.speed = 0
+        job.save(update_fields=[ 'state', 'profile', 'encoder', 'attempts', 'started', 'finished',
+                                 'message', 'target_seconds', 'position', 'fps', 'speed' ])
+        
+        last_save = [ 0 ]
+        def save_progress(p):
+            if time.time() - last_save[0] >= self.SAVE_INTERVAL:
+                last_save[0] = time.time()
+                PreviewJob.objects.filter(pk=job.intid).update(position=p.position, fps=p.fps, speed=p.speed)
+        progress = ConversionProgress(o.filename, self.expected_seconds(o), save_progress)
+        self.meter.start(progress)
+        try:
+            if self.segmenting:
+                res = self.make_segmented_sample(o, cmd, timeout, progress)
+            else:
+                res = self.make_video_sample(cmd, timeout, progress)
+        finally:
+            self.meter.finish(progress)
+        job.position = progress.position
+        job.fps = job.speed = 0
+        job.finished = timezone.now()
+        if res[0] == 0 and not os.path.exists(tmpfilespec):
+            res = [1, b'Converter exited normally but wrote no output.']
+        if res[0] == 0:
+            os.replace(tmpfilespec, outfilespec)
+            job.state = PreviewJob.DONE
+            job.output_size = os.path.getsize(outfilespec)
+        else:
+            if os.path.exists(tmpfilespec):
+                os.remove(tmpfilespec)
+            job.state = PreviewJob.FAILED
+            job.message = res[1].decode('utf-8', 'replace')
+        job.save(update_fields=[ 'state', 'finished', 'output_size', 'message', 'position', 'fps', 'speed' ])
+        return res
+    
+    def expected_seconds(self, o):
+        """
+        Return: seconds of output a conversion for o should produce,
+        or None if that isn't measured in time (sprite sheets)
+        """
+        if self.mode == 'sprite':
+            return None
+        if self.mode == 'clips':
+            total = self.config.clip_count * self.config.clip_seconds
+            # Shorter clips for short recordings - see clips_command, which
+            # run_preview_job has called, on this thread, by the time this is
+            if o.intid in self.recording_durations:
+                total = min(total, self.recording_durations[o.intid])
+            return total
+        total = duration_to_seconds(self.config.preview_duration)
+        if o.duration:
+            total = min(total, o.duration * 60)
+        return total
+    
+    @property
+    def segmenting(self):
+        """
+        True if each video sample is to be made in PREVIEW_SEGMENTS pieces
+        at once (ffmpeg only - avconv's concat demuxer lacks -safe).
+        """
+        return (self.mode == 'video' and self.config.preview_segments > 1
+                and 'ffmpeg' in self.config.vidconverter)
+    
+    def make_segmented_sample(self, o, cmd, timeout=None, progress=None):
+        """
+        Makes a video sample in PREVIEW_SEGMENTS time slices, each encoded by
+        its own converter process on its own core, then joins the slices
+        with ffmpeg's concat demuxer and -c copy, which neither decodes nor
+        re-encodes anything. A long sample is ready in roughly 1/PREVIEW_SEGMENTS
+        of the time one process would take.
+        Pass:
+          * Orphan, and the command list generated for it by characterize_orphan
+            (its last item is the file to write)
+          * timeout (optional) - applies to each slice, and to the join
+          * progress (optional) - a ConversionProgress, fed by every slice
+        Return:
+          same as make_video_sample
+        """
+        tmpfilespec = cmd[-1]
+        base = os.path.splitext(tmpfilespec)[0]
+        ext = os.path.splitext(tmpfilespec)[1]
+        infilespec = os.path.join(o.directory, o.filename)
+        total = self.expected_seconds(o)
+        count = self.config.preview_segments
+        length = total / count
+        seg_cmds = []
+        for i in range(count):
+            segfilespec = '{}.seg{:02d}{}'.format(base, i, ext)
+            seg_cmd = self.video_command(o, infilespec, segfilespec,
+                                         start='{:.3f}'.format(i * length), duration='{:.3f}'.format(length))
+            seg_cmd.insert(1, '-y')
+            seg_cmds.append(seg_cmd)
+        listfilespec = base + '.concat.txt'
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=count) as pool:
+                results = list(pool.map(lambda i: self.make_video_sample(seg_cmds[i], timeout, progress, i),
+                                        range(count)))
+            for res in results:
+                if res[0] != 0:
+                    return res
+            with open(listfilespec, 'w') as f:
+                for c in seg_cmds:
+                    f.write("file '{}'\n".format(c[-1].replace("'", "'\\''")))
+            return self.make_video_sample([ self.config.vidconverter, '-loglevel', '16', '-y',
+                                            '-f', 'concat', '-safe', '0', '-i', listfilespec,
+                                            '-c', 'copy', tmpfilespec ], timeout)
+        finally:
+            for c in seg_cmds:
+                if os.path.exists(c[-1]):
+                    os.remove(c[-1])
+            if os.path.exists(listfilespec):
+                os.remove(listfilespec)
+    
+    def make_video_sample(self, cmd, timeout=None, progress=None, stream=0):
         """
         Processes the cmd list for a single file
         Pass:
           * command list generated by characterize_orphan
+          * timeout (optional) - seconds to allow the conversion to run. If it
+            takes longer, the converter is killed and its partial output removed.
+          * progress (optional) - a ConversionProgress to feed with ffmpeg's
+            '-progress' output as it arrives (under the key stream)
         Return:
-          On success, returns a list consisting of [ 0 (to signal success), stdout from subprocess ]
+          On success, returns a list consisting of [ 0 (to signal success), b'' ]
           On failure, returns a list consisting of [ subprocess return code, stderr from subprocess ]
+          Only the last STDERR_LINES lines of stderr are kept.
           
         """
+        if timeout is not None and timeout <= 0:
+            timeout = None
+        if progress is not None and 'ffmpeg' in os.path.basename(cmd[0]):
+            cmd = cmd[:1] + [ '-progress', 'pipe:1', '-nostats' ] + cmd[1:]
+        if self.scheduler is not None:
+            cmd = self.scheduler.wrap(cmd)
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        res = proc.communicate()
-        # res[0] is stdout, res[1] is stderr
+        errors = collections.deque(maxlen=self.STDERR_LINES)
+        err_reader = threading.Thread(target=errors.extend, args=(proc.stderr,), daemon=True)
+        err_reader.start()
+        timed_out = threading.Event()
+        def kill():
+            timed_out.set()
+            proc.kill()
+        timer = threading.Timer(timeout, kill) if timeout is not None else None
+        if timer is not None:
+            timer.start()
+        try:
+            for line in proc.stdout:
+                if progress is not None:
+                    progress.feed(line.decode('ascii', 'replace'), stream)
+            proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        err_reader.join()
+        stderr = b''.join(errors)
+        if timed_out.is_set():
+            outfilespec = cmd[-1]
+            if os.path.exists(outfilespec):
+                os.remove(outfilespec) # don't leave a truncated sample behind
+            msg = "Conversion timed out after {} seconds.\n".format(timeout).encode('utf-8')
+            return [proc.returncode, msg + stderr]
         if proc.returncode != 0:
-            return [proc.returncode,res[1]]
+            return [proc.returncode, stderr]
         else:
-            return [0,res[0]]
+            return [0, b'']
         
 #     
 #     def make_video_samples(override=False):
@@ -298,13 +1165,208 @@ class VideoSampleMaker(object):
 #         to_do_list = orphan_types['to_do']
 #         conversion_results = execute_video_sample_converter(to_do_list)
 #         return ( orphan_types, conversion_results )
-#     
-    
+#
+
+
+class RecordingIndex(object):
+    """
+    Hash-based lookup table over the recordings (RecordingInfo)
+    returned by one Dvr/GetRecordedList fetch. Replaces linear scans of
+    MythApi.tv_recordings, which made orphan detection
+    O(files x recordings).
+
+    Recordings are indexed two ways:
+        * by (HostName, FileName)
+        * by (ChanId, StartTs) -- StartTs is the actual recording start,
+          as an ISO string in UTC (e.g. '2015-11-22T18:00:03Z')
+    A set of bare file names is kept as well, for callers that
+    don't know which host a file belongs to.
+    """
+    START_TS_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+    def __init__(self, recordings):
+        self._by_host_file = {}
+        self._by_chan_start = {}
+        self._filenames = set()
+        for r in recordings:
+            self._by_host_file[(r.hostname, r.filename)] = r
+            self._filenames.add(r.filename)
+            self._by_chan_start[(r.channel_id, r.start_ts)] = r
+
+    def __len__(self):
+        return len(self._by_host_file)
+
+    @classmethod
+    def normalize_start_ts(cls, start_ts):
+        """
+        Pass: a StartTs string from the MythTV API, or a datetime
+        Return: the string form used as part of the index key.
+        Naive datetimes are assumed to be UTC.
+        """
+        if isinstance(start_ts, datetime.datetime):
+            start_ts = ensure_tz_aware(start_ts).astimezone(pytz.utc)
+            return start_ts.strftime(cls.START_TS_FORMAT)
+        return start_ts
+
+    def contains_file(self, filename, hostname=None):
+        if hostname is None:
+            return filename in self._filenames
+        return (hostname, filename) in self._by_host_file
+
+    def find_by_file(self, filename, hostname):
+        """
+        Return: the RecordingInfo for this file on this host, or None.
+        """
+        return self._by_host_file.get((hostname, filename))
+
+    def find_by_channel_start(self, channel_id, start_ts):
+        """
+        Return: the RecordingInfo recorded on this channel starting
+        at start_ts, or None.
+        """
+        key = (str(channel_id), self.normalize_start_ts(start_ts))
+        return self._by_chan_start.get(key)
+
+
+class ChannelCatalogue(object):
+    """
+    In-memory cache of every channel the backend knows about, keyed
+    by ChanId. The whole list is loaded with a single
+    Channel/GetChannelInfoList call and kept for ttl seconds, so
+    resolving a channel's name and number normally costs no network
+    round trip at all.
+
+    If persist is True, each fetched list is also written to the
+    MythChannel table in the default database. A fresh enough copy
+    there is used instead of asking the backend, and a stale copy is
+    used as a last resort if the backend can't be reached.
+
+    Entries are dicts with the MythTV ChannelInfo keys
+    ChanId, ChanNum, CallSign and ChannelName.
+    """
+    def __init__(self, api, ttl=3600, persist=False):
+        self.api = api
+        self.ttl = ttl
+        self.persist = persist
+        self._channels = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_stale(self):
+        return self._loaded_at is None or time.time() - self._loaded_at > self.ttl
+
+    def get(self, channel_id):
+        """
+        Pass: Channel id, for example '1008'
+        Return: the channel's info dict, or None if the backend
+        doesn't know the channel.
+        """
+        channel_id = str(channel_id)
+        if self.is_stale:
+            self.reload()
+        ci = self._channels.get(channel_id)
+        if ci is None:
+            # Maybe added since the list was fetched -- ask for just this one.
+            try:
+                ci = self._compact(self.api.get_channel_info(channel_id))
+            except Exception:
+                return None
+            with self._lock:
+                self._channels[channel_id] = ci
+        return ci
+
+    def prefetch(self, channel_ids):
+        """
+        Makes sure every channel in channel_ids is cached. Any that
+        weren't in the bulk list are looked up with concurrent
+        GetChannelInfo calls, rather than one at a time by get().
+        """
+        if self.is_stale:
+            self.reload()
+        missing = set(str(c) for c in channel_ids) - set(self._channels)
+        if missing:
+            found = self.api.get_channel_infos(missing)
+            with self._lock:
+                for channel_id, info in found.items():
+                    self._channels[channel_id] = self._compact(info)
+
+    def reload(self, force=False):
+        """
+        Refill the cache. Unless force is True, a persisted copy
+        younger than ttl is preferred over a network call.
+        """
+        with self._lock:
+            if not force and not self.is_stale:
+                return # another thread got here first
+            if self.persist and not force:
+                channels, fetched = self._read_persisted()
+                if channels and time.time() - fetched.timestamp() <= self.ttl:
+                    self._set(channels, fetched.timestamp())
+                    return
+            try:
+                infos = self.api.get_channel_info_list()
+            except Exception:
+                if self.persist:
+                    channels, fetched = self._read_persisted()
+                    if channels:
+                        self._set(channels, time.time())
+                        return
+                raise
+            channels = {}
+            for info in infos:
+                ci = self._compact(info)
+                channels[ci['ChanId']] = ci
+            self._set(channels, time.time())
+            if self.persist:
+                self._write_persisted(channels)
+
+    def _set(self, channels, loaded_at):
+        self._channels = channels
+        self._loaded_at = loaded_at
+
+    @staticmethod
+    def _compact(info):
+        return {
+            'ChanId': str(info['ChanId']),
+            'ChanNum': info.get('ChanNum', ''),
+            'CallSign': info.get('CallSign', ''),
+            'ChannelName': info.get('ChannelName', ''),
+        }
+
+    @staticmethod
+    def _read_persisted():
+        """
+        Return: [ dict of channel info keyed by ChanId, time of fetch ],
+        or [ {}, None ] if nothing has been persisted.
+        """
+        rows = list(MythChannel.objects.all())
+        if len(rows) == 0:
+            return [ {}, None ]
+        channels = { r.channel_id: r.as_channel_info() for r in rows }
+        return [ channels, min(r.fetched for r in rows) ]
+
+    @staticmethod
+    def _write_persisted(channels):
+        now = timezone.now()
+        rows = [
+            MythChannel(channel_id=ci['ChanId'], channel_number=ci['ChanNum'],
+                        call_sign=ci['CallSign'], channel_name=ci['ChannelName'],
+                        fetched=now)
+            for ci in channels.values()
+            ]
+        with transaction.atomic(using=MythChannel.db_name()):
+            MythChannel.objects.all().delete()
+            MythChannel.objects.bulk_create(rows)
+
 
 class MythApi(object):
     """
     Wrapper for calls to MythTV API.
     Singleton
+    The calls themselves are made by self.aio, an AsyncMythApi;
+    the methods here just run them to completion. Code that wants
+    to overlap many calls can await self.aio's coroutines directly.
     """
     __instance = None
     def __new__(cls, server_name=None, server_port=None):
@@ -313,21 +1375,26 @@ class MythApi(object):
         If __instance isn't already there, build it and initialize
         some of its data. Then return it.
         """
-        # Read configuration...
-        config_file = os.path.join(settings.BASE_DIR, 'mtv_settings.cfg')
-        cfg = configparser.ConfigParser(interpolation=None)
-        config_files_read = cfg.read(config_file)
-        if len(config_files_read) == 0:
-            raise Exception('Could not find config file {}'.format(config_file))
-        if server_name is None:
-            server_name=cfg['MYTHTV_CONTENT'].get('MYTHBACKEND')
-        if server_port is None:
-            server_port=cfg['MYTHTV_CONTENT'].get('API_PORT')
         if MythApi.__instance is None:
+            config = get_config()
+            if server_name is None:
+                server_name=config.mythbackend
+            if server_port is None:
+                server_port=config.api_port
             MythApi.__instance = object.__new__(cls)
             MythApi.__instance.server_name = server_name
             MythApi.__instance.server_port = server_port
+            MythApi.__instance.aio = AsyncMythApi(server_name, server_port,
+                concurrency=config.api_concurrency,
+                pool_size=config.api_pool_size,
+                timeout=config.api_timeout)
+            MythApi.__instance.http_pool = MythApi.__instance.aio.http_pool
+            MythApi.__instance.recording_page_size = config.recording_page_size
             MythApi.__instance._tv_recordings = None # Don't get this unless and until it's needed.
+            MythApi.__instance._recording_index = None # Built from _tv_recordings on first lookup
+            MythApi.__instance.channels = ChannelCatalogue(MythApi.__instance,
+                ttl=config.channel_cache_ttl,
+                persist=config.persist_channel_cache)
             MythApi.__instance._storage_groups = MythApi.__instance._fill_myth_storage_group_list()
             MythApi.__instance.videos_directory = MythApi.__instance.storage_dir_for_name('Videos', server_name)
             MythApi.__instance.default_directory = MythApi.__instance.storage_dir_for_name('Default', server_name)
@@ -336,13 +1403,36 @@ class MythApi(object):
     """
     This is a property because initializing the list is expensive,
     and this is a simple way to make the initialization "lazy."
+    The list holds compact RecordingInfo records, not the API's
+    full program dicts.
     """
     @property
     def tv_recordings(self):
         if self._tv_recordings is None:
-            self._tv_recordings = self.get_mythtv_recording_list()
+            self._tv_recordings = list(self.iter_mythtv_recordings())
+            self._recording_index = None # stale -- belongs to previous fetch
         return self._tv_recordings
-    
+
+    """
+    Hash index over tv_recordings. Built once per GetRecordedList
+    fetch, and rebuilt after refresh_tv_recordings().
+    """
+    @property
+    def recording_index(self):
+        recordings = self.tv_recordings
+        if self._recording_index is None:
+            self._recording_index = RecordingIndex(recordings)
+        return self._recording_index
+
+    def refresh_tv_recordings(self):
+        """
+        Discard the cached recording list (and its index) and
+        fetch a fresh copy from the backend.
+        """
+        self._tv_recordings = None
+        self._recording_index = None
+        return self.tv_recordings
+
     """
     storage_groups is a property because
          it's read-only.
@@ -352,43 +1442,19 @@ class MythApi(object):
         return self._storage_groups    
     """
     Make a call to the MythTV API and request JSON back from MythTV server.
-    Pass:
-      * name of API service
-      * name of API call within service
-      * data (optional) - a dict of parameters for the call
-      * headers (optional)
-    Returns:
-      * A JSON object built from the data returned from the MythTV server
-    Raises:
-      * HTTPError
-    """
-    def _call_myth_api(self,service_name, call_name, data=None, headers={}):
-        # Tell server to send back JSON:
-        headers['Accept'] = 'application/json'
-        
-        if data:
-            DATA=urllib.parse.urlencode(data)
-            DATA=DATA.encode('utf-8')
-        else:
-            DATA=None
-        
-        # Assemble url:
-        url = (
-            "http://{}:{}/{}/{}".format(self.server_name, self.server_port, service_name, call_name)
-            )
-        # Make a Request object and pass it to the server.
-        # Use the returned result to make some JSON to return to our caller
-        req = urllib.request.Request(url, data=DATA, headers=headers)
-        if DATA:
-            req.add_header("Content-Type","application/x-www-form-urlencoded;charset=utf-8")
-        try:
-            with urllib.request.urlopen(req) as response:
-                the_answer = response.read()
-                if the_answer:
-                    the_answer = the_answer.decode('utf-8')
-                    return json.loads(the_answer)
-        except Exception as e:
-            return { 'Exception': e.__repr__() }
+    The request goes over a pooled keep-alive connection to
+    (server_name, server_port) - see utils.http_pool.
+    Pass/Returns: see AsyncMythApi._call_myth_api
+    """
+    def _call_myth_api(self,service_name, call_name, data=None, headers=None, timeout=None):
+        return run_sync(self.aio._call_myth_api(service_name, call_name, data, headers, timeout))
+    
+    """
+    Counts of new and reused connections made to the MythTV API server.
+    """
+    @property
+    def connection_stats(self):
+        return self.http_pool.stats()
         
     """
     Gets list of storage groups available to
@@ -398,8 +1464,7 @@ class MythApi(object):
        Id,  GroupName,  HostName,  DirName
     """
     def _fill_myth_storage_group_list(self):
-        j = self._call_myth_api('Myth', 'GetStorageGroupDirs')
-        return j['StorageGroupDirList']['StorageGroupDirs']
+        return run_sync(self.aio.get_storage_group_dirs())
     
     """
     Pass: Storage group name and host name
@@ -413,6 +1478,54 @@ class MythApi(object):
             if g['GroupName'] == group_name and g['HostName'] == hostname:
                 return g['DirName']
         return None
+
+    """
+    Pass: nothing
+    Return: dict mapping (GroupName, HostName) to DirName, for resolving
+    many storage groups without a scan of storage_groups for each.
+    If a group has several directories on one host, the first is used,
+    as in storage_dir_for_name.
+    """
+    def storage_dir_map(self):
+        dirs = {}
+        for g in self.storage_groups:
+            dirs.setdefault((g['GroupName'], g['HostName']), g['DirName'])
+        return dirs
+
+    """
+    Storage groups that hold things other than TV recordings.
+    """
+    NON_RECORDING_GROUPS = frozenset([ 'Videos', 'Trailers', 'Coverart', 'Fanart',
+                                       'Screenshots', 'Banners', 'Music', 'MusicArt',
+                                       'DB Backups', 'Photographs' ])
+
+    """
+    Return: list of the hosts that have at least one storage group
+    directory that can hold recordings, in the order the backend lists them.
+    """
+    def recording_hosts(self):
+        hosts = []
+        for g in self.storage_groups:
+            if g['GroupName'] not in self.NON_RECORDING_GROUPS and g['HostName'] not in hosts:
+                hosts.append(g['HostName'])
+        return hosts
+
+    """
+    Pass: hostname (optional) - defaults to the backend's name
+    Return: list of the directories, on that host, of every storage
+    group that can hold recordings (Default, LiveTV, and any custom
+    groups), without duplicates.
+    """
+    def recording_directories(self, hostname=None):
+        if hostname is None:
+            hostname = self.server_name
+        dirs = []
+        for g in self.storage_groups:
+            if g['HostName'] == hostname and g['GroupName'] not in self.NON_RECORDING_GROUPS:
+                if g['DirName'] not in dirs:
+                    dirs.append(g['DirName'])
+        return dirs
+    
     
     """
     Pass: Channel id, for example '1008'
@@ -426,12 +1539,26 @@ class MythApi(object):
     api call will return an exception code.
     """
     def get_channel_info(self,channel_id):
-        res_dict = self._call_myth_api('Channel', 'GetChannelInfo',
-                 { 'ChanID': channel_id } )
-        if 'Exception' in res_dict:
-            raise Exception("Problem getting channel info for channel {}: {}".format(channel_id, res_dict['Exception']))
-        else:
-            return res_dict['ChannelInfo']
+        return run_sync(self.aio.get_channel_info(channel_id))
+
+    """
+    Looks up several channels at once, with the calls overlapping.
+    Pass: iterable of channel ids
+    Return: dict of channel info (as from get_channel_info) keyed by channel id.
+    Channels that can't be found are left out.
+    """
+    def get_channel_infos(self, channel_ids):
+        return run_sync(self.aio.get_channel_infos(channel_ids))
+
+    """
+    Fetches info for every channel on the backend in one call.
+    Pass: nothing
+    Return: a list of dicts with the same keys as get_channel_info() returns.
+    Most callers should go through self.channels (a ChannelCatalogue)
+    rather than calling this directly.
+    """
+    def get_channel_info_list(self):
+        return run_sync(self.aio.get_channel_info_list())
     
     """
     Queries the MythAPI server for a list of the tv recordings.
@@ -460,47 +1587,79 @@ class MythApi(object):
       scheduled times, and do not reflect the fact that the recording may have started and/or
       ended at other than the scheduled times.
       
+      This reads the whole list in one response, which can be hundreds of MB
+      on a large backend. Prefer iter_mythtv_recordings().
     """
     def get_mythtv_recording_list(self):
-        res_dict = self._call_myth_api('Dvr', 'GetRecordedList')
-        if 'Exception' in res_dict:
-            raise Exception("Problem getting MythTV recording list: {}".format(res_dict['Exception']))
-        else:
-            return res_dict['ProgramList']['Programs']
+        return run_sync(self.aio.get_mythtv_recording_list())
+
+    """
+    Return: list of the backend's encoders - see AsyncMythApi.get_encoder_list
+    """
+    def get_encoder_list(self):
+        return run_sync(self.aio.get_encoder_list())
+
+    """
+    Return: True if any encoder is busy (recording, or being watched live).
+    """
+    def recording_in_progress(self):
+        return any(int(e.get('State', 0) or 0) != 0 for e in self.get_encoder_list())
+
+    """
+    Generator over the MythTV recordings, fetched page_size at a time
+    with GetRecordedList's StartIndex and Count parameters, so only one
+    page of the API's (bulky) response is in memory at once.
+    Pass: page_size (optional) - defaults to RECORDING_PAGE_SIZE from the config
+    Yields: a RecordingInfo for each recording
+    """
+    def iter_mythtv_recordings(self, page_size=None):
+        if page_size is None:
+            page_size = self.recording_page_size
+        start_index = 0
+        while True:
+            records, total = run_sync(self.aio.get_recorded_page(start_index, page_size))
+            for r in records:
+                yield r
+            start_index += len(records)
+            if len(records) == 0 or start_index >= total:
+                return
     
     
-    def is_tv_recording(self,filename):
+    def is_tv_recording(self, filename, hostname=None):
         """
         Is this filename associated with a MythTV tv recording?
+        If hostname is given, the recording must also live on that host.
+        """
+        return self.recording_index.contains_file(filename, hostname)
+
+    def find_recording(self, filename, hostname=None):
+        """
+        Return: the RecordingInfo for filename, or None if MythTV
+        has no such recording.
         """
-        m = [ p for p in self.tv_recordings if p['FileName'] == filename ]
-        return len(m) > 0
-    
-    def add_to_mythvideo(self, filename, hostname=None):
         if hostname is None:
             hostname = self.server_name
-        res_dict = self._call_myth_api('Video', 'AddVideo',
-                 { 'FileName': filename, 'HostName': hostname} )
-        if 'Exception' in res_dict:
-            raise Exception("Problem adding MythVideo file {}: {}".format(filename, res_dict['Exception']) )
-        else:
-            return 'bool' in res_dict and res_dict['bool'] == 'true'
+        return self.recording_index.find_by_file(filename, hostname)
+
+    def find_recording_by_start(self, channel_id, start_ts):
+        """
+        Return: the RecordingInfo recorded on channel_id starting at
+        start_ts (a StartTs string or a datetime), or None.
+        """
+        return self.recording_index.find_by_channel_start(channel_id, start_ts)
+    
+    def add_to_mythvideo(self, filename, hostname=None):
+        return run_sync(self.aio.add_to_mythvideo(filename, hostname))
         
     def find_in_mythvideo(self, filename):
-        res_dict = self._call_myth_api('Video', 'GetVideoByFileName',
-                 { 'FileName': filename } )
-        if 'Exception' in res_dict:
-            if res_dict['Exception'].getcode() == 500:
-                # probably just no such file
-                return None
-            else:
-                raise Exception("Problem finding MythVideo file {}: {}".format(filename, res_dict['Exception']) )
-        else:
-            return res_dict['VideoMetadataInfo']
+        return run_sync(self.aio.find_in_mythvideo(filename))
+
+    def find_many_in_mythvideo(self, filenames):
+        """
+        find_in_mythvideo for many files, with the calls overlapping.
+        Return: dict of video info (or None) keyed by filename
+        """
+        return run_sync(self.aio.find_many_in_mythvideo(filenames))
 
     def remove_from_mythvideo(self, video_id):
-        res = self._call_myth_api('Video', 'RemoveVideoFromDB', { 'Id': video_id })
-        if 'Exception' in res:
-            raise Exception("Could not remove video with id {}: {}".format(video_id,  res['Exception']))
-        else:
-            return 'bool' in res and res['bool'] == 'true'
+        return run_sync(self.aio.remove_from_mythvideo(video_id))
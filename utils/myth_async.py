@@ -0,0 +1,278 @@
+# Asyncio client for the MythTV Services API.
+import asyncio
+import concurrent.futures
+import functools
+import json
+import threading
+import urllib.parse
+import weakref
+
+from utils.http_pool import get_pool
+
+
+class RecordingInfo(object):
+    """
+    The parts of a Dvr/GetRecordedList program entry that this project
+    uses. The API's entries carry Artwork, VideoProps, the whole Channel
+    subtree and much more; keeping only these fields, in __slots__,
+    makes a cached recording list a small fraction of the size.
+    """
+    __slots__ = ('filename', 'hostname', 'filesize', 'start_ts', 'end_ts', 'storage_group',
+                 'channel_id', 'channel_number', 'channel_name', 'title', 'subtitle')
+
+    def __init__(self, filename, hostname, filesize=0, start_ts='', end_ts='', storage_group='',
+                 channel_id='', channel_number='', channel_name='', title='', subtitle=''):
+        self.filename = filename
+        self.hostname = hostname
+        self.filesize = filesize
+        self.start_ts = start_ts # actual start of recording, ISO format, UTC
+        self.end_ts = end_ts
+        self.storage_group = storage_group
+        self.channel_id = channel_id
+        self.channel_number = channel_number
+        self.channel_name = channel_name
+        self.title = title
+        self.subtitle = subtitle
+
+    @classmethod
+    def from_program(cls, p):
+        """
+        Pass: one program dict from Dvr/GetRecordedList
+        """
+        recording = p.get('Recording', {})
+        channel = p.get('Channel', {})
+        return cls(
+            p['FileName'], p['HostName'],
+            filesize=int(p.get('FileSize', 0) or 0),
+            start_ts=recording.get('StartTs', ''),
+            end_ts=recording.get('EndTs', ''),
+            storage_group=recording.get('StorageGroup', ''),
+            channel_id=str(channel.get('ChanId', '')),
+            channel_number=channel.get('ChanNum', ''),
+            channel_name=channel.get('ChannelName', ''),
+            title=p.get('Title', ''),
+            subtitle=p.get('SubTitle', ''),
+            )
+
+    def __repr__(self):
+        return 'RecordingInfo({!r}, {!r})'.format(self.hostname, self.filename)
+
+
+class AsyncMythApi(object):
+    """
+    Coroutine versions of the MythTV API calls made by utils.myth.MythApi,
+    so that many lookups (channel info, MythVideo searches, ...) can be in
+    flight at once:
+
+        infos = await asyncio.gather(*[ aio.find_in_mythvideo(f) for f in files ])
+
+    No more than 'concurrency' calls run at a time, whatever the number of
+    coroutines waiting. Each call goes over the keep-alive pool for
+    (server_name, server_port), on a worker thread of this client's own.
+    The pool keeps at least 'concurrency' idle connections, so a full wave
+    of calls doesn't close connections only for the next wave to reopen them.
+
+    MythApi is a thin synchronous wrapper around an instance of this class;
+    see run_sync().
+    """
+    def __init__(self, server_name, server_port, concurrency=8, pool_size=4, timeout=30):
+        self.server_name = server_name
+        self.server_port = server_port
+        self.concurrency = max(1, concurrency)
+        self.http_pool = get_pool(server_name, server_port, size=max(pool_size, self.concurrency), timeout=timeout)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        # asyncio.Semaphore is tied to the loop it was made on, so keep one per loop.
+        self._limiters = weakref.WeakKeyDictionary()
+        self._limiters_lock = threading.Lock()
+
+    def _limiter(self, loop):
+        with self._limiters_lock:
+            sem = self._limiters.get(loop)
+            if sem is None:
+                sem = asyncio.Semaphore(self.concurrency)
+                self._limiters[loop] = sem
+            return sem
+
+    def _request(self, service_name, call_name, data=None, headers=None, timeout=None):
+        """
+        Blocking half of _call_myth_api; runs on a worker thread.
+        """
+        headers = dict(headers or {})
+        # Tell server to send back JSON:
+        headers['Accept'] = 'application/json'
+
+        if data:
+            DATA=urllib.parse.urlencode(data)
+            DATA=DATA.encode('utf-8')
+            headers['Content-Type'] = "application/x-www-form-urlencoded;charset=utf-8"
+            method = 'POST'
+        else:
+            DATA=None
+            method = 'GET'
+
+        path = "/{}/{}".format(service_name, call_name)
+        try:
+            status, reason, the_answer = self.http_pool.request(method, path, body=DATA,
+                                                                headers=headers, timeout=timeout)
+        except Exception as e:
+            return { 'Exception': e.__repr__() }
+        if status >= 400:
+            return { 'Exception': 'HTTP Error {}: {} ({})'.format(status, reason, path), 'Status': status }
+        if the_answer:
+            the_answer = the_answer.decode('utf-8')
+            return json.loads(the_answer)
+
+    async def _call_myth_api(self, service_name, call_name, data=None, headers=None, timeout=None):
+        """
+        Make a call to the MythTV API and request JSON back from MythTV server.
+        Pass:
+          * name of API service
+          * name of API call within service
+          * data (optional) - a dict of parameters for the call
+          * headers (optional)
+          * timeout (optional) - seconds, overriding API_TIMEOUT for this call
+        Returns:
+          * A JSON object built from the data returned from the MythTV server.
+            If the call fails, a dict with an 'Exception' key describing the
+            problem, plus a 'Status' key holding the HTTP status code if the
+            server answered with an error.
+        """
+        loop = asyncio.get_event_loop()
+        async with self._limiter(loop):
+            return await loop.run_in_executor(self._executor, functools.partial(
+                self._request, service_name, call_name, data, headers, timeout))
+
+    async def get_storage_group_dirs(self):
+        """
+        Return: list of the backend's storage group directories, each a dict
+        with the keys Id, GroupName, HostName, DirName
+        """
+        j = await self._call_myth_api('Myth', 'GetStorageGroupDirs')
+        if 'Exception' in j:
+            raise Exception("Problem getting storage groups: {}".format(j['Exception']))
+        return j['StorageGroupDirList']['StorageGroupDirs']
+
+    async def get_channel_info(self, channel_id):
+        """
+        Pass: Channel id, for example '1008'
+        Return: the ChannelInfo dict for that channel. See MythApi.get_channel_info.
+        """
+        res_dict = await self._call_myth_api('Channel', 'GetChannelInfo',
+                 { 'ChanID': channel_id } )
+        if 'Exception' in res_dict:
+            raise Exception("Problem getting channel info for channel {}: {}".format(channel_id, res_dict['Exception']))
+        else:
+            return res_dict['ChannelInfo']
+
+    async def get_channel_infos(self, channel_ids):
+        """
+        Looks up several channels concurrently.
+        Return: dict of ChannelInfo keyed by channel id. Channels the
+        backend doesn't know are left out.
+        """
+        channel_ids = list(channel_ids)
+        results = await asyncio.gather(
+            *[ self.get_channel_info(c) for c in channel_ids ], return_exceptions=True)
+        return { str(c): r for c, r in zip(channel_ids, results) if not isinstance(r, Exception) }
+
+    async def get_channel_info_list(self):
+        """
+        Return: a list of ChannelInfo dicts, one per channel on the backend.
+        """
+        res_dict = await self._call_myth_api('Channel', 'GetChannelInfoList',
+                 { 'OnlyVisible': 'false' } )
+        if 'Exception' in res_dict:
+            raise Exception("Problem getting channel list: {}".format(res_dict['Exception']))
+        else:
+            return res_dict['ChannelInfoList']['ChannelInfos']
+
+    async def get_mythtv_recording_list(self):
+        """
+        Return: a list of program dicts, one per recording.
+        See MythApi.get_mythtv_recording_list.
+        """
+        res_dict = await self._call_myth_api('Dvr', 'GetRecordedList')
+        if 'Exception' in res_dict:
+            raise Exception("Problem getting MythTV recording list: {}".format(res_dict['Exception']))
+        else:
+            return res_dict['ProgramList']['Programs']
+
+    async def get_encoder_list(self):
+        """
+        Return: list of Encoder dicts from Dvr/GetEncoderList, one per
+        capture card input, each with (among others) Id, HostName, State
+        and Connected. State is MythTV's TVState: 0 when the encoder is idle.
+        """
+        res_dict = await self._call_myth_api('Dvr', 'GetEncoderList')
+        if 'Exception' in res_dict:
+            raise Exception("Problem getting encoder list: {}".format(res_dict['Exception']))
+        return res_dict['EncoderList']['Encoders']
+
+    async def get_recorded_page(self, start_index, count):
+        """
+        Fetches one page of Dvr/GetRecordedList.
+        Pass: index of the first recording wanted, and how many
+        Return: [ list of RecordingInfo, total number of recordings on the backend ]
+        """
+        res_dict = await self._call_myth_api('Dvr', 'GetRecordedList',
+                 { 'StartIndex': start_index, 'Count': count } )
+        if 'Exception' in res_dict:
+            raise Exception("Problem getting MythTV recording list: {}".format(res_dict['Exception']))
+        program_list = res_dict['ProgramList']
+        records = [ RecordingInfo.from_program(p) for p in program_list['Programs'] ]
+        total = int(program_list.get('TotalAvailable', start_index + len(records)) or 0)
+        return [ records, total ]
+
+    async def add_to_mythvideo(self, filename, hostname=None):
+        if hostname is None:
+            hostname = self.server_name
+        res_dict = await self._call_myth_api('Video', 'AddVideo',
+                 { 'FileName': filename, 'HostName': hostname} )
+        if 'Exception' in res_dict:
+            raise Exception("Problem adding MythVideo file {}: {}".format(filename, res_dict['Exception']) )
+        else:
+            return 'bool' in res_dict and res_dict['bool'] == 'true'
+
+    async def find_in_mythvideo(self, filename):
+        res_dict = await self._call_myth_api('Video', 'GetVideoByFileName',
+                 { 'FileName': filename } )
+        if 'Exception' in res_dict:
+            if res_dict.get('Status') == 500:
+                # probably just no such file
+                return None
+            else:
+                raise Exception("Problem finding MythVideo file {}: {}".format(filename, res_dict['Exception']) )
+        else:
+            return res_dict['VideoMetadataInfo']
+
+    async def find_many_in_mythvideo(self, filenames):
+        """
+        Runs find_in_mythvideo for each file concurrently.
+        Return: dict of VideoMetadataInfo (or None) keyed by filename
+        """
+        filenames = list(filenames)
+        results = await asyncio.gather(*[ self.find_in_mythvideo(f) for f in filenames ])
+        return dict(zip(filenames, results))
+
+    async def remove_from_mythvideo(self, video_id):
+        res = await self._call_myth_api('Video', 'RemoveVideoFromDB', { 'Id': video_id })
+        if 'Exception' in res:
+            raise Exception("Could not remove video with id {}: {}".format(video_id,  res['Exception']))
+        else:
+            return 'bool' in res and res['bool'] == 'true'
+
+
+_thread_loops = threading.local()
+
+def run_sync(coro):
+    """
+    Runs a coroutine to completion on this thread's own event loop
+    (created on first use) and returns its result. Lets synchronous
+    code - Django views, site_init.py - call AsyncMythApi methods.
+    Must not be called from inside a running event loop.
+    """
+    loop = getattr(_thread_loops, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_loops.loop = loop
+    return loop.run_until_complete(coro)
@@ -0,0 +1,203 @@
+# Keeping VIDEO_SAMPLES_DIR within its disk quota.
+import os
+import os.path
+
+from django.db import transaction
+from django.utils import timezone
+
+from orphans.models import Orphan, PreviewJob
+from utils.config import get_config
+from utils.scanner import mythtv_filename_pattern
+
+TEMP_PREFIX = '.part-' # files still being written - see VideoSampleMaker
+
+
+def is_preview_name(name, config=None):
+    """
+    Return: True if name is one VideoSampleMaker could have given a
+    preview: a MythTV recording's base name, then a sprite sheet's
+    '.sprite.<format>' or an encoder profile's extension
+    """
+    if not mythtv_filename_pattern.match(name):
+        return False
+    base, sep, ext = name.partition('.')
+    if ext.startswith('sprite.'):
+        return True
+    config = config or get_config()
+    return ext in { e for e, args in config.encoder_profiles.values() }
+
+def remove_sample_files(sample_names, outdir=None):
+    """
+    Deletes the named files from VIDEO_SAMPLES_DIR, if they are there.
+    Return: number of bytes freed
+    """
+    if outdir is None:
+        outdir = get_config().video_samples_dir
+    freed = 0
+    for name in sample_names:
+        filespec = os.path.join(outdir, name)
+        try:
+            size = os.path.getsize(filespec)
+            os.remove(filespec)
+        except FileNotFoundError:
+            continue
+        freed += size
+    return freed
+
+def remove_previews_for(orphan_ids, batch_size=500):
+    """
+    Deletes the preview files of the given orphans, which are about to be
+    deleted or have been promoted to MythVideo. Their PreviewJob rows go
+    when the orphans do.
+    Return: number of bytes freed
+    """
+    orphan_ids = list(orphan_ids)
+    names = []
+    for i in range(0, len(orphan_ids), batch_size):
+        names.extend(PreviewJob.objects.filter(orphan_id__in=orphan_ids[i:i+batch_size])
+                     .values_list('sample_name', flat=True))
+    return remove_sample_files(names)
+
+def mark_viewed(orphan_ids, profile=None, requeue=True):
+    """
+    Records that the previews of these orphans were just shown to someone.
+    Pass:
+      * profile (optional) - only mark previews of this kind (see
+        VideoSampleMaker.MODES), e.g. 'sprite' for the list page, which
+        shows nothing else
+      * requeue - if True, evicted previews go back in the queue, to be
+        made again on the next run. Pages that merely list orphans pass
+        False, or paging through them would undo every eviction.
+    """
+    orphan_ids = list(orphan_ids)
+    if not orphan_ids:
+        return
+    jobs = PreviewJob.objects.filter(orphan_id__in=orphan_ids)
+    if profile is not None:
+        jobs = jobs.filter(profile=profile)
+    jobs.exclude(state=PreviewJob.EVICTED).update(last_viewed=timezone.now())
+    if requeue:
+        jobs.filter(state=PreviewJob.EVICTED).update(state=PreviewJob.PENDING, last_viewed=timezone.now())
+
+def relink_preview_jobs(jobs, batch_size=500):
+    """
+    Saves PreviewJobs again after the orphans table has been rebuilt (see
+    utils.myth.initialize_orphans_list): deleting the orphans cascades to
+    their jobs, but the preview files are still there, and still good.
+    Each job is attached to the new Orphan for the same recording,
+    matched by base name, and keeps its state - so done samples are not
+    made again.
+    Pass: PreviewJob instances read before the orphans were deleted
+    Return: the jobs whose recording has no Orphan any more
+    """
+    by_base = {}
+    for job in jobs:
+        by_base.setdefault(job.sample_name.split('.')[0], []).append(job)
+    relinked = []
+    for intid, filename in Orphan.objects.values_list('intid', 'filename').iterator():
+        for job in by_base.pop(os.path.splitext(filename)[0], ()):
+            job.orphan_id = intid
+            relinked.append(job)
+    PreviewJob.objects.bulk_create(relinked, batch_size=batch_size)
+    return [ job for unmatched in by_base.values() for job in unmatched ]
+
+
+class SampleCache(object):
+    """
+    Manages VIDEO_SAMPLES_DIR as a cache of previews:
+        * files that belong to no orphan (the orphan was deleted, promoted
+          by new_video_from_orphan, or dropped by a rescan) are removed
+        * if the directory holds more than SAMPLES_QUOTA_MB, previews are
+          evicted, least recently viewed first (never-viewed ones before
+          any that have been viewed, oldest first), until it fits.
+          Their jobs are marked 'evicted', so they aren't simply made again;
+          viewing the orphan queues them up again (see mark_viewed).
+    """
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.outdir = self.config.video_samples_dir
+        self.quota = self.config.samples_quota_mb * 1024 * 1024
+
+    def scan(self):
+        """
+        Return: dict of file name to size, for everything in VIDEO_SAMPLES_DIR
+        """
+        files = {}
+        try:
+            with os.scandir(self.outdir) as it:
+                for entry in it:
+                    if entry.is_file():
+                        files[entry.name] = entry.stat().st_size
+        except FileNotFoundError:
+            pass
+        return files
+
+    def sweep_unowned(self, files=None):
+        """
+        Removes previews whose orphan no longer exists. Only names that
+        could be previews (see is_preview_name) are considered; anything
+        else kept in VIDEO_SAMPLES_DIR is left alone.
+        Return: list of the names removed
+        """
+        if files is None:
+            files = self.scan()
+        candidates = { n for n in files if is_preview_name(n, self.config) }
+        if not candidates:
+            return []
+        owned = set(PreviewJob.objects.values_list('sample_name', flat=True).iterator())
+        candidates -= owned
+        if candidates:
+            # Not in the manifest, but still a live orphan's - reconcile_manifest will record it
+            bases = { os.path.splitext(f)[0] for f in
+                      Orphan.objects.values_list('filename', flat=True).iterator() }
+            candidates = { n for n in candidates if n.split('.')[0] not in bases }
+        removed = sorted(candidates)
+        remove_sample_files(removed, self.outdir)
+        for name in removed:
+            files.pop(name, None)
+        return removed
+
+    def enforce_quota(self, files=None):
+        """
+        Evicts least recently viewed previews until VIDEO_SAMPLES_DIR is
+        within SAMPLES_QUOTA_MB. Does nothing if there is no quota.
+        Return: [ number of previews evicted, bytes freed ]
+        """
+        if self.quota <= 0:
+            return [ 0, 0 ]
+        if files is None:
+            files = self.scan()
+        used = sum(files.values())
+        evicted = []
+        freed = 0
+        if used > self.quota:
+            # SQLite sorts NULLs first, so never-viewed previews go before viewed ones
+            done = PreviewJob.objects.filter(state=PreviewJob.DONE) \
+                                     .order_by('last_viewed', 'finished') \
+                                     .values_list('intid', 'sample_name').iterator()
+            for intid, name in done:
+                if used - freed <= self.quota:
+                    break
+                size = files.get(name)
+                if size is None:
+                    continue
+                freed += remove_sample_files([ name ], self.outdir)
+                evicted.append(intid)
+        with transaction.atomic(using=PreviewJob.db_name()):
+            for i in range(0, len(evicted), 500):
+                PreviewJob.objects.filter(pk__in=evicted[i:i+500]).update(state=PreviewJob.EVICTED, output_size=0)
+        return [ len(evicted), freed ]
+
+    def run(self):
+        """
+        Sweeps, then enforces the quota.
+        Return: dict with removed (count of unowned previews removed),
+        evicted, bytes_freed and bytes_used
+        """
+        files = self.scan()
+        before = sum(files.values())
+        removed = self.sweep_unowned(files)
+        evicted, freed = self.enforce_quota(files)
+        after = sum(files.values()) - freed
+        return { 'removed': len(removed), 'evicted': evicted,
+                 'bytes_freed': before - after, 'bytes_used': after }
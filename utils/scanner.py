@@ -0,0 +1,170 @@
+# Fast directory scanning for recording files.
+import fnmatch
+import os
+import os.path
+import queue
+import re
+import stat
+import threading
+
+from utils.general import open_sftp, ssh_session
+
+# Start of a MythTV recording's file name: <chanid>_<YYYYMMDDHHMMSS>.
+mythtv_filename_pattern = re.compile('\d{4}_\d{14}\.')
+
+def name_matches(filename, filename_pattern):
+    """
+    Return: True if filename matches filename_pattern the way glob would
+    match it - case-sensitively, and never for hidden files.
+    """
+    return not filename.startswith('.') and fnmatch.fnmatchcase(filename, filename_pattern)
+
+
+def scan_directory(directory, filename_pattern):
+    """
+    Generator over the regular files in one directory whose names match
+    filename_pattern (a glob-style pattern such as '*.mpg'). As with glob,
+    hidden files (names starting with '.') never match.
+    Uses os.scandir, so the name filtering needs no syscalls and each
+    matching file costs a single stat, reused for its size, mtime and type.
+    Yields: [ directory, filename, os.stat_result ]
+    """
+    directory = directory.rstrip(os.sep) or os.sep
+    try:
+        it = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with it:
+        for entry in it:
+            if not name_matches(entry.name, filename_pattern):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue # deleted while we were looking
+            if stat.S_ISREG(st.st_mode): # don't bother with directories
+                yield [ directory, entry.name, st ]
+
+
+def unique_directories(directories):
+    """
+    Drops directories that are the same place on disk as one already
+    listed (by way of symlinks, bind mounts, or being listed twice),
+    and ones that don't exist.
+    Return: list of directories, in their original order
+    """
+    seen = set()
+    result = []
+    for d in directories:
+        try:
+            st = os.stat(d)
+        except OSError:
+            continue
+        key = (st.st_dev, st.st_ino)
+        if key not in seen:
+            seen.add(key)
+            result.append(d)
+    return result
+
+
+_DONE = object()
+
+def merge_generators(generators):
+    """
+    Runs each generator on a thread of its own and yields their items,
+    in whatever order they arrive, until all are exhausted.
+    Raises: whatever a generator raised, once the others have finished
+    """
+    generators = list(generators)
+    if len(generators) == 1:
+        for item in generators[0]:
+            yield item
+        return
+    results = queue.Queue(maxsize=10000)
+    errors = []
+
+    def worker(gen):
+        try:
+            for item in gen:
+                results.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            results.put(_DONE)
+
+    threads = [ threading.Thread(target=worker, args=(g,), daemon=True) for g in generators ]
+    for t in threads:
+        t.start()
+    running = len(threads)
+    while running > 0:
+        item = results.get()
+        if item is _DONE:
+            running -= 1
+        else:
+            yield item
+    if errors:
+        raise errors[0]
+
+def scan_directories(directories, filename_pattern):
+    """
+    Scans several directories at once, one thread per directory, so that
+    directories on different disks are read in parallel. Results are
+    yielded as soon as any thread produces them, so callers can start
+    work on the first files while the rest are still being listed.
+    Yields: [ directory, filename, os.stat_result ], as scan_directory does
+    Raises: whatever a scanning thread raised, once the others have finished
+    """
+    directories = unique_directories(directories)
+    return merge_generators(scan_directory(d, filename_pattern) for d in directories)
+
+
+def scan_remote_directories(hostname, directories, filename_pattern):
+    """
+    Lists directories on another host over a single SFTP channel, on one
+    pooled SSH connection (see utils.general.ssh_session). The SFTP
+    directory listing carries each file's size, mtime and mode, so no
+    per-file round trips are needed.
+    Yields: [ directory, filename, attributes ] for each matching regular
+    file. attributes is a paramiko SFTPAttributes, which has the st_size,
+    st_mtime and st_mode fields of an os.stat_result.
+    """
+    with ssh_session(hostname) as client:
+        sftp = open_sftp(client)
+        try:
+            for directory in directories:
+                directory = directory.rstrip('/') or '/'
+                try:
+                    entries = sftp.listdir_attr(directory)
+                except IOError:
+                    continue # no such directory on that host
+                for attrs in entries:
+                    if not name_matches(attrs.filename, filename_pattern):
+                        continue
+                    if attrs.st_mode is not None and stat.S_ISREG(attrs.st_mode):
+                        yield [ directory, attrs.filename, attrs ]
+        finally:
+            sftp.close()
+
+
+def _tag_with_host(hostname, gen):
+    for item in gen:
+        yield [ hostname ] + item
+
+def scan_hosts(targets, filename_pattern):
+    """
+    Scans recording directories on several hosts concurrently.
+    Pass:
+      * targets - list of [ hostname, list of directories, is_local ].
+        Local targets are read with scan_directories; the rest over
+        SFTP with scan_remote_directories.
+      * filename_pattern
+    Yields: [ hostname, directory, filename, stat result ]
+    """
+    gens = []
+    for hostname, directories, is_local in targets:
+        if is_local:
+            gen = scan_directories(directories, filename_pattern)
+        else:
+            gen = scan_remote_directories(hostname, directories, filename_pattern)
+        gens.append(_tag_with_host(hostname, gen))
+    return merge_generators(gens)
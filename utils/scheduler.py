@@ -0,0 +1,129 @@
+# Deciding how many preview conversions may run without hurting recordings.
+import os
+import shutil
+import time
+
+
+def read_cpu_times():
+    """
+    Return: [ iowait, total ] jiffies from the 'cpu' line of /proc/stat,
+    or None where there is no /proc/stat
+    """
+    try:
+        with open('/proc/stat') as f:
+            fields = f.readline().split()
+    except OSError:
+        return None
+    values = [ int(v) for v in fields[1:] ]
+    return [ values[4] if len(values) > 4 else 0, sum(values) ]
+
+
+class LoadAwareScheduler(object):
+    """
+    Tells VideoSampleMaker how many conversions it may have running,
+    so that previews made on the MythTV backend itself don't take the
+    CPU or disk a recording needs:
+        * none while a recording is in progress (PAUSE_WHILE_RECORDING),
+          or while VIDEO_SAMPLES_DIR has less than MIN_FREE_MB free
+        * fewer than PREVIEW_WORKERS while the load average per CPU is
+          over MAX_LOAD_PER_CPU, and half as many again while the share
+          of CPU time spent waiting on I/O is over MAX_IOWAIT_PERCENT
+    Conversions already running are left to finish; it's new ones that
+    are held back. Each one runs under nice and ionice (see wrap).
+
+    The checks are made at most once every check_interval seconds.
+    """
+    def __init__(self, config, api=None, check_interval=15):
+        self.config = config
+        self.api = api
+        self.check_interval = check_interval
+        self.checked_at = 0
+        self.allowed = None
+        self.reason = ''
+        self.low_disk = False # True while paused for lack of free space
+        self._cpu_times = read_cpu_times()
+        self._ionice = shutil.which('ionice')
+        self._nice = shutil.which('nice')
+
+    def wrap(self, cmd):
+        """
+        Return: cmd, prefixed so that it runs at PREVIEW_NICE and in
+        ionice class PREVIEW_IONICE_CLASS, level PREVIEW_IONICE_LEVEL.
+        Both nice and ionice exec the command, so the pid is still that
+        of the converter.
+        """
+        prefix = []
+        if self._nice and self.config.preview_nice:
+            prefix += [ self._nice, '-n', str(self.config.preview_nice) ]
+        if self._ionice and self.config.preview_ionice_class:
+            prefix += [ self._ionice, '-c', str(self.config.preview_ionice_class) ]
+            if self.config.preview_ionice_class in (1, 2): # only these classes have levels
+                prefix += [ '-n', str(self.config.preview_ionice_level) ]
+        return prefix + list(cmd)
+
+    def iowait_percent(self):
+        """
+        Return: percentage of CPU time spent waiting on I/O since the last call
+        """
+        now = read_cpu_times()
+        before, self._cpu_times = self._cpu_times, now
+        if now is None or before is None or now[1] <= before[1]:
+            return 0.0
+        return 100.0 * (now[0] - before[0]) / (now[1] - before[1])
+
+    def load_per_cpu(self):
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except OSError:
+            return 0.0
+
+    def free_mb(self):
+        try:
+            return shutil.disk_usage(self.config.video_samples_dir).free / (1024 * 1024)
+        except OSError:
+            return None
+
+    def recording(self):
+        """
+        Return: True if MythTV says a recording is in progress. If the
+        backend can't be asked, conversions aren't held up on its account.
+        """
+        if self.api is None or not self.config.pause_while_recording:
+            return False
+        try:
+            return self.api.recording_in_progress()
+        except Exception:
+            return False
+
+    def allowed_workers(self, workers):
+        """
+        Pass: the most conversions that may ever run at once
+        Return: how many may run now (0 means pause). self.reason says why,
+        if it is fewer than workers.
+        """
+        now = time.time()
+        if self.allowed is not None and now - self.checked_at < self.check_interval:
+            return min(self.allowed, workers)
+        self.checked_at = now
+        allowed = workers
+        reasons = []
+        free = self.free_mb()
+        self.low_disk = free is not None and free < self.config.min_free_mb
+        if self.low_disk:
+            allowed = 0
+            reasons.append('only {:.0f} MB free for samples'.format(free))
+        elif self.recording():
+            allowed = 0
+            reasons.append('a recording is in progress')
+        else:
+            load = self.load_per_cpu()
+            if load > self.config.max_load_per_cpu:
+                allowed = max(1, int(workers * self.config.max_load_per_cpu / load))
+                reasons.append('load {:.2f} per CPU'.format(load))
+            iowait = self.iowait_percent()
+            if iowait > self.config.max_iowait_percent:
+                allowed = max(1, allowed // 2)
+                reasons.append('{:.0f}% iowait'.format(iowait))
+        self.allowed = allowed
+        self.reason = ', '.join(reasons)
+        return min(allowed, workers)
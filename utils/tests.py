@@ -1,3 +1,338 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import os
+import os.path
+import shutil
+import tempfile
+import types
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from orphans.models import Orphan, PreviewJob
+from tvrecordings.models import TvRecording
+from utils.config import MtvConfig
+from utils.conversion_progress import ConversionProgress
+from utils.date_and_time import duration_to_seconds
+from utils.filemove import copy_file
+from utils.myth import sync_tvrecordings_list, tvrecording_from_recording_info
+from utils.myth_async import RecordingInfo
+from utils.sample_cache import SampleCache
 
 # Create your tests here.
+
+STORAGE_DIRS = { ('Default', 'mythbox'): '/var/lib/mythtv/recordings' }
+
+def make_recording(chanid, start, title='News', **kwargs):
+    """
+    Return: a RecordingInfo for an hour-long recording starting at start
+    (an ISO UTC time, e.g. '2015-11-22T18:00:00Z')
+    """
+    fields = dict(filesize=1000, start_ts=start, end_ts=start.replace('T18', 'T19'),
+                  storage_group='Default', channel_id=chanid, channel_number='8',
+                  channel_name='WXYZ', title=title, subtitle='')
+    fields.update(kwargs)
+    filename = '{}_{}.mpg'.format(chanid, start.replace('-', '').replace('T', '').replace(':', '').rstrip('Z'))
+    return RecordingInfo(filename, 'mythbox', **fields)
+
+
+class FakeMythApi(object):
+    def __init__(self, recordings):
+        self.recordings = recordings
+
+    def storage_dir_map(self):
+        return STORAGE_DIRS
+
+    def iter_mythtv_recordings(self):
+        return iter(self.recordings)
+
+
+class SyncTvRecordingsListTest(TestCase):
+
+    def save(self, rec, **changes):
+        r = tvrecording_from_recording_info(rec, STORAGE_DIRS)
+        for field, value in changes.items():
+            setattr(r, field, value)
+        r.save()
+        return r
+
+    def sync(self, recordings):
+        with mock.patch('utils.myth.MythApi', return_value=FakeMythApi(recordings)):
+            return sync_tvrecordings_list(batch_size=2)
+
+    def test_inserts_into_empty_table(self):
+        recordings = [ make_recording('1008', '2015-11-22T18:00:00Z'),
+                       make_recording('1009', '2015-11-22T18:00:00Z') ]
+        counts = self.sync(recordings)
+        self.assertEqual(counts, { 'inserted': 2, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'total': 2 })
+        r = TvRecording.objects.get(channel_id='1009')
+        self.assertEqual([ r.directory, r.duration, r.channel_number ], [ '/var/lib/mythtv/recordings', 60, 8 ])
+
+    def test_updates_and_deletes_existing_rows(self):
+        same = make_recording('1008', '2015-11-22T18:00:00Z')
+        retitled = make_recording('1008', '2015-11-23T18:00:00Z', title='Late News')
+        gone = make_recording('1008', '2015-11-24T18:00:00Z')
+        new = make_recording('1009', '2015-11-22T18:00:00Z')
+        self.save(same)
+        kept = self.save(retitled, title='News')
+        self.save(gone)
+
+        counts = self.sync([ same, retitled, new, same ]) # same is listed twice
+
+        self.assertEqual(counts, { 'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1, 'total': 3 })
+        self.assertEqual(TvRecording.objects.count(), 3)
+        self.assertEqual(TvRecording.objects.get(pk=kept.intid).title, 'Late News')
+        self.assertFalse(TvRecording.objects.filter(filename=gone.filename).exists())
+
+    def test_empty_backend_deletes_everything(self):
+        self.save(make_recording('1008', '2015-11-22T18:00:00Z'))
+        counts = self.sync([])
+        self.assertEqual(counts['deleted'], 1)
+        self.assertEqual(TvRecording.objects.count(), 0)
+
+
+class CopyFileTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.source = os.path.join(self.dir, 'source.mpg')
+        self.target = os.path.join(self.dir, 'target.mpg')
+        self.data = os.urandom(100000)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+
+    def test_copies_data_and_checksum(self):
+        p = copy_file(self.source, self.target, buffer_size=4096)
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(p.checksum, hashlib.blake2b(self.data).hexdigest())
+        self.assertEqual(p.copied, len(self.data))
+
+    def test_verify_passes_for_good_copy(self):
+        p = copy_file(self.source, self.target, checksum='sha256', verify=True)
+        self.assertEqual(p.checksum, hashlib.sha256(self.data).hexdigest())
+
+    def test_verify_without_checksum_uses_default(self):
+        p = copy_file(self.source, self.target, checksum=None, verify=True)
+        self.assertEqual(p.checksum, hashlib.blake2b(self.data).hexdigest())
+
+    def test_verify_mismatch_removes_target(self):
+        with mock.patch('utils.filemove.file_checksum', return_value='not the checksum'):
+            with self.assertRaises(Exception):
+                copy_file(self.source, self.target, verify=True)
+        self.assertFalse(os.path.exists(self.target))
+
+    def test_partial_target_removed_on_failure(self):
+        def fail(progress):
+            if progress.copied < len(self.data):
+                raise IOError('disk full')
+        with self.assertRaises(IOError):
+            copy_file(self.source, self.target, progress=fail, buffer_size=4096)
+        self.assertFalse(os.path.exists(self.target))
+
+
+class ConversionProgressTest(SimpleTestCase):
+
+    def feed_block(self, p, stream=0, progress='continue', **values):
+        for key, value in values.items():
+            p.feed('{}={}\n'.format(key, value), stream)
+        p.feed('progress={}\n'.format(progress), stream)
+
+    def test_values_before_first_frame_are_zero(self):
+        p = ConversionProgress('x', total=60)
+        self.feed_block(p, out_time_us='N/A', fps='N/A', speed='N/A')
+        self.assertEqual([ p.position, p.fps, p.speed ], [ 0.0, 0.0, 0.0 ])
+        self.assertIsNone(p.eta)
+
+    def test_block_applied_only_when_complete(self):
+        p = ConversionProgress('x', total=60)
+        p.feed('out_time_us=5000000')
+        self.assertEqual(p.position, 0.0)
+        p.feed('progress=continue')
+        self.assertEqual(p.position, 5.0)
+
+    def test_old_out_time_ms_is_microseconds(self):
+        p = ConversionProgress('x')
+        self.feed_block(p, out_time_ms='2500000', speed='1.5x')
+        self.assertEqual([ p.position, p.speed ], [ 2.5, 1.5 ])
+
+    def test_streams_are_summed(self):
+        updates = []
+        p = ConversionProgress('x', total=100, on_update=updates.append)
+        self.feed_block(p, stream=0, out_time_us='10000000', fps='30', speed='2x')
+        self.feed_block(p, stream=1, out_time_us='20000000', fps='20', speed='3x')
+        self.assertEqual([ p.position, p.fps, p.speed ], [ 30.0, 50.0, 5.0 ])
+        self.assertEqual(p.eta, 14.0)
+        self.assertEqual(len(updates), 2)
+
+    def test_end_stops_stream_speed(self):
+        p = ConversionProgress('x', total=100)
+        self.feed_block(p, stream=0, out_time_us='50000000', speed='2x', progress='end')
+        self.feed_block(p, stream=1, out_time_us='10000000', speed='4x')
+        self.assertEqual(p.position, 60.0)
+        self.assertEqual(p.speed, 4.0)
+
+
+class DurationToSecondsTest(SimpleTestCase):
+
+    def test_formats(self):
+        self.assertEqual(duration_to_seconds('600'), 600.0)
+        self.assertEqual(duration_to_seconds('90.5'), 90.5)
+        self.assertEqual(duration_to_seconds(45), 45.0)
+        self.assertEqual(duration_to_seconds('10:30'), 630.0)
+        self.assertEqual(duration_to_seconds('00:10:00'), 600.0)
+        self.assertEqual(duration_to_seconds(' 01:00:01.5 '), 3601.5)
+
+    def test_rejects_garbage(self):
+        with self.assertRaises(ValueError):
+            duration_to_seconds('ten minutes')
+
+
+class MtvConfigTest(SimpleTestCase):
+
+    REQUIRED = '''
+[SECURITY]
+SECRET_KEY = s3cret
+[DB]
+DEFAULT_DB_ENGINE = django.db.backends.sqlite3
+DEFAULT_DB_NAME = db.sqlite3
+[MYTHTV_CONTENT]
+MYTHBACKEND = mythbox
+TV_RECORDINGS_DIR = /var/lib/mythtv/recordings
+VIDEO_SAMPLES_DIR = /tmp/vidsamples
+VIDCONVERTER = /usr/bin/ffmpeg
+'''
+
+    def config_from(self, text):
+        fd, filespec = tempfile.mkstemp(suffix='.cfg')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        self.addCleanup(os.remove, filespec)
+        return MtvConfig(filespec)
+
+    def test_missing_file(self):
+        with self.assertRaisesRegex(Exception, 'Could not find config file'):
+            MtvConfig(os.path.join(tempfile.gettempdir(), 'no-such-mtv-settings.cfg'))
+
+    def test_missing_required_option(self):
+        text = self.REQUIRED.replace('MYTHBACKEND = mythbox\n', '')
+        with self.assertRaisesRegex(Exception, 'MYTHTV_CONTENT/MYTHBACKEND: .*missing'):
+            self.config_from(text)
+
+    def test_typed_values_and_defaults(self):
+        config = self.config_from(self.REQUIRED + 'API_PORT = 7000\nCOPY_VERIFY = yes\nMAX_LOAD_PER_CPU = 1.5\n')
+        self.assertEqual(config.api_port, 7000)
+        self.assertIs(config.copy_verify, True)
+        self.assertEqual(config.max_load_per_cpu, 1.5)
+        self.assertEqual(config.preview_duration, '00:10:00')
+        self.assertIs(config.debug, False)
+
+    def test_relative_paths_are_under_base_dir(self):
+        config = self.config_from(self.REQUIRED)
+        self.assertTrue(os.path.isabs(config.default_db_name))
+        self.assertEqual(os.path.basename(config.default_db_name), 'db.sqlite3')
+        self.assertEqual(config.video_samples_dir, '/tmp/vidsamples')
+
+    def test_bad_value_is_reported(self):
+        with self.assertRaisesRegex(Exception, 'MYTHTV_CONTENT/API_PORT'):
+            self.config_from(self.REQUIRED + 'API_PORT = lots\n')
+
+    def test_builtin_encoder_profile(self):
+        config = self.config_from(self.REQUIRED + 'PREVIEW_QUALITY = 7\n')
+        self.assertEqual(config.encoder_profile(),
+                         [ 'ogv', [ '-acodec', 'libvorbis', '-vcodec', 'libtheora', '-qscale:v', '7' ] ])
+
+    def test_encoder_profiles_section_overrides_and_adds(self):
+        config = self.config_from(self.REQUIRED + 'PREVIEW_ENCODER = vp9\n'
+                                  '[ENCODER_PROFILES]\n'
+                                  'vp9 = .webm, -c:v libvpx-vp9 -crf {quality}\n'
+                                  'h264 = mkv, -c:v libx264 -preset veryfast\n')
+        self.assertEqual(config.encoder_profile(), [ 'webm', [ '-c:v', 'libvpx-vp9', '-crf', '5' ] ])
+        self.assertEqual(config.encoder_profile('h264'), [ 'mkv', [ '-c:v', 'libx264', '-preset', 'veryfast' ] ])
+        self.assertIn('theora', config.encoder_profiles)
+
+    def test_unknown_encoder_is_reported(self):
+        with self.assertRaisesRegex(Exception, 'PREVIEW_ENCODER: no profile named av1'):
+            self.config_from(self.REQUIRED + 'PREVIEW_ENCODER = av1\n')
+
+
+class SampleCacheTest(TestCase):
+
+    SIZE = 300 * 1024 # five of these are over a 1 MB quota; three are under it
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.config = types.SimpleNamespace(video_samples_dir=self.dir, samples_quota_mb=1,
+                                            encoder_profiles={ 'theora': [ 'ogv', '' ], 'vp8': [ 'webm', '' ] })
+
+    def write_file(self, name, size=None):
+        with open(os.path.join(self.dir, name), 'wb') as f:
+            f.write(b'\0' * (self.SIZE if size is None else size))
+
+    def make_sample(self, stamp, viewed_days_ago=None, finished_days_ago=10):
+        """
+        Saves an Orphan and a done PreviewJob for it, and writes its file.
+        Return: the sample's name
+        """
+        filename = '1008_{}.mpg'.format(stamp)
+        o = Orphan.objects.create(hostname='mythbox', directory='/var/lib/mythtv/recordings', filename=filename,
+                                  start_date=datetime.date(2015, 11, 22), start_time=datetime.time(18, 0),
+                                  channel_id='1008', channel_number=8, channel_name='WXYZ')
+        name = '1008_{}.ogv'.format(stamp)
+        now = timezone.now()
+        PreviewJob.objects.create(orphan=o, sample_name=name, state=PreviewJob.DONE, output_size=self.SIZE,
+                                  finished=now - datetime.timedelta(days=finished_days_ago),
+                                  last_viewed=None if viewed_days_ago is None
+                                              else now - datetime.timedelta(days=viewed_days_ago))
+        self.write_file(name)
+        return name
+
+    def test_quota_evicts_never_viewed_then_least_recently_viewed(self):
+        recent = self.make_sample('20151122180003', viewed_days_ago=1)
+        oldest_view = self.make_sample('20151123180003', viewed_days_ago=30)
+        never = self.make_sample('20151124180003', viewed_days_ago=None)
+        middle = self.make_sample('20151125180003', viewed_days_ago=10)
+        latest = self.make_sample('20151126180003', viewed_days_ago=0)
+
+        stats = SampleCache(self.config).run()
+
+        self.assertEqual(stats['evicted'], 2)
+        self.assertEqual(stats['bytes_freed'], 2 * self.SIZE)
+        self.assertEqual(stats['bytes_used'], 3 * self.SIZE)
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted([ recent, middle, latest ]))
+        evicted = PreviewJob.objects.filter(state=PreviewJob.EVICTED)
+        self.assertEqual(sorted(evicted.values_list('sample_name', flat=True)), sorted([ never, oldest_view ]))
+
+    def test_never_viewed_go_oldest_first(self):
+        self.make_sample('20151122180003', finished_days_ago=5)
+        older = self.make_sample('20151123180003', finished_days_ago=20)
+        self.make_sample('20151124180003', viewed_days_ago=30)
+        self.make_sample('20151125180003', viewed_days_ago=1)
+        self.assertEqual(SampleCache(self.config).enforce_quota(), [ 1, self.SIZE ])
+        self.assertEqual(list(PreviewJob.objects.filter(state=PreviewJob.EVICTED)
+                              .values_list('sample_name', flat=True)), [ older ])
+
+    def test_no_quota_evicts_nothing(self):
+        for stamp in [ '20151122180003', '20151123180003', '20151124180003', '20151125180003' ]:
+            self.make_sample(stamp)
+        self.config.samples_quota_mb = 0
+        self.assertEqual(SampleCache(self.config).enforce_quota(), [ 0, 0 ])
+        self.assertEqual(len(os.listdir(self.dir)), 4)
+
+    def test_sweep_removes_only_unowned_previews(self):
+        owned = self.make_sample('20151122180003')
+        # a live orphan's file, not yet in the manifest - reconcile_manifest will record it
+        live_untracked = '1008_20151122180003.sprite.jpg'
+        keep = [ owned, live_untracked, '.hidden', 'notes.txt', '.part-1008_20151123180003.ogv',
+                 '1008_20151123180003.mkv' ] # not an extension of any profile
+        gone = [ '1008_20151123180003.ogv', '1008_20151123180003.webm', '1008_20151123180003.sprite.jpg' ]
+        for name in keep[1:] + gone:
+            self.write_file(name, 10)
+
+        removed = SampleCache(self.config).sweep_unowned()
+
+        self.assertEqual(sorted(removed), sorted(gone))
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted(keep))